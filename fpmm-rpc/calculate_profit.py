@@ -1,17 +1,16 @@
-from pymongo import MongoClient
+from rpc_client import get_mongo_client
 from pprint import pprint
 import csv
 from collections import defaultdict
+from bson.decimal128 import Decimal128
 
 
 def main():
     # Connect to MongoDB
-    client_polymarket = MongoClient("mongodb://localhost:27017/")
+    client_polymarket = get_mongo_client()
     db_polymarket = client_polymarket["polygon_polymarket"]
 
-    client_orderbook = MongoClient(
-        "mongodb://localhost:27017/"
-    )  # Assuming same instance, different DB
+    client_orderbook = get_mongo_client()  # Same instance, different DB
     db_orderbook = client_orderbook["the-graph-polymarket-orderbook"]
 
     # pnl is a dictionary: pnl[fpmm_address_str][lp_address_str] = profit_loss_value
@@ -100,6 +99,9 @@ def main():
 
             for i, outcome in enumerate(outcomes):
                 try:
+                    # Payouts are stored as Decimal128, which float() rejects
+                    if isinstance(outcome, Decimal128):
+                        outcome = outcome.to_decimal()
                     multiplier = float(outcome)
                 except (ValueError, TypeError):
                     multiplier = 0.0  # fallback if outcome is not a valid number
@@ -1,12 +1,12 @@
 from math import log
+import logging
 import time
 import warnings
-from pymongo import MongoClient, UpdateOne
+from pymongo import UpdateOne
 from web3 import Web3
-from web3.middleware import ExtraDataToPOAMiddleware
 from pprint import pp, pprint
-from web3.logs import STRICT, IGNORE, DISCARD, WARN
 import os
+import sys
 
 # import ctfabi.json
 import json
@@ -16,60 +16,29 @@ from tqdm import tqdm
 from collections import defaultdict
 from dotenv import load_dotenv
 
-# w3 = Web3(Web3.HTTPProvider("https://polygon-rpc.com"))
-load_dotenv()
-POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
-
-w31 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w31")}")
-)
-
-w32 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w32")}")
-)
-
-w33 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w33")}")
+# utils.schema lives with the subgraph ingestion utils
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "the-graph")
 )
 
-w34 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w34")}")
+from rpc_client import (
+    RPC_BATCH_SIZE,
+    fetch_transactions_with_receipts,
+    get_mongo_client,
+    rpc_call,
 )
+from provider_pool import get_provider_pool
+from log_decoder import LogDecoder
+from utils.logs import configure_logging
+from utils.metrics import export_metrics, timed_stage
+from utils.schema import to_int64
 
-w35 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w35")}")
-)
-
-w36 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w36")}")
-)
-
-w37 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w37")}")
-)
-
-w38 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w38")}")
-)
-
-w39 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w39")}")
-)
+# w3 = Web3(Web3.HTTPProvider("https://polygon-rpc.com"))
+load_dotenv()
+POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
 
-w310 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w310")}")
-)
+logger = logging.getLogger(__name__)
 
-w31.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w32.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w33.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w34.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w35.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w36.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w37.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w38.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w39.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w310.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
 # Load ABI from ctfabi.json
 ctf_abi = None
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -79,10 +48,20 @@ try:
     with open(abi_file_path, "r") as f:
         ctf_abi = json.load(f)
 except Exception as e:
-    print(f"Error loading ctfabi.json: {e}")
-
-providers = [w31, w32, w33, w34, w35, w36, w37, w38, w39, w310]
-contracts = [w.eth.contract(abi=ctf_abi) for w in providers]
+    logger.error("Error loading ctfabi.json", extra={"error": str(e)})
+
+# Every request draws its provider from the shared pool
+pool = get_provider_pool()
+# Decodes the events of receipts, one topic0 lookup per log
+decoder = LogDecoder(ctf_abi)
+
+# Trade type of each FPMM event, stored in the FPMM<type> collections
+TRADE_TYPES = {
+    "FPMMBuy": "Buy",
+    "FPMMSell": "Sell",
+    "FPMMFundingAdded": "FundingAdded",
+    "FPMMFundingRemoved": "FundingRemoved",
+}
 
 # Constants
 USDC_DECIMALS = 6
@@ -138,17 +117,15 @@ def parse_fpmmtrade_logs(
 ):
     # Add safety checks
     if not rich_log or not rich_log.get("args"):
-        print(f"Warning: rich_log or rich_log.args is None for trade_type {trade_type}")
+        logger.warning("Event has no args", extra={"trade_type": trade_type})
         return None
 
     if not transaction_dict:
-        print(f"Warning: transaction_dict is None for trade_type {trade_type}")
+        logger.warning("Transaction is missing", extra={"trade_type": trade_type})
         return None
 
     if not receipt_dict or not receipt_dict.get("logs"):
-        print(
-            f"Warning: receipt_dict or receipt_dict.logs is None for trade_type {trade_type}"
-        )
+        logger.warning("Receipt has no logs", extra={"trade_type": trade_type})
         return None
 
     trade_info = {}
@@ -190,8 +167,9 @@ def parse_fpmmtrade_logs(
                 trade_info["collateralAmount"] = int(log["data"][2:], 16)
                 collateral_found = True
         if not collateral_found:
-            print(
-                f"No collateralAmount added for tx hash {trade_info.get('transaction_hash', 'unknown')}"
+            logger.warning(
+                "No collateralAmount added",
+                extra={"transaction_hash": trade_info.get("transaction_hash")},
             )
         return trade_info
 
@@ -272,104 +250,127 @@ def parse_fpmmtrade_logs(
     return trade_info
 
 
-def get_trade_info_from_hash(tx_hash, w3, my_contract):
+def get_trade_info_from_hash(tx_hash, w3, decoder):
+    try:
+        tx = rpc_call(w3, "get_transaction", tx_hash)
+        receipt = rpc_call(w3, "get_transaction_receipt", tx_hash)
+    except Exception as e:
+        return fetch_error(tx_hash, e)
+    return get_trade_info_from_receipt(tx_hash, tx, receipt, decoder)
+
+
+def get_trade_info_from_hashes(tx_hashes, w3, decoder):
+    """
+    Trade info of many transactions, their transactions and receipts fetched
+    in JSON-RPC batches of RPC_BATCH_SIZE hashes
+    Returns hash -> list of processed events, as get_trade_info_from_hash
+    """
+    try:
+        fetched = fetch_transactions_with_receipts(w3, tx_hashes)
+    except Exception as e:
+        # No provider could serve the batch: each of its hashes failed
+        fetched = {tx_hash: e for tx_hash in tx_hashes}
+    trade_info = {}
+    for tx_hash in tx_hashes:
+        result = fetched[tx_hash]
+        if isinstance(result, Exception):
+            trade_info[tx_hash] = fetch_error(tx_hash, result)
+        else:
+            tx, receipt = result
+            trade_info[tx_hash] = get_trade_info_from_receipt(
+                tx_hash, tx, receipt, decoder
+            )
+    return trade_info
+
+
+def fetch_error(tx_hash, error):
+    logger.warning(
+        "Error fetching transaction or receipt",
+        extra={"transaction_hash": tx_hash, "error": str(error)},
+    )
+    return [
+        {  # Return a list with a single error object
+            "error": str(error),
+            "transaction_hash": tx_hash,
+            "type": "transaction_processing_error",
+        }
+    ]
+
+
+def get_trade_info_from_receipt(tx_hash, tx, receipt, decoder):
     processed_events_info = []
     try:
-        tx = w3.eth.get_transaction(tx_hash)
-        time.sleep(0.2)
         tx_dict = convert_attribute_dict_to_dict(tx)
-        receipt = w3.eth.get_transaction_receipt(tx_hash)
         receipt_dict = convert_receipt_to_dict(receipt)  # For parse_fpmmtrade_logs
 
-        for log_entry in receipt.logs:
-            if not log_entry.get("topics"):
+        # Each log is decoded once, so every FPMM event of the transaction is
+        # returned, including several trades in one transaction
+        with timed_stage("decode", "transactions", rows=len(receipt["logs"])):
+            decoded = decoder.decode_receipt(receipt)
+        for log_entry, event in decoded:
+            trade_type = TRADE_TYPES.get(event["event"])
+            if trade_type is None:
                 continue
 
-            event_signature = "0x" + log_entry["topics"][0].hex()
-
-            event_processor = None
-            trade_type = None
-
-            if event_signature == EVENT_SIGNATURES["FPMMBuy"]:
-                event_processor = my_contract.events.FPMMBuy().process_receipt(
-                    receipt, errors=DISCARD
+            try:
+                # Convert the raw log_entry to dict with hex strings for parse_fpmmtrade_logs
+                current_event_log_dict = convert_hex_bytes_to_hex_str(log_entry)
+                trade_info = parse_fpmmtrade_logs(
+                    event,  # Decoded event data for this specific log
+                    tx_dict,
+                    trade_type,
+                    receipt_dict,  # Full receipt dict (used for finding related transfers)
+                    current_event_log_dict,  # Raw data of this specific log
                 )
-                trade_type = "Buy"
-            elif event_signature == EVENT_SIGNATURES["FPMMSell"]:
-                event_processor = my_contract.events.FPMMSell().process_receipt(
-                    receipt, errors=DISCARD
+                if trade_info:
+                    trade_info["log_index"] = log_entry.get("logIndex")
+                    processed_events_info.append(trade_info)
+            except Exception as e:
+                logger.warning(
+                    "Error processing log",
+                    extra={
+                        "trade_type": trade_type,
+                        "transaction_hash": tx_hash,
+                        "log_index": log_entry.get("logIndex"),
+                        "error": str(e),
+                    },
                 )
-                trade_type = "Sell"
-            elif event_signature == EVENT_SIGNATURES["FundingAdded"]:
-                event_processor = my_contract.events.FPMMFundingAdded().process_receipt(
-                    receipt, errors=DISCARD
+                processed_events_info.append(
+                    {
+                        "error": f"Log processing error for {trade_type}: {str(e)}",
+                        "transaction_hash": tx_hash,
+                        "log_index": log_entry.get("logIndex"),
+                        "type": "log_processing_error",
+                    }
                 )
-                trade_type = "FundingAdded"
-            elif event_signature == EVENT_SIGNATURES["FundingRemoved"]:
-                event_processor = (
-                    my_contract.events.FPMMFundingRemoved().process_receipt(
-                        receipt, errors=DISCARD
-                    )
-                )
-                trade_type = "FundingRemoved"
-
-            if event_processor is not None and trade_type is not None:
-                try:
-
-                    # Convert the raw log_entry to dict with hex strings for parse_fpmmtrade_logs
-                    current_event_log_dict = convert_hex_bytes_to_hex_str(log_entry)
-                    trade_info = parse_fpmmtrade_logs(
-                        event_processor[0],  # Decoded event data for this specific log
-                        tx_dict,
-                        trade_type,
-                        receipt_dict,  # Full receipt dict (used for finding related transfers)
-                        current_event_log_dict,  # Raw data of this specific log
-                    )
-                    # print("Trade info processed:", trade_info)
-                    if trade_info:
-                        processed_events_info.append(trade_info)
-                except Exception as e:
-                    print(
-                        f"Error processing log for {trade_type} in {tx_hash} at log index {log_entry.get('logIndex')}: {e}"
-                    )
-                    processed_events_info.append(
-                        {
-                            "error": f"Log processing error for {trade_type}: {str(e)}",
-                            "transaction_hash": tx_hash,
-                            "log_index": log_entry.get("logIndex"),
-                            "type": "log_processing_error",
-                        }
-                    )
 
         return processed_events_info  # Returns a list of all processed events, or an empty list
 
     except Exception as e:
-        print(f"Error fetching transaction or receipt for {tx_hash}: {e}")
-        return [
-            {  # Return a list with a single error object
-                "error": str(e),
-                "transaction_hash": tx_hash,
-                "type": "transaction_processing_error",
-            }
-        ]
+        return fetch_error(tx_hash, e)
 
 
-def sanitize_for_mongodb(data):
-    """Convert large integers to strings to avoid MongoDB limitations."""
+def sanitize_for_mongodb(data, key=None):
+    """
+    Store uint256 amounts as int64, or Decimal128 when they exceed int64, so
+    they stay numeric in MongoDB. Token ids are identifiers, not amounts, and
+    are kept as strings when they do not fit in int64.
+    """
     if isinstance(data, dict):
-        return {k: sanitize_for_mongodb(v) for k, v in data.items()}
+        return {k: sanitize_for_mongodb(v, k) for k, v in data.items()}
     elif isinstance(data, list):
-        return [sanitize_for_mongodb(v) for v in data]
-    elif isinstance(data, int):
-        # Convert large integers to strings
-        if abs(data) > 2**63 - 1:
-            return str(data)
+        return [sanitize_for_mongodb(v, key) for v in data]
+    elif isinstance(data, int) and not isinstance(data, bool):
+        if key and key.endswith("AssetId"):
+            return str(data) if abs(data) > 2**63 - 1 else data
+        return to_int64(data)
     return data
 
 
-def process_single_hash(tx_hash, db, w3, my_contract):
+def process_single_hash(tx_hash, db, w3, decoder, processed_events=None):
     try:
-        processed_events = get_trade_info_from_hash(tx_hash, w3, my_contract)
+        if processed_events is None:
+            processed_events = get_trade_info_from_hash(tx_hash, w3, decoder)
         if not processed_events:
             return (tx_hash, "No events found for this transaction hash")
 
@@ -400,14 +401,30 @@ def process_single_hash(tx_hash, db, w3, my_contract):
             #     {"$set": sanitized_event_info},
             #     upsert=True,
             # )
-            if not collection.find_one({"transaction_hash": event_tx_hash}):
-                print(f"Adding new event {event_tx_hash} to {collection_name}")
-                collection.update_one(
-                    {"transaction_hash": event_tx_hash},
-                    {"$set": sanitized_event_info},
-                    upsert=True,
-                )
-            time.sleep(0.2)  # Reduced sleep slightly
+            # A transaction may hold several events of one type, told apart by
+            # their log index
+            log_index = sanitized_event_info.get("log_index")
+            event_key = {"transaction_hash": event_tx_hash, "log_index": log_index}
+            with timed_stage("write", collection_name, rows=1):
+                if not collection.find_one(event_key):
+                    logger.debug(
+                        "Adding new event",
+                        extra={
+                            "transaction_hash": event_tx_hash,
+                            "collection": collection_name,
+                        },
+                    )
+                    # A document stored before the log index was recorded
+                    # (one per transaction) is rewritten as this event, the
+                    # others of the transaction are inserted
+                    legacy = collection.update_one(
+                        {"transaction_hash": event_tx_hash, "log_index": None},
+                        {"$set": sanitized_event_info},
+                    )
+                    if not legacy.matched_count:
+                        collection.update_one(
+                            event_key, {"$set": sanitized_event_info}, upsert=True
+                        )
 
         # Return success after processing all events for this hash
         return (tx_hash, None)
@@ -420,7 +437,7 @@ def process_transaction_hashes_parallel(
     hashes=[], db=None, fpmm_address=None, max_workers=5
 ):
     # if db is None:
-    #     client = MongoClient("mongodb://localhost:27017/")
+    #     client = get_mongo_client()
     #     db = client["polygon_polymarket"]
     # if hashes is None:
     #     hashes = ["0x1b31ac5fdd8dc3695d224d5d7199867fb7476e50ba0a771539f7132443d198bf"]
@@ -431,42 +448,54 @@ def process_transaction_hashes_parallel(
     last_hash = None
 
     def worker(args):
+        chunk = args
+        done = 0
         try:
-            tx_hash, idx = args
-            # print(f"Worker started for {tx_hash}")
-            w3 = providers[idx % len(providers)]
-            my_contract = contracts[idx % len(contracts)]
-            result = process_single_hash(tx_hash, db, w3, my_contract)
-            # print(f"process_single_hash returned for {tx_hash}")
-            time.sleep(0.1)
-            with lock:
-                nonlocal processed_count, last_hash
-                processed_count += 1
-                last_hash = tx_hash
-                if result[1] is not None:
-                    error_hashes.append((result[0], result[1]))
-            return tx_hash
+            trade_info = get_trade_info_from_hashes(chunk, pool, decoder)
+            for tx_hash in chunk:
+                result = process_single_hash(
+                    tx_hash, db, pool, decoder, trade_info[tx_hash]
+                )
+                with lock:
+                    nonlocal processed_count, last_hash
+                    processed_count += 1
+                    last_hash = tx_hash
+                    if result[1] is not None:
+                        error_hashes.append((result[0], result[1]))
+                done += 1
+            return chunk
         except Exception as e:
-            print(f"Exception in worker for hash {args[0]}: {e}")
-            raise
+            logger.exception(
+                "Exception in worker", extra={"first_transaction_hash": args[0]}
+            )
+            # The hashes the worker did not get to are reported as failed
+            with lock:
+                error_hashes.extend(
+                    (tx_hash, f"Exception in worker: {e}") for tx_hash in chunk[done:]
+                )
 
     total_hashes = len(hashes)
-    # print(f"Submitting {total_hashes} hashes to the executor")
+    # One JSON-RPC batch of transactions and receipts per chunk
+    chunks = [
+        hashes[i : i + RPC_BATCH_SIZE] for i in range(0, total_hashes, RPC_BATCH_SIZE)
+    ]
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(worker, (tx_hash, i)) for i, tx_hash in enumerate(hashes)
-        ]
-        # for _ in tqdm(as_completed(futures), total=total_hashes, desc="Processing"):
+        futures = [executor.submit(worker, chunk) for chunk in chunks]
+        # for _ in tqdm(as_completed(futures), total=len(chunks), desc="Processing"):
         #     pass
 
-    if error_hashes:
-        print("Errors encountered for the following hashes:")
-        for tx_hash, error in error_hashes:
-            print(f"{tx_hash}: {error}")
+    for tx_hash, error in error_hashes:
+        logger.warning(
+            "Error processing transaction",
+            extra={"transaction_hash": tx_hash, "error": error},
+        )
+    return error_hashes
 
 
 if __name__ == "__main__":
-    client = MongoClient("mongodb://localhost:27017/")
+    configure_logging()
+    export_metrics()
+    client = get_mongo_client()
     db = client["polygon_polymarket"]
 
     # hashes = list(db.FPMMFundingAdded.find({}, {"transaction_hash": 1, "_id": 0}))
@@ -479,5 +508,5 @@ if __name__ == "__main__":
     ]
 
     total_hashes = len(hashes)
-    print(f"Total transaction hashes to process: {total_hashes}")
+    logger.info("Transaction hashes to process", extra={"total": total_hashes})
     process_transaction_hashes_parallel(hashes=hashes, db=db)
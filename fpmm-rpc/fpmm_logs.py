@@ -0,0 +1,124 @@
+import os
+from typing import Dict, Iterator, List, Optional
+from web3 import Web3
+from rpc_client import rpc_call, rpc_error
+from fetch_transactions import EVENT_SIGNATURES
+
+# FPMM events indexed, matched on topic0
+FPMM_EVENTS = ["FPMMBuy", "FPMMSell", "FundingAdded", "FundingRemoved"]
+FPMM_TOPICS = [EVENT_SIGNATURES[event] for event in FPMM_EVENTS]
+
+# First block scanned for an FPMM with neither a creation block nor a scanned one
+FPMM_START_BLOCK = int(os.getenv("FPMM_START_BLOCK", "0"))
+# Field of the fpmms documents holding the last block whose logs were stored
+SCANNED_BLOCK_FIELD = "logs_scanned_block"
+# Block span of the first eth_getLogs request, and the most it grows to
+LOGS_BLOCK_SPAN = int(os.getenv("LOGS_BLOCK_SPAN", "100000"))
+LOGS_MAX_BLOCK_SPAN = int(os.getenv("LOGS_MAX_BLOCK_SPAN", "2000000"))
+
+# JSON-RPC error code of a provider refusing a range for returning too many
+# logs ("query returned more than 10000 results")
+RANGE_TOO_LARGE_RPC_CODES = {-32005}
+# JSON-RPC error messages of providers refusing it with a generic code
+_RANGE_TOO_LARGE = (
+    "more than",
+    "too many",
+    "response size",
+    "block range",
+    "range is too",
+)
+
+
+def is_range_too_large(error: Exception) -> bool:
+    """
+    Whether the provider refused a range for holding too many logs, from the
+    JSON-RPC error. Transport errors and timeouts are not about the range and
+    are left to the provider pool's failover.
+    """
+    error_object = rpc_error(error)
+    if error_object.get("code") in RANGE_TOO_LARGE_RPC_CODES:
+        return True
+    message = str(error_object.get("message", "")).lower()
+    return any(fragment in message for fragment in _RANGE_TOO_LARGE)
+
+
+def get_start_block(fpmm_docs: List[Dict]) -> int:
+    """
+    First block to scan for a group of FPMMs: the earliest block one of them
+    has not been scanned at, from its stored high-water block or else its
+    creation block (creation_block_number, see timestamps.py)
+    """
+    starts = []
+    for doc in fpmm_docs:
+        if doc.get(SCANNED_BLOCK_FIELD) is not None:
+            starts.append(doc[SCANNED_BLOCK_FIELD] + 1)
+        elif doc.get("creation_block_number") is not None:
+            starts.append(doc["creation_block_number"])
+        else:
+            return FPMM_START_BLOCK
+    return min(starts, default=FPMM_START_BLOCK)
+
+
+def iter_fpmm_logs(
+    w3,
+    fpmm_addresses: List[str],
+    from_block: int = FPMM_START_BLOCK,
+    to_block: Optional[int] = None,
+    block_span: int = LOGS_BLOCK_SPAN,
+) -> Iterator[Dict]:
+    """
+    Yield the FPMMBuy, FPMMSell, FPMMFundingAdded and FPMMFundingRemoved logs
+    emitted by the FPMMs, block range by block range, with eth_getLogs. A
+    range the provider refuses for holding too many logs is halved and
+    retried; after a range succeeds the next one is twice as wide.
+    Args:
+        fpmm_addresses: FPMMs queried together in every request
+        to_block: Last block scanned, defaults to the latest one
+        block_span: Blocks in the first request
+    """
+    if to_block is None:
+        to_block = rpc_call(w3, "get_block_number")
+    addresses = [Web3.to_checksum_address(address) for address in fpmm_addresses]
+
+    start = from_block
+    span = block_span
+    while start <= to_block:
+        end = min(start + span - 1, to_block)
+        try:
+            logs = rpc_call(
+                w3,
+                "get_logs",
+                {
+                    "address": addresses,
+                    "topics": [FPMM_TOPICS],
+                    "fromBlock": start,
+                    "toBlock": end,
+                },
+            )
+        except Exception as e:
+            if end == start or not is_range_too_large(e):
+                raise
+            span = max(1, (end - start + 1) // 2)
+            continue
+        yield from logs
+        start = end + 1
+        span = min(span * 2, LOGS_MAX_BLOCK_SPAN)
+
+
+def get_fpmm_transaction_hashes(
+    w3,
+    fpmm_addresses: List[str],
+    from_block: int = FPMM_START_BLOCK,
+    to_block: Optional[int] = None,
+) -> Dict[str, List[str]]:
+    """
+    Hashes of the transactions emitting FPMM events, per FPMM address
+    (lowercase), in block order without duplicates
+    """
+    hashes: Dict[str, Dict[str, None]] = {
+        address.lower(): {} for address in fpmm_addresses
+    }
+    for log in iter_fpmm_logs(w3, fpmm_addresses, from_block, to_block):
+        tx_hash = "0x" + log["transactionHash"].hex().removeprefix("0x")
+        hashes.setdefault(log["address"].lower(), {})[tx_hash] = None
+    return {address: list(tx_hashes) for address, tx_hashes in hashes.items()}
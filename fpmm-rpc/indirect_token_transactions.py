@@ -8,7 +8,7 @@ from web3 import Web3
 from web3.exceptions import BlockNotFound
 from dotenv import load_dotenv
 from main import connect_to_mongodb
-from fetch_transactions import process_transaction_hashes_parallel
+from receipt_crawler import process_transaction_hashes_async
 
 load_dotenv()
 
@@ -97,7 +97,7 @@ def main():
         # Now subtract existing hashes from all collected events
         new_hashes_to_add = list(set(all_funding_removal_events) - existing_hashes)
         try:
-            process_transaction_hashes_parallel(new_hashes_to_add, mongo_client)
+            process_transaction_hashes_async(new_hashes_to_add, mongo_client)
             print(
                 f"Processed {len(new_hashes_to_add)} new funding removal events for {fpmm}. Completed {idx + 1}/{len(relevant_amms)}"
             )
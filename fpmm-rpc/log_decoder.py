@@ -0,0 +1,148 @@
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+from eth_abi import decode
+from eth_utils import event_abi_to_log_topic, to_checksum_address
+from hexbytes import HexBytes
+
+
+def _is_hashed(abi_type: str) -> bool:
+    """Whether an indexed value of this type is stored as its keccak hash"""
+    return abi_type in ("string", "bytes") or abi_type.endswith("]")
+
+
+# Traders and FPMMs recur across logs, so their checksums are computed once
+_checksum = lru_cache(maxsize=65536)(to_checksum_address)
+
+
+def _word_decoder(abi_type: str) -> Optional[Callable[[bytes], object]]:
+    """
+    Decoder of a value of this type from its 32-byte ABI word, for the static
+    types held in a single word (None for the others, left to eth_abi)
+    """
+    if "[" in abi_type:
+        return None
+    if abi_type.startswith("uint"):
+        return lambda word: int.from_bytes(word, "big")
+    if abi_type.startswith("int"):
+        return lambda word: int.from_bytes(word, "big", signed=True)
+    if abi_type == "address":
+        return lambda word: _checksum("0x" + word[12:].hex())
+    if abi_type == "bool":
+        return lambda word: word[-1] != 0
+    return None
+
+
+def _normalize(abi_type: str, value):
+    """Shape a value decoded by eth_abi like web3's event decoding does"""
+    if abi_type == "address":
+        return _checksum(value)
+    if abi_type == "address[]":
+        return [_checksum(item) for item in value]
+    if abi_type.endswith("]"):
+        return list(value)
+    return value
+
+
+class EventDecoder:
+    """Decodes the logs of one ABI event"""
+
+    def __init__(self, event_abi: Dict):
+        self.name = event_abi["name"]
+        inputs = event_abi["inputs"]
+        self.names = [i["name"] for i in inputs]
+        self.indexed = [(i["name"], i["type"]) for i in inputs if i["indexed"]]
+        self.data = [(i["name"], i["type"]) for i in inputs if not i["indexed"]]
+        self.data_types = [abi_type for _, abi_type in self.data]
+        # Every data value in one word of its own: slice instead of eth_abi
+        word_decoders = [_word_decoder(abi_type) for abi_type in self.data_types]
+        self.data_words = (
+            word_decoders if all(word_decoders) and word_decoders else None
+        )
+
+    def _decode_topic(self, abi_type: str, topic: bytes):
+        if _is_hashed(abi_type):
+            return HexBytes(topic)
+        word_decoder = _word_decoder(abi_type)
+        if word_decoder is not None:
+            return word_decoder(topic)
+        return _normalize(abi_type, decode([abi_type], topic)[0])
+
+    def decode(self, log) -> Dict:
+        """
+        Decoded event of a log, shaped like web3's process_receipt output
+        (event name, args and the position of the log)
+        """
+        topics = log["topics"][1:]
+        if len(topics) != len(self.indexed):
+            raise ValueError(
+                f"{self.name} has {len(self.indexed)} indexed inputs, "
+                f"log has {len(topics)} topics"
+            )
+
+        values = {}
+        for (name, abi_type), topic in zip(self.indexed, topics):
+            values[name] = self._decode_topic(abi_type, HexBytes(topic))
+
+        data = HexBytes(log["data"])
+        if self.data_words is not None:
+            if len(data) != 32 * len(self.data_words):
+                raise ValueError(f"{self.name} data has {len(data)} bytes")
+            for i, ((name, _), word_decoder) in enumerate(
+                zip(self.data, self.data_words)
+            ):
+                values[name] = word_decoder(data[32 * i : 32 * (i + 1)])
+        else:
+            decoded = decode(self.data_types, data)
+            for (name, abi_type), value in zip(self.data, decoded):
+                values[name] = _normalize(abi_type, value)
+
+        return {
+            "event": self.name,
+            "args": {name: values[name] for name in self.names},
+            "logIndex": log.get("logIndex"),
+            "transactionIndex": log.get("transactionIndex"),
+            "transactionHash": log.get("transactionHash"),
+            "address": log.get("address"),
+            "blockHash": log.get("blockHash"),
+            "blockNumber": log.get("blockNumber"),
+        }
+
+
+class LogDecoder:
+    """
+    Decoders of every event of an ABI keyed by topic0, built once, so each log
+    is decoded exactly once by looking up its first topic instead of running
+    every event's decoder over the whole receipt
+    """
+
+    def __init__(self, abi: List[Dict]):
+        self.events: Dict[bytes, EventDecoder] = {
+            bytes(event_abi_to_log_topic(item)): EventDecoder(item)
+            for item in abi
+            if item.get("type") == "event" and not item.get("anonymous")
+        }
+
+    def decode_log(self, log) -> Optional[Dict]:
+        """
+        Decoded event of a log, or None when its topic0 is not in the ABI or
+        it does not match the event's layout (as web3's errors=DISCARD)
+        """
+        topics = log.get("topics")
+        if not topics:
+            return None
+        decoder = self.events.get(bytes(HexBytes(topics[0])))
+        if decoder is None:
+            return None
+        try:
+            return decoder.decode(log)
+        except Exception:
+            return None
+
+    def decode_receipt(self, receipt) -> List[Tuple[Dict, Dict]]:
+        """Every decodable log of a receipt and its event, in log order"""
+        decoded = []
+        for log in receipt["logs"]:
+            event = self.decode_log(log)
+            if event is not None:
+                decoded.append((log, event))
+        return decoded
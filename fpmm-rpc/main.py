@@ -1,27 +1,43 @@
-from pymongo import MongoClient
-from web3 import Web3
-from fetch_blocks import fetch_all_token_transfers
+import logging
+import os
+import sys
 
-from fetch_transactions import (
-    get_trade_info_from_hash,
-    process_transaction_hashes_parallel,
+# utils.logs and utils.metrics live with the subgraph ingestion utils
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "the-graph")
 )
 
+from rpc_client import get_mongo_client, rpc_call
+from web3 import Web3
+from fpmm_logs import (
+    SCANNED_BLOCK_FIELD,
+    get_fpmm_transaction_hashes,
+    get_start_block,
+)
+from receipt_crawler import process_transaction_hashes_async
+
+from fetch_transactions import pool
+
 # from populate_withdraw_fees import process_transaction_hashes_parallel
-from pprint import pp, pprint, pformat
 import time
 from tqdm import tqdm
 import signal
-import sys
 import threading
 from queue import Queue
 from concurrent.futures import ThreadPoolExecutor
 from web3.middleware import ExtraDataToPOAMiddleware
+from utils.logs import configure_logging
+from utils.metrics import export_metrics
+
+# FPMMs whose events are fetched together by one eth_getLogs request
+FPMMS_PER_LOGS_QUERY = 50
+
+logger = logging.getLogger("main")
 
 
 def connect_to_mongodb():
     """Connect to MongoDB and return the database."""
-    client = MongoClient("mongodb://localhost:27017/")
+    client = get_mongo_client()
     return client["polygon_polymarket"]
 
 
@@ -31,19 +47,6 @@ def get_last_processed_address(db):
     return last_fpmm["fpmm_address"] if last_fpmm else "0x0"
 
 
-def sanitize_for_mongodb(data):
-    """Convert large integers to strings to avoid MongoDB limitations."""
-    if isinstance(data, dict):
-        return {k: sanitize_for_mongodb(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [sanitize_for_mongodb(v) for v in data]
-    elif isinstance(data, int):
-        # Convert large integers to strings
-        if abs(data) > 2**63 - 1:
-            return str(data)
-    return data
-
-
 # def cleanup_current_fpmm(db, fpmm_address):
 #     """
 #     Clean up all data related to the current FPMM address being processed.
@@ -58,67 +61,81 @@ def signal_handler(signum, frame):
     """
     Handle cleanup when the script is interrupted.
     """
-    print("\nInterrupt received. Cleaning up before exit...")
+    logger.warning("Interrupt received, exiting")
     # if hasattr(signal_handler, "current_fpmm"):
     #     db = connect_to_mongodb()
     #     cleanup_current_fpmm(db, signal_handler.current_fpmm)
     sys.exit(1)
 
 
-def process_single_fpmm(doc, db, existing_hashes_set, thread_idx=0):
-    """Process a single FPMM with retries."""
+def process_fpmms(docs, db, existing_hashes_set, thread_idx=0):
+    """
+    Process FPMMs, whose events are indexed together, with retries. Logs are
+    scanned from the group's stored high-water block (or the FPMMs' creation
+    block), which moves up to the scanned head once every event is stored.
+    """
+    fpmm_addresses = [doc["fpmm_address"] for doc in docs]
+    from_block = get_start_block(docs)
     max_retries = 3
     retry_count = 0
     while retry_count < max_retries:
         try:
-            # Store current FPMM address in signal handler
-            signal_handler.current_fpmm = doc["fpmm_address"]
-            try:
-                transfers = fetch_all_token_transfers(doc["fpmm_address"], thread_idx)
-            except Exception as e:
-                if "Result window is too large" in str(e):
-                    print(
-                        f"\nNote: Hit 10k transfer limit for {doc['fpmm_address']}, processing available transfers"
-                    )
-                    transfers = getattr(e, "partial_results", [])
-                else:
-                    print(
-                        f"Error fetching transfers for {doc['fpmm_address']}: {str(e)}"
-                    )
-                    raise e
-
-            # Process transfers if they exist
-            unique_transfers = {}
-            for transfer in transfers:
-                tx_hash = transfer.get("hash")
-                if tx_hash and tx_hash not in unique_transfers:
-                    unique_transfers[tx_hash] = transfer
-
-            transfers = list(unique_transfers.values())
-            print("Length of transfers: ", len(transfers))
-
-            transfer_hashes = [
-                transfer.get("hash")
-                for transfer in transfers
-                # if transfer.get("hash") not in existing_hashes_set
-            ]
-            process_transaction_hashes_parallel(
-                transfer_hashes, db, doc["fpmm_address"]
+            # Store current FPMM addresses in signal handler
+            signal_handler.current_fpmm = fpmm_addresses
+            to_block = rpc_call(pool, "get_block_number")
+            # Transactions emitting FPMMBuy, FPMMSell or funding events, straight
+            # from eth_getLogs instead of every token transfer from Polygonscan
+            hashes_by_fpmm = get_fpmm_transaction_hashes(
+                pool, fpmm_addresses, from_block, to_block
+            )
+
+            for fpmm_address, transaction_hashes in hashes_by_fpmm.items():
+                logger.info(
+                    "Transactions to crawl",
+                    extra={
+                        "fpmm_address": fpmm_address,
+                        "transactions": len(transaction_hashes),
+                    },
+                )
+            # The group is crawled at once, so all its requests share one
+            # crawler and the endpoints' rate limiters and concurrency bounds
+            group_hashes = list(
+                dict.fromkeys(
+                    tx_hash
+                    for transaction_hashes in hashes_by_fpmm.values()
+                    for tx_hash in transaction_hashes
+                )
             )
+            failed = process_transaction_hashes_async(group_hashes, db)
 
+            # Failed transactions are picked up again by the next run
+            if not failed:
+                db.fpmms.update_many(
+                    {"fpmm_address": {"$in": fpmm_addresses}},
+                    {"$set": {SCANNED_BLOCK_FIELD: to_block}},
+                )
             return True
 
         except Exception as e:
-            print(f"Error processing {doc['fpmm_address']}: {str(e)}")
+            logger.warning(
+                "Error processing FPMMs",
+                extra={"fpmm_addresses": fpmm_addresses, "error": str(e)},
+            )
             retry_count += 1
             if retry_count < max_retries:
-                print(
-                    f"Retrying FPMM {doc['fpmm_address']}... (Attempt {retry_count + 1} of {max_retries})"
+                logger.info(
+                    "Retrying FPMMs",
+                    extra={
+                        "fpmm_addresses": fpmm_addresses,
+                        "attempt": retry_count + 1,
+                        "max_retries": max_retries,
+                    },
                 )
                 time.sleep(5)  # Wait 5 seconds before retrying
             else:
-                print(
-                    f"Max retries reached for FPMM {doc['fpmm_address']}. Skipping..."
+                logger.error(
+                    "Max retries reached, skipping FPMMs",
+                    extra={"fpmm_addresses": fpmm_addresses},
                 )
                 return False
 
@@ -132,7 +149,7 @@ def process_fpmm_addresses(batch_size=100, num_threads=4):
     signal.signal(signal.SIGTERM, signal_handler)
 
     # Connect to source database
-    client = MongoClient("mongodb://localhost:27017/")
+    client = get_mongo_client()
     db = client["polygon_polymarket"]
     existing_hashes = list(db.transaction_hashes.find())
     existing_hashes_set = {hash["transaction_hash"] for hash in existing_hashes}
@@ -142,16 +159,23 @@ def process_fpmm_addresses(batch_size=100, num_threads=4):
 
     def process_batch(batch_docs, thread_idx):
         nonlocal processed_count  # So we can modify the outer variable
-        for doc in batch_docs:
-            print(f"[Thread {thread_idx}] Processing {doc['fpmm_address']}")
-            success = process_single_fpmm(doc, db, existing_hashes_set, thread_idx)
+        for i in range(0, len(batch_docs), FPMMS_PER_LOGS_QUERY):
+            docs = batch_docs[i : i + FPMMS_PER_LOGS_QUERY]
+            logger.info(
+                "Processing FPMMs", extra={"thread": thread_idx, "fpmms": len(docs)}
+            )
+            success = process_fpmms(docs, db, existing_hashes_set, thread_idx)
             if success:
                 with count_lock:
-                    processed_count += 1
-                    print(
-                        f"(Total processed: {processed_count}) [Thread {thread_idx}] --------- Processed {doc['fpmm_address']} "
+                    processed_count += len(docs)
+                    logger.info(
+                        "Processed FPMMs",
+                        extra={
+                            "thread": thread_idx,
+                            "fpmm_addresses": [doc["fpmm_address"] for doc in docs],
+                            "total_processed": processed_count,
+                        },
                     )
-            time.sleep(0.2)
 
     try:
         # while True:
@@ -174,7 +198,10 @@ def process_fpmm_addresses(batch_size=100, num_threads=4):
             # .limit(batch_size * num_threads)  # Fetch enough for all threads
         )
 
-        print(f"Processing batch of {len(batch)} documents with {num_threads} threads")
+        logger.info(
+            "Processing batch of FPMMs",
+            extra={"fpmms": len(batch), "threads": num_threads},
+        )
 
         # Split batch into sub-batches for threads
         sub_batches = [[] for _ in range(num_threads)]
@@ -194,25 +221,27 @@ def process_fpmm_addresses(batch_size=100, num_threads=4):
             # time.sleep(0.2)  # Brief pause between batches
 
     except Exception as e:
-        print(f"Database error: {str(e)}")
+        logger.error("Database error", extra={"error": str(e)})
         raise e
 
-    # Print the final count after all threads are done
-    print(f"Total processed addresses: {processed_count}")
+    # Log the final count after all threads are done
+    logger.info("Processed FPMM addresses", extra={"total_processed": processed_count})
 
 
 def get_fpmm_info(fpmm_address):
-    """Get FPMM info from the polygon/rpc host and just print it"""
+    """Get FPMM info from the polygon/rpc host and just log it"""
     RPC_URL = "https://polygon-rpc.com"
     w3 = Web3(Web3.HTTPProvider(RPC_URL))
     w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
 
     fpmm_info = w3.eth.get  # get_transaction(fpmm_address)
-    print(fpmm_info)
+    logger.info("FPMM info", extra={"fpmm_address": fpmm_address, "info": fpmm_info})
 
 
 def main():
     """Main function to control the script execution."""
+    configure_logging()
+    export_metrics()
 
     try:
         # res = fetch_token_transfers("0x01a4333b6aCb5091cF0219646f35E289546F4656")
@@ -221,7 +250,9 @@ def main():
         process_fpmm_addresses()
         return 0
     except Exception as e:
-        pprint({"error": str(e), "type": "main_execution_error"})
+        logger.exception(
+            "Main execution error", extra={"type": "main_execution_error"}
+        )
         return 1
 
 
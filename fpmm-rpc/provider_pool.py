@@ -0,0 +1,372 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Collection, Dict, List, Optional, Set, Tuple, TypeVar
+from urllib.parse import urlparse
+from aiohttp import ClientConnectionError
+from dotenv import load_dotenv
+from web3 import Web3
+from web3.exceptions import ProviderConnectionError
+from web3.middleware import ExtraDataToPOAMiddleware
+from rpc_client import (
+    THROTTLE_STATUS_CODES,
+    http_status,
+    is_throttled,
+    limited,
+    rpc_error,
+    timed_request,
+)
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Endpoint URL of an Alchemy key
+ALCHEMY_URL = "https://polygon-mainnet.g.alchemy.com/v2/{}"
+# Environment variables holding the Alchemy keys of the pool
+DEFAULT_KEY_NAMES = ",".join(f"w3{i}" for i in range(1, 11))
+
+# HTTP statuses and JSON-RPC error messages of a provider refusing a key
+# (invalid, unpaid, out of quota)
+KEY_REJECTED_STATUS_CODES = {401, 403}
+KEY_REJECTED_MESSAGES = (
+    "unauthorized",
+    "invalid api key",
+    "must be authenticated",
+    "monthly capacity",
+)
+# HTTP statuses and JSON-RPC error codes of a provider being down, as opposed
+# to an error about the request itself (unknown hash, too many logs...)
+PROVIDER_DOWN_STATUS_CODES = {500, 502, 503, 504}
+PROVIDER_DOWN_RPC_CODES = {-32603}  # Internal error
+# Exceptions of a provider being unreachable (OSError includes requests'
+# connection errors and timeouts)
+CONNECTION_ERRORS = (OSError, ClientConnectionError, ProviderConnectionError)
+
+
+class ProviderPoolExhaustedError(Exception):
+    """Every provider of the pool is out of quota or rejected its key"""
+
+
+def is_key_rejected(error: Exception) -> bool:
+    """
+    Whether the provider refused the key, from the HTTP status or the
+    JSON-RPC error (never the exception text, which may hold a hash)
+    """
+    if http_status(error) in KEY_REJECTED_STATUS_CODES:
+        return True
+    message = str(rpc_error(error).get("message", "")).lower()
+    return any(text in message for text in KEY_REJECTED_MESSAGES)
+
+
+def is_provider_error(error: Exception) -> bool:
+    """Whether an error is the provider's fault, so another one may succeed"""
+    status = http_status(error)
+    if status is not None:
+        # HTTPError is an OSError, the status tells whose fault it is
+        return status in PROVIDER_DOWN_STATUS_CODES | THROTTLE_STATUS_CODES
+    return (
+        is_throttled(error)
+        or rpc_error(error).get("code") in PROVIDER_DOWN_RPC_CODES
+        or isinstance(error, CONNECTION_ERRORS)
+    )
+
+
+@dataclass
+class RpcProvider:
+    """
+    One RPC endpoint and its health
+    Args:
+        name: Name in logs, so the key in the URL is never printed
+        w3: Client of the endpoint
+        latency: Moving average of the response time (seconds), None until
+            the first response
+        failures: Consecutive failures since the last success
+        trips: Times the circuit opened since the provider was last healthy
+        open_until: Monotonic time until which the circuit is open
+        probing: Whether a trial request is in flight after the circuit
+            reopened (half-open)
+        used: JSON-RPC calls sent, counted against the pool's quota
+    """
+
+    name: str
+    w3: Web3
+    latency: Optional[float] = None
+    failures: int = 0
+    trips: int = 0
+    open_until: float = 0.0
+    probing: bool = False
+    used: int = 0
+
+
+class ProviderPool:
+    """
+    Pool of RPC providers shared by every request of the process. Each
+    request goes to a provider drawn at random, weighted by the inverse of
+    its latency, so faster endpoints take more of the traffic.
+    A provider that throttles, or fails failure_threshold times in a row,
+    has its circuit opened for an exponentially growing cooldown. Once the
+    cooldown is over a single trial request is let through: its success
+    re-admits the provider, its failure opens the circuit again. A provider
+    that uses up its quota or whose key is rejected is retired for good.
+    Args:
+        providers: Providers to spread requests over
+        quota: Maximum number of JSON-RPC calls per provider in this process
+            (None for no limit)
+        failure_threshold: Consecutive failures opening the circuit
+        base_cooldown: Seconds the circuit stays open after its first trip
+        max_cooldown: Upper bound of the cooldown
+    """
+
+    def __init__(
+        self,
+        providers: List[RpcProvider],
+        quota: Optional[int] = None,
+        failure_threshold: int = 3,
+        base_cooldown: float = 2.0,
+        max_cooldown: float = 120.0,
+    ):
+        if not providers:
+            raise ValueError("A provider pool needs at least one provider")
+        self.providers = providers
+        self.quota = quota
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+
+        self._lock = threading.Lock()
+        self._retired: Dict[str, str] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.providers)
+
+    def _weight(self, provider: RpcProvider, fastest: Optional[float]) -> float:
+        # Providers without a measurement yet are assumed as fast as the best
+        latency = provider.latency or fastest or 1.0
+        return 1.0 / max(latency, 0.001)
+
+    def _pick(
+        self, cost: int, tried: Collection[str] = ()
+    ) -> Tuple[Optional[RpcProvider], float]:
+        """
+        A provider charged for the request, or None and the seconds to wait.
+        Providers in `tried` (names) are only drawn when no other one is up.
+        """
+        with self._lock:
+            active = [p for p in self.providers if p.name not in self._retired]
+            if not active:
+                reasons = "; ".join(sorted(set(self._retired.values())))
+                raise ProviderPoolExhaustedError(
+                    f"All RPC providers exhausted ({reasons})"
+                )
+
+            now = time.monotonic()
+            closed = [p for p in active if p.open_until == 0.0]
+            closed = [p for p in closed if p.name not in tried] or closed
+            # Circuits whose cooldown is over admit one trial request
+            half_open = [
+                p for p in active if 0.0 < p.open_until <= now and not p.probing
+            ]
+            if half_open:
+                provider = half_open[0]
+                provider.probing = True
+            elif closed:
+                latencies = [p.latency for p in closed if p.latency is not None]
+                fastest = min(latencies) if latencies else None
+                weights = [self._weight(p, fastest) for p in closed]
+                provider = random.choices(closed, weights=weights)[0]
+            else:
+                waiting = [p.open_until for p in active if p.open_until > now]
+                return None, max(min(waiting) - now if waiting else 0.1, 0.01)
+
+            self._charge(provider, cost)
+            return provider, 0.0
+
+    def acquire(self, cost: int = 1, tried: Collection[str] = ()) -> RpcProvider:
+        """
+        Draw a provider for a request of `cost` JSON-RPC calls, waiting out
+        open circuits if needed
+        Args:
+            tried: Names of the providers the request already failed on
+        """
+        while True:
+            provider, wait = self._pick(cost, tried)
+            if provider is not None:
+                return provider
+            time.sleep(wait)
+
+    async def acquire_async(
+        self, cost: int = 1, tried: Collection[str] = ()
+    ) -> RpcProvider:
+        """acquire() for asyncio code, waiting without blocking the event loop"""
+        while True:
+            provider, wait = self._pick(cost, tried)
+            if provider is not None:
+                return provider
+            await asyncio.sleep(wait)
+
+    def _charge(self, provider: RpcProvider, cost: int) -> None:
+        provider.used += cost
+        if self.quota is not None and provider.used >= self.quota:
+            self._retired[provider.name] = f"quota of {self.quota} calls used"
+
+    def record_success(self, provider: RpcProvider, latency: float) -> None:
+        with self._lock:
+            if provider.open_until:
+                logger.info(
+                    "RPC provider re-admitted", extra={"provider": provider.name}
+                )
+            provider.latency = (
+                latency
+                if provider.latency is None
+                else 0.8 * provider.latency + 0.2 * latency
+            )
+            provider.failures = 0
+            provider.trips = 0
+            provider.open_until = 0.0
+            provider.probing = False
+
+    def record_failure(self, provider: RpcProvider, throttled: bool = False) -> None:
+        """Count a failure, opening the circuit on throttling or repeated errors"""
+        with self._lock:
+            provider.failures += 1
+            trial_failed = provider.probing
+            provider.probing = False
+            if not (
+                throttled
+                or trial_failed
+                or provider.failures >= self.failure_threshold
+            ):
+                return
+            provider.trips += 1
+            cooldown = min(
+                self.max_cooldown, self.base_cooldown * 2 ** (provider.trips - 1)
+            )
+            provider.open_until = time.monotonic() + cooldown
+        logger.warning(
+            "RPC provider circuit open",
+            extra={"provider": provider.name, "cooldown": round(cooldown)},
+        )
+
+    def record_rejected(self, provider: RpcProvider, reason: str) -> None:
+        """Retire a provider refusing its key"""
+        with self._lock:
+            self._retired[provider.name] = reason
+            provider.probing = False
+        logger.warning(
+            "RPC provider retired", extra={"provider": provider.name, "reason": reason}
+        )
+
+    def record_error(
+        self, provider: RpcProvider, error: Exception, latency: float
+    ) -> bool:
+        """
+        Record a request that raised. Returns whether the provider was at
+        fault, so the request may succeed on another one.
+        """
+        if is_key_rejected(error):
+            self.record_rejected(provider, str(error))
+            return True
+        if is_provider_error(error):
+            self.record_failure(provider, throttled=is_throttled(error))
+            return True
+        # The provider answered, the request itself is wrong
+        self.record_success(provider, latency)
+        return False
+
+    def request(
+        self,
+        send: Callable[[Web3], T],
+        cost: int = 1,
+        entity: str = "rpc",
+        rows: int = 0,
+    ) -> T:
+        """
+        Send a request to a provider from the pool, failing over to another
+        one when the provider is at fault. Errors about the request itself
+        are raised straight away.
+        Args:
+            send: Sends the request with the given client and returns the result
+            cost: JSON-RPC calls in the request, charged to the quota
+            entity: Label of the request in the provider's metrics series
+            rows: Transactions or logs the request fetches, for the metrics
+        """
+        error: Optional[Exception] = None
+        tried: Set[str] = set()
+        for _ in range(self.size):
+            provider = self.acquire(cost, tried)
+            tried.add(provider.name)
+            started = time.monotonic()
+            try:
+                result = timed_request(
+                    lambda: limited(provider.w3, lambda: send(provider.w3)),
+                    entity,
+                    provider.name,
+                    rows=rows,
+                )
+            except Exception as e:
+                if not self.record_error(provider, e, time.monotonic() - started):
+                    raise
+                error = e
+                continue
+            self.record_success(provider, time.monotonic() - started)
+            return result
+        raise error
+
+    def health(self) -> Dict[str, Dict]:
+        """State of each provider, by name"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                p.name: {
+                    "latency": p.latency,
+                    "used": p.used,
+                    "failures": p.failures,
+                    "open": p.open_until > now,
+                    "retired": self._retired.get(p.name),
+                }
+                for p in self.providers
+            }
+
+
+def build_provider_pool() -> ProviderPool:
+    """
+    Build a pool from the environment: the Alchemy keys held by the variables
+    listed in RPC_KEY_NAMES (comma separated, defaults to w31..w310), plus the
+    endpoints of RPC_URLS (comma separated URLs). RPC_KEY_QUOTA caps the
+    JSON-RPC calls per provider.
+    """
+    load_dotenv()
+    endpoints = {}
+    key_names = os.getenv("RPC_KEY_NAMES", DEFAULT_KEY_NAMES)
+    for key_name in [k.strip() for k in key_names.split(",") if k.strip()]:
+        if os.getenv(key_name):
+            endpoints[key_name] = ALCHEMY_URL.format(os.getenv(key_name))
+    for url in [u.strip() for u in os.getenv("RPC_URLS", "").split(",") if u.strip()]:
+        endpoints[urlparse(url).netloc] = url
+
+    providers = []
+    for name, url in endpoints.items():
+        w3 = Web3(Web3.HTTPProvider(url))
+        w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+        providers.append(RpcProvider(name, w3))
+    quota = os.getenv("RPC_KEY_QUOTA")
+    return ProviderPool(providers, quota=int(quota) if quota else None)
+
+
+_pool: Optional[ProviderPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_provider_pool() -> ProviderPool:
+    """Return the process-wide provider pool, building it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = build_provider_pool()
+        return _pool
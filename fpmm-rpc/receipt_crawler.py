@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple, Union
+from web3 import AsyncWeb3
+from rpc_client import (
+    RPC_BATCH_SIZE,
+    RPC_MAX_RATE,
+    RPC_RATE,
+    is_request_error,
+    is_throttled,
+    record_request,
+)
+from provider_pool import ProviderPool, RpcProvider
+from fetch_transactions import (
+    decoder,
+    fetch_error,
+    get_trade_info_from_receipt,
+    pool,
+    process_single_hash,
+)
+from utils.rate_limiter import AdaptiveRateLimiter, get_rate_limiter
+
+# Requests in flight at once on each provider
+RPC_PROVIDER_CONCURRENCY = int(os.getenv("RPC_PROVIDER_CONCURRENCY", "50"))
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptCrawler:
+    """
+    Fetches transactions and receipts with asyncio, keeping up to
+    `concurrency` JSON-RPC batch requests in flight on every provider of the
+    pool instead of one blocking request per thread. Providers are drawn from
+    the pool, which tracks their health and fails over when one is down, and
+    every request waits for the endpoint's adaptive rate limiter, shared with
+    the synchronous requests (see rpc_client.limited).
+    Args:
+        pool: Providers to crawl with
+        concurrency: Requests in flight at once per provider
+        batch_size: Hashes whose transaction and receipt share a batch request
+    """
+
+    def __init__(
+        self,
+        pool: ProviderPool,
+        concurrency: int = RPC_PROVIDER_CONCURRENCY,
+        batch_size: int = RPC_BATCH_SIZE,
+    ):
+        self.pool = pool
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._clients: Dict[str, Tuple[AsyncWeb3, asyncio.Semaphore]] = {}
+
+    def _client(self, provider: RpcProvider) -> Tuple[AsyncWeb3, asyncio.Semaphore]:
+        """Async client of a provider and the semaphore bounding its requests"""
+        if provider.name not in self._clients:
+            endpoint_uri = provider.w3.provider.endpoint_uri
+            w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(endpoint_uri))
+            self._clients[provider.name] = (w3, asyncio.Semaphore(self.concurrency))
+        return self._clients[provider.name]
+
+    def _limiter(self, provider: RpcProvider) -> AdaptiveRateLimiter:
+        return get_rate_limiter(
+            provider.w3.provider.endpoint_uri, rate=RPC_RATE, max_rate=RPC_MAX_RATE
+        )
+
+    async def _request(self, tx_hashes: List[str]) -> List:
+        """One batch request, failing over while providers are at fault"""
+        error = None
+        tried: Set[str] = set()
+        for _ in range(self.pool.size):
+            provider = await self.pool.acquire_async(2 * len(tx_hashes), tried)
+            tried.add(provider.name)
+            w3, in_flight = self._client(provider)
+            limiter = self._limiter(provider)
+            async with in_flight:
+                await limiter.acquire_async()
+                started = time.monotonic()
+                try:
+                    async with w3.batch_requests() as batch:
+                        for tx_hash in tx_hashes:
+                            batch.add(w3.eth.get_transaction(tx_hash))
+                            batch.add(w3.eth.get_transaction_receipt(tx_hash))
+                        responses = await batch.async_execute()
+                except Exception as e:
+                    latency = time.monotonic() - started
+                    if is_throttled(e):
+                        limiter.record_throttle()
+                    record_request("transactions", provider.name, latency, error=e)
+                    if not self.pool.record_error(provider, e, latency):
+                        raise
+                    error = e
+                    continue
+            latency = time.monotonic() - started
+            limiter.record_success(latency)
+            record_request(
+                "transactions", provider.name, latency, rows=len(tx_hashes)
+            )
+            self.pool.record_success(provider, latency)
+            return responses
+        raise error
+
+    async def fetch(self, tx_hashes: List[str]) -> Dict[str, Union[Tuple, Exception]]:
+        """
+        Transaction and receipt of each hash of one batch. A batch fails as a
+        whole when one of its calls fails, so it is split in halves until the
+        error is down to the hash it belongs to. Provider errors (throttling,
+        outages, exhausted pool) are raised as they are: splitting the batch
+        would only multiply the failing requests.
+        """
+        try:
+            responses = await self._request(tx_hashes)
+        except Exception as e:
+            if not is_request_error(e):
+                raise
+            if len(tx_hashes) == 1:
+                return {tx_hashes[0]: e}
+            middle = len(tx_hashes) // 2
+            halves = await asyncio.gather(
+                self.fetch(tx_hashes[:middle]), self.fetch(tx_hashes[middle:])
+            )
+            return {**halves[0], **halves[1]}
+        return {
+            tx_hash: (responses[2 * i], responses[2 * i + 1])
+            for i, tx_hash in enumerate(tx_hashes)
+        }
+
+    async def fetch_or_fail(
+        self, tx_hashes: List[str]
+    ) -> Dict[str, Union[Tuple, Exception]]:
+        """
+        fetch(), reporting an error no provider could serve the batch with as
+        the error of each of its hashes instead of raising it
+        """
+        try:
+            return await self.fetch(tx_hashes)
+        except Exception as e:
+            return {tx_hash: e for tx_hash in tx_hashes}
+
+    def batches(self, tx_hashes: List[str]) -> List[List[str]]:
+        return [
+            tx_hashes[i : i + self.batch_size]
+            for i in range(0, len(tx_hashes), self.batch_size)
+        ]
+
+    async def crawl(self, tx_hashes: List[str]) -> Dict[str, Union[Tuple, Exception]]:
+        """
+        Transaction and receipt of every hash, or the exception raised for it,
+        with all the batches in flight at once
+        """
+        results: Dict[str, Union[Tuple, Exception]] = {}
+        for fetched in await asyncio.gather(
+            *(self.fetch_or_fail(batch) for batch in self.batches(tx_hashes))
+        ):
+            results.update(fetched)
+        return results
+
+    async def close(self) -> None:
+        for w3, _ in self._clients.values():
+            await w3.provider.disconnect()
+        self._clients = {}
+
+
+async def _process_transaction_hashes(hashes, db, max_workers):
+    crawler = ReceiptCrawler(pool)
+    loop = asyncio.get_running_loop()
+    error_hashes = []
+
+    def store(fetched):
+        """Parse the events of fetched transactions and store them in MongoDB"""
+        for tx_hash, result in fetched.items():
+            if isinstance(result, Exception):
+                processed_events = fetch_error(tx_hash, result)
+            else:
+                processed_events = get_trade_info_from_receipt(
+                    tx_hash, *result, decoder
+                )
+            result = process_single_hash(tx_hash, db, pool, decoder, processed_events)
+            if result[1] is not None:
+                error_hashes.append(result)
+
+    # Parsing and MongoDB writes block, so they run on threads while the
+    # event loop keeps the requests in flight
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        async def crawl_batch(batch):
+            fetched = await crawler.fetch_or_fail(batch)
+            await loop.run_in_executor(executor, store, fetched)
+
+        try:
+            await asyncio.gather(
+                *(crawl_batch(batch) for batch in crawler.batches(hashes))
+            )
+        finally:
+            await crawler.close()
+    return error_hashes
+
+
+def process_transaction_hashes_async(
+    hashes=[], db=None, fpmm_address=None, max_workers=5
+):
+    """
+    Drop-in for fetch_transactions.process_transaction_hashes_parallel,
+    crawling the transactions and receipts with ReceiptCrawler.
+    Returns the (hash, error) pairs of the transactions that failed.
+    Args:
+        max_workers: Threads parsing the receipts and writing the events
+    """
+    error_hashes = asyncio.run(_process_transaction_hashes(hashes, db, max_workers))
+
+    for tx_hash, error in error_hashes:
+        logger.warning(
+            "Error processing transaction",
+            extra={"transaction_hash": tx_hash, "error": error},
+        )
+    return error_hashes
@@ -0,0 +1,231 @@
+import os
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+import requests
+from aiohttp import ClientResponseError
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from web3 import Web3
+from web3.exceptions import TooManyRequests, Web3RPCError, Web3ValueError
+
+# Shared helpers (rate limiting, metrics) live with the subgraph ingestion utils
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "the-graph")
+)
+
+from utils.metrics import REQUESTS, STAGE_ROWS, STAGE_SECONDS
+from utils.rate_limiter import get_rate_limiter
+
+# MongoDB used by the RPC scripts when MONGO_URI is not set
+DEFAULT_MONGO_URI = "mongodb://localhost:27017/"
+
+# Starting and maximum request rate per RPC endpoint (requests per second)
+RPC_RATE = float(os.getenv("RPC_RATE", "10"))
+RPC_MAX_RATE = float(os.getenv("RPC_MAX_RATE", "100"))
+# Transactions whose transaction and receipt are fetched in one JSON-RPC batch
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "100"))
+
+# HTTP statuses and JSON-RPC error codes of a provider rate limiting us
+THROTTLE_STATUS_CODES = {429}
+THROTTLE_RPC_CODES = {429}
+# JSON-RPC error messages of a provider rate limiting us
+THROTTLE_MESSAGES = ("too many requests", "rate limit", "per second capacity")
+
+
+def get_mongo_client() -> MongoClient:
+    """MongoDB client for the URI in MONGO_URI (a local server by default)"""
+    load_dotenv()
+    return MongoClient(os.getenv("MONGO_URI", DEFAULT_MONGO_URI))
+
+
+def _error_chain(error: BaseException) -> Iterator[BaseException]:
+    """An error and the errors it was raised from"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def http_status(error: Exception) -> Optional[int]:
+    """HTTP status of the response an error was raised for, if any"""
+    for e in _error_chain(error):
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            return e.response.status_code
+        if isinstance(e, ClientResponseError):
+            return e.status
+    return None
+
+
+def rpc_error(error: Exception) -> Dict:
+    """The `error` object of the JSON-RPC response an error was raised for"""
+    for e in _error_chain(error):
+        if isinstance(e, Web3RPCError) and isinstance(e.rpc_response, dict):
+            if isinstance(e.rpc_response.get("error"), dict):
+                return e.rpc_response["error"]
+    return {}
+
+
+def is_throttled(error: Exception) -> bool:
+    """
+    Whether an RPC error means the provider is rate limiting us, from the
+    HTTP status, the JSON-RPC error or the exception type. The text of the
+    exception is never searched: it may hold a hash or an address.
+    """
+    if isinstance(error, TooManyRequests):
+        return True
+    if http_status(error) in THROTTLE_STATUS_CODES:
+        return True
+    error_object = rpc_error(error)
+    if error_object.get("code") in THROTTLE_RPC_CODES:
+        return True
+    message = str(error_object.get("message", "")).lower()
+    return any(text in message for text in THROTTLE_MESSAGES)
+
+
+def is_request_error(error: Exception) -> bool:
+    """
+    Whether an error is about the request itself (an unknown hash, invalid
+    params...) as opposed to the provider failing, throttling or the pool
+    being exhausted, which another attempt at a smaller request cannot fix
+    """
+    if is_throttled(error):
+        return False
+    return isinstance(error, (Web3RPCError, Web3ValueError))
+
+
+def record_request(
+    entity: str,
+    provider: str,
+    seconds: float,
+    error: Optional[Exception] = None,
+    rows: int = 0,
+) -> None:
+    """
+    Record the fetch stage of one RPC request in the provider's series
+    Args:
+        entity: What the request fetches ('transactions', 'logs' or the method)
+        provider: Name of the provider, never its URL (it holds the key)
+        error: Exception the request raised, if any
+        rows: Transactions or logs fetched, counted on success
+    """
+    labels = {"entity": entity, "provider": provider}
+    STAGE_SECONDS.observe(seconds, stage="fetch", **labels)
+    if error is None:
+        status = "ok"
+    else:
+        status = "throttled" if is_throttled(error) else "error"
+    REQUESTS.inc(status=status, **labels)
+    if error is None and rows:
+        STAGE_ROWS.inc(rows, stage="fetch", **labels)
+
+
+def timed_request(send: Callable, entity: str, provider: str, rows: int = 0):
+    """Call send(), recording it with record_request"""
+    started = time.perf_counter()
+    try:
+        result = send()
+    except Exception as e:
+        record_request(entity, provider, time.perf_counter() - started, error=e)
+        raise
+    record_request(entity, provider, time.perf_counter() - started, rows=rows)
+    return result
+
+
+def limited(w3, send: Callable):
+    """Send one HTTP request to the endpoint through its adaptive rate limiter"""
+    limiter = get_rate_limiter(
+        w3.provider.endpoint_uri, rate=RPC_RATE, max_rate=RPC_MAX_RATE
+    )
+    limiter.acquire()
+    started = time.monotonic()
+    try:
+        result = send()
+    except Exception as e:
+        if is_throttled(e):
+            limiter.record_throttle()
+        raise
+    limiter.record_success(time.monotonic() - started)
+    return result
+
+
+def send_request(
+    w3, send: Callable, cost: int = 1, entity: str = "rpc", rows: int = 0
+):
+    """
+    Send a request with a Web3 client, or with a client drawn from a provider
+    pool (see provider_pool), which fails over to another provider when one
+    is down
+    Args:
+        send: Sends the request with the client it is given
+        cost: JSON-RPC calls in the request, charged to the pool's quota
+        entity: Label of the request in the metrics
+        rows: Transactions or logs the request fetches, for the metrics
+    """
+    if isinstance(w3, Web3):
+        provider = urlparse(w3.provider.endpoint_uri).netloc
+        return timed_request(
+            lambda: limited(w3, lambda: send(w3)), entity, provider, rows=rows
+        )
+    return w3.request(send, cost=cost, entity=entity, rows=rows)
+
+
+def rpc_call(w3, method: str, *args):
+    """
+    Call a w3.eth method through the endpoint's adaptive rate limiter instead
+    of sleeping between calls
+    """
+    return send_request(
+        w3, lambda client: getattr(client.eth, method)(*args), entity=method
+    )
+
+
+def _fetch_batch(w3, tx_hashes: List[str]) -> List:
+    def send(client):
+        with client.batch_requests() as batch:
+            for tx_hash in tx_hashes:
+                batch.add(client.eth.get_transaction(tx_hash))
+                batch.add(client.eth.get_transaction_receipt(tx_hash))
+            return batch.execute()
+
+    return send_request(
+        w3, send, cost=2 * len(tx_hashes), entity="transactions", rows=len(tx_hashes)
+    )
+
+
+def fetch_transactions_with_receipts(
+    w3, tx_hashes: List[str], batch_size: Optional[int] = None
+) -> Dict[str, Union[Tuple, Exception]]:
+    """
+    Fetch the transaction and receipt of every hash, packing the two calls of
+    up to batch_size (RPC_BATCH_SIZE) hashes into one JSON-RPC batch request.
+    Responses are matched to their requests by id. A batch fails as a whole
+    when one of its calls fails (e.g. an unknown hash), so it is split in
+    halves and retried until the error is down to the hash it belongs to.
+    Provider errors (throttling, outages, exhausted pool) are raised as they
+    are: splitting the batch would only multiply the failing requests.
+    Returns hash -> (transaction, receipt), or the exception raised for it.
+    """
+    batch_size = batch_size or RPC_BATCH_SIZE
+    results: Dict[str, Union[Tuple, Exception]] = {}
+    pending = [
+        tx_hashes[i : i + batch_size] for i in range(0, len(tx_hashes), batch_size)
+    ]
+    while pending:
+        chunk = pending.pop()
+        try:
+            responses = _fetch_batch(w3, chunk)
+        except Exception as e:
+            if not is_request_error(e):
+                raise
+            if len(chunk) == 1:
+                results[chunk[0]] = e
+            else:
+                middle = len(chunk) // 2
+                pending.extend([chunk[middle:], chunk[:middle]])
+            continue
+        for i, tx_hash in enumerate(chunk):
+            results[tx_hash] = (responses[2 * i], responses[2 * i + 1])
+    return results
@@ -4,51 +4,37 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 from json import load
-import pprint
+import logging
+import sys
 import threading
 import requests
 import time
-from pymongo import MongoClient, UpdateOne
+from pymongo import UpdateOne
 from web3 import Web3
-from web3.middleware import ExtraDataToPOAMiddleware
 from tqdm import tqdm
 import os
 from collections import defaultdict
 from functools import partial
 from dotenv import load_dotenv
 
-db = MongoClient("mongodb://localhost:27017/")["polygon_polymarket"]
-
-load_dotenv()
-POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
-
-w31 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w31")}")
+# utils.logs lives with the subgraph ingestion utils
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "the-graph")
 )
 
-w32 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w32")}")
-)
+from rpc_client import get_mongo_client, rpc_call
+from provider_pool import get_provider_pool
+from utils.logs import configure_logging
 
-w33 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w33")}")
-)
-
-w34 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w34")}")
-)
+logger = logging.getLogger(__name__)
 
-w35 = Web3(
-    Web3.HTTPProvider(f"https://polygon-mainnet.g.alchemy.com/v2/{os.getenv("w35")}")
-)
+db = get_mongo_client()["polygon_polymarket"]
 
-w31.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w32.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w33.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w34.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
-w35.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+load_dotenv()
+POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
 
-w3_providers = [w31, w32, w33, w34, w35]
+# Every request draws its provider from the shared pool
+pool = get_provider_pool()
 
 
 def get_contract_creation_hash(fpmm_addresses):
@@ -78,7 +64,7 @@ def add_creation_hashes():
                 {"fpmm_address": result["contractAddress"].lower()},
                 {"$set": {"creation_transaction_hash": result["txHash"]}},
             )
-        print(f"Processed {i} of {len(all_fpmms)}")
+        logger.info("Processed FPMMs", extra={"processed": i, "total": len(all_fpmms)})
         time.sleep(0.2)
 
 
@@ -98,9 +84,9 @@ def add_creation_timestamps():
     count = 0
 
     for fpmm in all_fpmms:
-        tx = w31.eth.get_transaction(fpmm["creation_transaction_hash"])
+        tx = rpc_call(pool, "get_transaction", fpmm["creation_transaction_hash"])
         blockNumber = tx["blockNumber"]
-        block = w32.eth.get_block(blockNumber)
+        block = rpc_call(pool, "get_block", blockNumber)
         timestamp = block["timestamp"]
 
         updates.append(
@@ -119,11 +105,13 @@ def add_creation_timestamps():
         )
 
         count += 1
-        print(f"Processed {count} of {len(all_fpmms)}")
+        logger.info(
+            "Processed FPMMs", extra={"processed": count, "total": len(all_fpmms)}
+        )
         # Bulk update all at once
         if len(updates) >= 100:
             result = db.fpmms.bulk_write(updates)
-            print(f"Updated {result.modified_count} records")
+            logger.info("Updated FPMMs", extra={"updated": result.modified_count})
             updates = []
 
 
@@ -134,24 +122,29 @@ def get_active_clob_fpmms():
             {"creation_date": {"$gte": "2023-01-01"}, "total_interactions": {"$gt": 0}}
         )
     )
-    pprint.pprint(all_fpmms[0])
+    logger.info("First active FPMM", extra={"fpmm": all_fpmms[0]})
     checksum_address = Web3.to_checksum_address(
         "0x0095a54a4c548362d69a5aea8d2f1664f86cfdc6"
     )
-    tx_count = w31.eth.get_transaction_count(checksum_address)
-    print(tx_count)
+    tx_count = rpc_call(pool, "get_transaction_count", checksum_address)
+    logger.info(
+        "Transaction count",
+        extra={"address": checksum_address, "transactions": tx_count},
+    )
 
 
 def fetch_block_timestamps(block_numbers, w3, pbar):
-    """Fetches timestamps for a list of block numbers using a single w3 provider."""
+    """Fetches timestamps for a list of block numbers, w3 being a client or the pool."""
     block_timestamps = {}
     for block_num in block_numbers:
         try:
-            block = w3.eth.get_block(block_num)
+            block = rpc_call(w3, "get_block", block_num)
             block_timestamps[block_num] = block["timestamp"]
-            time.sleep(0.1)  # Small delay to avoid rate limits
         except Exception as e:
-            print(f"Error fetching block {block_num}: {e}")
+            logger.warning(
+                "Error fetching block",
+                extra={"block_number": block_num, "error": str(e)},
+            )
             # Handle error, maybe store failed block numbers or skip
             pass  # Or handle more robustly
         if pbar:
@@ -160,12 +153,10 @@ def fetch_block_timestamps(block_numbers, w3, pbar):
 
 
 def populate_timestamps_for_events():
-    client = MongoClient(
-        "mongodb://localhost:27017/"
-    )  # Assuming client is initialized here or globally
+    client = get_mongo_client()
     db = client["polygon_polymarket"]
 
-    print("Fetching events without timestamps...")
+    logger.info("Fetching events without timestamps")
     # Fetch events, but only the blockNumber and _id
     # We fetch transaction_hash as well, as it might be indexed and used elsewhere
     events_to_update = list(
@@ -173,10 +164,12 @@ def populate_timestamps_for_events():
             {"timestamp": {"$exists": False}}, {"blockNumber": 1, "transaction_hash": 1}
         ).limit(200000)
     )
-    print(f"Found {len(events_to_update)} events requiring timestamp updates.")
+    logger.info(
+        "Events requiring timestamp updates", extra={"events": len(events_to_update)}
+    )
 
     if not events_to_update:
-        print("No events found without timestamps. Exiting.")
+        logger.info("No events found without timestamps, exiting")
         return
 
     # Get unique block numbers
@@ -187,14 +180,14 @@ def populate_timestamps_for_events():
             if event.get("blockNumber") is not None
         )
     )
-    print(f"Found {len(unique_block_numbers)} unique block numbers.")
+    logger.info("Unique block numbers", extra={"blocks": len(unique_block_numbers)})
 
     if not unique_block_numbers:
-        print("No valid block numbers found in events. Exiting.")
+        logger.info("No valid block numbers found in events, exiting")
         return
 
-    # Divide unique block numbers evenly among providers
-    num_providers = len(w3_providers)  # Use your global providers list
+    # Divide unique block numbers evenly among workers, one per provider
+    num_providers = pool.size
     n = len(unique_block_numbers)
     # Calculate chunk size, ensuring roughly even distribution
     chunk_size = (n + num_providers - 1) // num_providers
@@ -206,8 +199,12 @@ def populate_timestamps_for_events():
     # Filter out any empty chunks that might result if n < num_providers
     block_number_chunks = [chunk for chunk in block_number_chunks if chunk]
 
-    print(
-        f"Fetching timestamps for {len(unique_block_numbers)} unique blocks divided into {len(block_number_chunks)} chunks..."
+    logger.info(
+        "Fetching block timestamps",
+        extra={
+            "blocks": len(unique_block_numbers),
+            "chunks": len(block_number_chunks),
+        },
     )
     block_timestamp_map = {}
     error_block_numbers = []
@@ -217,14 +214,9 @@ def populate_timestamps_for_events():
 
     with ThreadPoolExecutor(max_workers=num_providers) as executor:
         futures = []
-        for i, chunk in enumerate(block_number_chunks):
-            provider_idx = i % num_providers
+        for chunk in block_number_chunks:
             # Use partial to pass the same pbar to each thread
-            futures.append(
-                executor.submit(
-                    fetch_block_timestamps, chunk, w3_providers[provider_idx], pbar
-                )
-            )
+            futures.append(executor.submit(fetch_block_timestamps, chunk, pool, pbar))
 
         for future in as_completed(futures):
             result = future.result()
@@ -233,10 +225,10 @@ def populate_timestamps_for_events():
 
     pbar.close()
 
-    print(f"Fetched timestamps for {len(block_timestamp_map)} blocks.")
+    logger.info("Fetched block timestamps", extra={"blocks": len(block_timestamp_map)})
     # Optionally handle blocks that failed to fetch timestamps
 
-    print("Generating update operations and performing bulk writes...")
+    logger.info("Generating update operations and performing bulk writes")
     updates = []
     bulk_write_chunk_size = 2000  # Define bulk write size
     total_updated = 0
@@ -261,9 +253,8 @@ def populate_timestamps_for_events():
                 try:
                     result = db.FPMMFundingRemoved.bulk_write(updates, ordered=False)
                     total_updated += result.modified_count
-                    # print(f"Bulk wrote {result.modified_count} timestamp updates.")
                 except Exception as e:
-                    print(f"Error during bulk write: {e}")
+                    logger.error("Error during bulk write", extra={"error": str(e)})
                     # Handle bulk write errors (e.g., log failed updates)
                 updates = []
 
@@ -272,17 +263,15 @@ def populate_timestamps_for_events():
         try:
             result = db.FPMMFundingRemoved.bulk_write(updates, ordered=False)
             total_updated += result.modified_count
-            # print(f"Final bulk wrote {result.modified_count} timestamp updates.")
         except Exception as e:
-            print(f"Error during final bulk write: {e}")
+            logger.error("Error during final bulk write", extra={"error": str(e)})
             # Handle bulk write errors
 
-    print(
-        f"Finished populating timestamps. Total events potentially updated: {total_updated}"
-    )
+    logger.info("Finished populating timestamps", extra={"updated": total_updated})
 
 
 if __name__ == "__main__":
+    configure_logging()
     # add_creation_hashes()
     # add_creation_timestamps()
     # get_active_clob_fpmms()
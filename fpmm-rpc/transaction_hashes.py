@@ -2,14 +2,14 @@
 # counts them, and stores them in a separate collection. It also includes functionality to handle
 # transactions related to merges and splits, ensuring that all unique transaction hashes are captured
 
-from pymongo import MongoClient
+from rpc_client import get_mongo_client
 from web3 import Web3
 import time
 from bson import ObjectId
 
 
 def get_transaction_counts():
-    client = MongoClient("mongodb://localhost:27017/")
+    client = get_mongo_client()
     db = client["polygon_polymarket"]
 
     # Get unique transaction hashes for each collection
@@ -51,7 +51,7 @@ def get_transaction_counts():
 
 
 def store_transaction_hashes():
-    client = MongoClient("mongodb://localhost:27017/")
+    client = get_mongo_client()
     db = client["the-graph-polymarket-orderbook"]
     db_polygon = client["polygon_polymarket"]
 
@@ -63,8 +63,8 @@ def store_transaction_hashes():
         [
             {
                 "$match": {
-                    "timestamp": {"$lt": "1704067200"},
-                    "condition.id": {"$in": condition_ids},
+                    "timestamp": {"$lt": 1704067200},
+                    "condition": {"$in": condition_ids},
                 }
             },
             {"$group": {"_id": "$id"}},
@@ -79,8 +79,8 @@ def store_transaction_hashes():
         [
             {
                 "$match": {
-                    "timestamp": {"$lt": "1704067200"},
-                    "condition.id": {"$in": condition_ids},
+                    "timestamp": {"$lt": 1704067200},
+                    "condition": {"$in": condition_ids},
                 }
             },
             {"$group": {"_id": "$id"}},
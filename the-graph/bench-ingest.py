@@ -0,0 +1,167 @@
+import os
+import argparse
+from dotenv import load_dotenv
+from utils.benchmark import append_result, load_results, previous_result, run_benchmark
+from utils.logs import configure_logging
+from utils.metrics import export_metrics
+from utils.registry import ENTITIES
+from utils.replay_server import ReplayServer, record_entity, recording_path
+from utils.storage import open_storage
+
+# Recorded subgraph rows replayed by the benchmark
+RECORDINGS_DIR = "bench-recordings"
+# Results of every run, one JSON line each, compared across commits
+RESULTS_PATH = "bench-results.jsonl"
+
+# Measurements compared with the previous run, and whether higher is better
+COMPARED = {
+    "rows_per_second": True,
+    "page_latency_p50": False,
+    "page_latency_p99": False,
+    "write_seconds": False,
+}
+
+
+def record(names, api_key, directory, limit):
+    """Record the entities from the live gateway"""
+    for name in names:
+        total_recorded = record_entity(directory, name, api_key, limit=limit)
+        print(f"Recorded {name}: {total_recorded} rows")
+
+
+def report(entry, previous):
+    """Print a result next to the previous one measured with the same settings"""
+    print(
+        f"{entry['entity']}: {entry['rows']} rows in {entry['seconds']}s, "
+        f"{entry['requests']} requests ({entry['errors']} errors, "
+        f"{entry['throttled']} throttled)"
+    )
+    for field, higher_is_better in COMPARED.items():
+        value = entry[field]
+        line = f"  {field}: {value}"
+        if previous and previous.get(field) and value is not None:
+            change = (value - previous[field]) / previous[field] * 100
+            better = (change > 0) == higher_is_better
+            line += (
+                f" ({change:+.1f}% vs {previous['commit']}, "
+                f"{'better' if better else 'worse'})"
+            )
+        print(line)
+
+
+def main():
+    load_dotenv()
+    configure_logging()
+    export_metrics()
+
+    parser = argparse.ArgumentParser(
+        description="Measure ingestion throughput against a local replay of "
+        "recorded subgraph pages"
+    )
+    parser.add_argument(
+        "entities",
+        nargs="*",
+        metavar="ENTITY",
+        help="Entities to benchmark (defaults to every recorded one)",
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Record the entities from the live gateway instead (needs API_KEY)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=100_000,
+        help="Rows recorded per entity",
+    )
+    parser.add_argument("--recordings", default=RECORDINGS_DIR, metavar="DIR")
+    parser.add_argument("--results", default=RESULTS_PATH, metavar="PATH")
+    parser.add_argument(
+        "--storage",
+        metavar="URI",
+        help="Storage written to (defaults to STORAGE_URI, then MONGO_URI); "
+        "benchmark collections live in bench-* databases",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Backfill timestamp entities using N concurrent windows each",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds added per response"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.05, help="Random seconds added on top"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests failing with HTTP 502",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Requests per second served before answering HTTP 429",
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.entities if name not in ENTITIES]
+    if unknown:
+        parser.error(
+            f"unknown entities {', '.join(unknown)} "
+            f"(choose from {', '.join(sorted(ENTITIES))})"
+        )
+
+    if args.record:
+        api_key = os.getenv("API_KEY")
+        if not api_key and not os.getenv("API_KEYS"):
+            raise ValueError("API_KEY or API_KEYS not found in environment variables")
+        record(args.entities or list(ENTITIES), api_key, args.recordings, args.limit)
+        return
+
+    names = args.entities or [
+        name
+        for name, spec in ENTITIES.items()
+        if os.path.exists(
+            recording_path(args.recordings, spec.subgraph_url, spec.entity)
+        )
+    ]
+    if not names:
+        parser.error(f"no recordings in {args.recordings}, run with --record first")
+
+    storage = open_storage(args.storage)
+    storage_uri = args.storage or os.getenv("STORAGE_URI") or os.getenv("MONGO_URI")
+    config = {
+        "shards": args.shards,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "rate_limit": args.rate_limit,
+        "storage": storage_uri.split(":", 1)[0],
+    }
+    results = load_results(args.results)
+
+    server = ReplayServer(
+        args.recordings,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+    ).start()
+    # Every query of this process goes to the replay server
+    os.environ["GATEWAY_URLS"] = server.url
+    os.environ.pop("API_KEY_BUDGET", None)
+    try:
+        for name in names:
+            result = run_benchmark(server, storage, name, shards=args.shards)
+            entry = append_result(args.results, result, config)
+            report(entry, previous_result(results, entry))
+    finally:
+        storage.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# This script brings collections written by earlier versions of the ingest
+# scripts to the schema declared in utils/registry.py: nested `{id}`
+# references become bare ids, fields nothing reads are removed, and
+# BigInt/BigDecimal fields stored as strings become BSON numbers.
+
+import argparse
+import logging
+from dotenv import load_dotenv
+from utils.database import get_database_connection
+from utils.logs import configure_logging
+from utils.registry import ENTITIES, EntitySpec
+from utils.schema import (
+    migration_filter,
+    migration_pipeline,
+    reference_filter,
+    reference_pipeline,
+)
+
+logger = logging.getLogger("migrate-schema")
+
+
+def migrate_entity(collection, spec: EntitySpec, dry_run: bool = False) -> None:
+    """Flatten references, drop unused fields and convert numeric fields in place"""
+    steps = []
+    for name in spec.references:
+        steps.append(
+            (name, "flatten", reference_filter(name), reference_pipeline(name))
+        )
+    for name in spec.dropped_fields:
+        steps.append(
+            (name, "drop", {name: {"$exists": True}}, {"$unset": {name: ""}})
+        )
+    for name, kind in spec.numeric_fields.items():
+        steps.append(
+            (name, kind, migration_filter(name), migration_pipeline(name, kind))
+        )
+
+    for name, action, query, update in steps:
+        if dry_run:
+            count = collection.count_documents(query)
+            logger.info(
+                "Documents to migrate",
+                extra={
+                    "collection": collection.name,
+                    "field": name,
+                    "action": action,
+                    "documents": count,
+                },
+            )
+            continue
+
+        result = collection.update_many(query, update)
+        logger.info(
+            "Migrated",
+            extra={
+                "collection": collection.name,
+                "field": name,
+                "action": action,
+                "documents": result.modified_count,
+            },
+        )
+
+    if spec.indexes and not dry_run:
+        collection.create_indexes(spec.indexes)
+
+
+def main():
+    load_dotenv()
+    configure_logging()
+
+    parser = argparse.ArgumentParser(
+        description="Migrate stored subgraph entities to the registry schema"
+    )
+    parser.add_argument(
+        "entities",
+        nargs="*",
+        metavar="ENTITY",
+        help="Entities to migrate (defaults to all of them)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only count documents to migrate"
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.entities if name not in ENTITIES]
+    if unknown:
+        parser.error(
+            f"unknown entities {', '.join(unknown)} "
+            f"(choose from {', '.join(sorted(ENTITIES))})"
+        )
+
+    client = get_database_connection()
+    try:
+        for name in args.entities or list(ENTITIES):
+            spec = ENTITIES[name]
+            logger.info("Migrating", extra={"entity": name})
+            collection = client[spec.db_name][spec.collection_name]
+            migrate_entity(collection, spec, dry_run=args.dry_run)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
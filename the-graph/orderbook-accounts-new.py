@@ -1,91 +1,43 @@
 import os
-import time
+import logging
 from dotenv import load_dotenv
-from utils.database import database_connection, store_batch_to_mongodb
-from utils.subgraph_query import query_subgraph
+from utils.storage import storage_connection
+from utils.ingest import ingest_entity
+from utils.registry import ENTITIES
+from utils.logs import configure_logging
+from utils.metrics import export_metrics
 
-# Database configuration
-DB_NAME = "the-graph-polymarket-orderbook"
-COLLECTION_NAME = "accounts"
+# Entity declaration: query fields, subgraph, database and indexes
+SPEC = ENTITIES['accounts']
 
-# The Graph API endpoint
-SUBGRAPH_URL = "https://gateway.thegraph.com/api/{}/subgraphs/id/81Dm16JjuFSrqz813HysXoUPvzTwE7fsfPk2RTf66nyC"
+logger = logging.getLogger("orderbook-accounts-new")
 
-# Define the GraphQL query
-ACCOUNTS_QUERY = """
-    query GetAccounts($skip: Int!) {
-        accounts(
-            first: 1000,
-            orderBy: id,
-            orderDirection: asc,
-            skip: $skip
-        ) {
-            id
-            creationTimestamp
-            lastSeenTimestamp
-            collateralVolume
-            scaledCollateralVolume
-            profit
-            numTrades
-            lastTradedTimestamp
-            fpmmPoolMemberships {
-                id
-            }
-            scaledProfit
-        }
-    }
-"""
 
 def process_accounts() -> None:
     """
-    Process all accounts with pagination and store in MongoDB
+    Process all accounts with keyset pagination and store in MongoDB
     """
     api_key = os.getenv('API_KEY')
     if not api_key:
         raise ValueError("API_KEY not found in environment variables")
 
-    with database_connection(DB_NAME, COLLECTION_NAME) as collection:
-        # Create index for better performance
-        collection.create_index('id', unique=True)
-        
-        skip = 0
-        total_processed = 0
-        
-        while True:
-            print(f"Fetching records with skip={skip}")
-            result = query_subgraph(
-                query=ACCOUNTS_QUERY,
-                variables={'skip': skip},
-                subgraph_url=SUBGRAPH_URL,
-                api_key=api_key
-            )
-            
-            if not result or 'data' not in result or not result['data']['accounts']:
-                print("No more data to fetch")
-                break
-            
-            current_batch = result['data']['accounts']
-            store_batch_to_mongodb(collection, current_batch)
-            
-            total_processed += len(current_batch)
-            print(f"Total accounts processed: {total_processed}")
-            
-            if len(current_batch) < 1000:  # Less than max results means we're done
-                break
-            
-            skip += 1000
-            time.sleep(0.1)  # Rate limiting
+    with storage_connection(SPEC.db_name, SPEC.collection_name) as collection:
+        total_processed = ingest_entity(SPEC, collection, api_key)
+        logger.info("Total accounts processed", extra={"processed": total_processed})
 
 def main():
     load_dotenv()
+    configure_logging()
+    export_metrics()
     
     try:
-        print("Starting to process accounts...")
+        logger.info("Starting to process accounts")
         process_accounts()
-        print("Completed processing all accounts")
+        logger.info("Completed processing all accounts")
     
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
+    except Exception:
+        logger.exception("An error occurred")
+        exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,104 +1,62 @@
 import os
-import time
+import logging
+import argparse
+from typing import Optional
 from dotenv import load_dotenv
-from utils.database import database_connection, store_batch_to_mongodb
-from utils.subgraph_query import query_subgraph
+from utils.storage import storage_connection
+from utils.ingest import ingest_entity
+from utils.registry import ENTITIES
+from utils.logs import configure_logging
+from utils.metrics import export_metrics
 
-# Database configuration
-DB_NAME = "the-graph-polymarket-orderbook"
-COLLECTION_NAME = "splits"
+# Entity declaration: query fields, subgraph, database and indexes
+SPEC = ENTITIES['splits']
 
-# The Graph API endpoint
-SUBGRAPH_URL = "https://gateway.thegraph.com/api/{}/subgraphs/id/81Dm16JjuFSrqz813HysXoUPvzTwE7fsfPk2RTf66nyC"
+logger = logging.getLogger("orderbook-splits")
 
-# Define the GraphQL query
-SPLITS_QUERY = """
-    query GetSplits($timestamp: Int!) {
-        splits(
-            first: 1000,
-            orderBy: timestamp,
-            orderDirection: asc,
-            where: { timestamp_gte: $timestamp }
-        ) {
-            timestamp
-            partition
-            parentCollectionId
-            id
-            amount
-            stakeholder {
-                id
-            }
-            condition {
-                id
-            }
-            collateralToken {
-                id
-            }
-        }
-    }
-"""
 
-def get_last_timestamp(collection) -> int:
-    """Get the highest timestamp from the collection"""
-    last_record = collection.find_one(sort=[("timestamp", -1)])
-    return int(last_record["timestamp"]) if last_record else 0
-
-def process_splits() -> None:
+def process_splits(shards: int = 1, start: Optional[int] = None) -> None:
     """
-    Process all splits with pagination and store in MongoDB
+    Process all splits with (timestamp, id) pagination and store in MongoDB
+    Args:
+        shards: Number of timestamp windows to backfill concurrently
+        start: Timestamp to start the backfill from (defaults to the first in the subgraph)
     """
     api_key = os.getenv('API_KEY')
     if not api_key:
         raise ValueError("API_KEY not found in environment variables")
 
-    with database_connection(DB_NAME, COLLECTION_NAME) as collection:
-        # Create indexes for better performance
-        collection.create_index('id', unique=True)
-        collection.create_index('timestamp')
-        
-        # Get the last processed timestamp
-        last_timestamp = get_last_timestamp(collection)
-        if last_timestamp:
-            print(f"Resuming from timestamp: {last_timestamp}")
-        
-        total_processed = 0
-        
-        while True:
-            print(f"Fetching records from timestamp: {last_timestamp}")
-            result = query_subgraph(
-                query=SPLITS_QUERY,
-                variables={'timestamp': last_timestamp},
-                subgraph_url=SUBGRAPH_URL,
-                api_key=api_key
-            )
-            
-            if not result or 'data' not in result or not result['data']['splits']:
-                print("No more data to fetch")
-                break
-            
-            current_batch = result['data']['splits']
-            store_batch_to_mongodb(collection, current_batch)
-            
-            total_processed += len(current_batch)
-            print(f"Total splits processed: {total_processed}")
-            
-            if len(current_batch) < 1000:  # Less than max results means we're done
-                break
-            
-            # Get the last timestamp from the current batch
-            last_timestamp = int(current_batch[-1]['timestamp'])
-            time.sleep(0.1)  # Rate limiting
+    with storage_connection(SPEC.db_name, SPEC.collection_name) as collection:
+        total_processed = ingest_entity(
+            SPEC, collection, api_key, shards=shards, start=start
+        )
+        logger.info("Total splits processed", extra={"processed": total_processed})
 
 def main():
     load_dotenv()
+    configure_logging()
+    export_metrics()
+
+    parser = argparse.ArgumentParser(description="Fetch splits from The Graph")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Backfill using N concurrent timestamp windows",
+    )
+    parser.add_argument(
+        "--start", type=int, default=None, help="Timestamp to start the backfill from"
+    )
+    args = parser.parse_args()
     
     try:
-        print("Starting to process splits...")
-        process_splits()
-        print("Completed processing all splits")
+        logger.info("Starting to process splits")
+        process_splits(shards=args.shards, start=args.start)
+        logger.info("Completed processing all splits")
     
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
+    except Exception:
+        logger.exception("An error occurred")
+        exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from utils.follow import (
+    POLL_INTERVAL,
+    follow_entities,
+    is_followable,
+    json_lines_consumer,
+)
+from utils.gateway_pool import get_gateway_pool
+from utils.ingest import ingest_entities
+from utils.logs import configure_logging
+from utils.metrics import export_metrics
+from utils.registry import ENTITIES
+from utils.subgraph_query import get_subgraph_head, pin_subgraph
+
+logger = logging.getLogger("sync-all")
+
+
+def follow(parser, args, names, api_key):
+    """Run the entities in follow mode until interrupted"""
+    if args.entities:
+        unfollowable = [name for name in names if not is_followable(ENTITIES[name])]
+        if unfollowable:
+            parser.error(
+                f"cannot follow {', '.join(unfollowable)}, sync them instead"
+            )
+    else:
+        names = [name for name in names if is_followable(ENTITIES[name])]
+
+    consumers = []
+    if args.parquet:
+        # pyarrow is only needed for the Parquet sink
+        from utils.parquet_sink import parquet_consumer
+
+        consumers.append(parquet_consumer(args.parquet))
+    stream = None
+    if args.stream == "-":
+        consumers.append(json_lines_consumer(sys.stdout))
+    elif args.stream:
+        stream = open(args.stream, "a")
+        consumers.append(json_lines_consumer(stream))
+
+    logger.info(
+        "Following entities",
+        extra={"entities": ", ".join(names), "interval": args.interval},
+    )
+    try:
+        follow_entities(names, api_key, interval=args.interval, consumers=consumers)
+    finally:
+        if stream:
+            stream.close()
+
+
+def pin_block(names, api_key, block=None):
+    """
+    Pin the subgraphs of the given entities to one block, by default the
+    latest block every one of them has indexed
+    """
+    subgraph_urls = {ENTITIES[name].subgraph_url for name in names}
+    if block is None:
+        block = min(get_subgraph_head(url, api_key) for url in subgraph_urls)
+
+    for url in subgraph_urls:
+        pin_subgraph(url, block)
+    logger.info(
+        "Pinned subgraphs", extra={"subgraphs": len(subgraph_urls), "block": block}
+    )
+
+
+def ingest_parquet(names, api_key, root):
+    """Fetch the entities concurrently into Parquet files under root"""
+    # pyarrow is only needed for the Parquet sink
+    from utils.parquet_sink import sync_to_parquet
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        futures = {
+            executor.submit(sync_to_parquet, root, name, api_key): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = None
+                logger.exception("Error writing to Parquet", extra={"entity": name})
+    return results
+
+
+def main():
+    load_dotenv()
+    configure_logging()
+
+    parser = argparse.ArgumentParser(
+        description="Ingest every registered subgraph entity concurrently"
+    )
+    parser.add_argument(
+        "entities",
+        nargs="*",
+        metavar="ENTITY",
+        help="Entities to ingest (defaults to all of them)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Backfill timestamp entities using N concurrent windows each",
+    )
+    parser.add_argument(
+        "--no-batch",
+        action="store_true",
+        help="Send one request per entity instead of batching entities that "
+        "share a subgraph",
+    )
+    parser.add_argument(
+        "--block",
+        type=int,
+        help="Read every entity at this block; responses are cached on disk",
+    )
+    parser.add_argument(
+        "--pin-head",
+        action="store_true",
+        help="Pin every entity to the latest block all subgraphs have indexed",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Keep running and poll the subgraph head for new rows",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=POLL_INTERVAL,
+        help="Seconds between polls in follow mode",
+    )
+    parser.add_argument(
+        "--stream",
+        metavar="PATH",
+        help="In follow mode, append new rows as JSON lines to PATH (- for stdout)",
+    )
+    parser.add_argument(
+        "--parquet",
+        metavar="DIR",
+        help="Write day-partitioned Parquet files to DIR instead of MongoDB "
+        "(in follow mode, in addition to MongoDB)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics on this port (defaults to METRICS_PORT)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="Dump Prometheus metrics to PATH periodically and on exit "
+        "(defaults to METRICS_FILE)",
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.entities if name not in ENTITIES]
+    if unknown:
+        parser.error(
+            f"unknown entities {', '.join(unknown)} "
+            f"(choose from {', '.join(sorted(ENTITIES))})"
+        )
+    export_metrics(port=args.metrics_port, path=args.metrics_file)
+
+    api_key = os.getenv("API_KEY")
+    if not api_key and not os.getenv("API_KEYS"):
+        raise ValueError("API_KEY or API_KEYS not found in environment variables")
+
+    names = args.entities or list(ENTITIES)
+    if args.follow:
+        if args.block is not None or args.pin_head:
+            parser.error("--follow reads the subgraph head and cannot be pinned")
+        follow(parser, args, names, api_key)
+        return
+
+    if args.block is not None or args.pin_head:
+        pin_block(names, api_key, args.block)
+
+    logger.info("Starting to ingest", extra={"entities": ", ".join(names)})
+    started = time.time()
+    if args.parquet:
+        results = ingest_parquet(names, api_key, args.parquet)
+    else:
+        results = ingest_entities(
+            names, api_key, shards=args.shards, batch=not args.no_batch
+        )
+    pool = get_gateway_pool()
+    logger.info(
+        "Completed",
+        extra={
+            "seconds": round(time.time() - started, 1),
+            "requests_per_key": pool.usage(),
+        },
+    )
+
+    failed = [name for name, count in results.items() if count is None]
+    if failed:
+        logger.error("Failed entities", extra={"entities": ", ".join(failed)})
+        if pool.is_exhausted():
+            logger.error("Every API key is exhausted, add keys to API_KEYS or wait")
+            exit(2)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 # This script adds the conditionId for FPMMs in a MongoDB collection
 
 import os
-import time
+import logging
 from dotenv import load_dotenv
-from utils.database import database_connection, store_batch_to_mongodb
-from utils.subgraph_query import query_subgraph
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo import UpdateOne
+from utils.database import database_connection
+from utils.logs import configure_logging
+from utils.subgraph_query import query_subgraph_many
+
+logger = logging.getLogger("update_fpmms")
 
 # Database configuration
 DB_NAME = "polygon_polymarket"
@@ -14,61 +17,88 @@ COLLECTION_NAME = "fpmms"
 # The Graph API endpoint
 SUBGRAPH_URL = "https://gateway.thegraph.com/api/{}/subgraphs/id/6c58N5U4MtQE2Y8njfVrrAfRykzfqajMGeTMEvMmskVz"
 
+# Maximum number of FPMM addresses resolved by one query (the gateway's `first` cap)
+BATCH_SIZE = 1000
+
 # Define the GraphQL query
-FPMMS_QUERY = """
-    query GetFPMMs($id: String!) {
+FPMMS_QUERY = f"""
+    query GetFPMMs($ids: [String!]!) {{
         fpmms(
-            where: { id: $id }
-        ) {
+            first: {BATCH_SIZE},
+            where: {{ id_in: $ids }}
+        ) {{
             id
             conditionId
-        }
-    }
+        }}
+    }}
 """
 
 
 def process_fpmms() -> None:
-    """Process the FPMMs using 5 threads"""
+    """Resolve the conditionId of every FPMM still missing one"""
+    load_dotenv()
+    api_key = os.getenv("API_KEY")
+
     with database_connection(DB_NAME, COLLECTION_NAME) as collection:
+        # Only FPMMs without a conditionId, so reruns are nearly free
         fpmms = list(
-            collection.find()
-        )  # Convert cursor to list for safe multi-threading
-        print(f"Total FPMMs: {len(fpmms)}")
-
-        def process_single_fpmm(fpmm):
-            # Fetch data from The Graph
-            data = query_subgraph(
-                FPMMS_QUERY,
-                variables={"id": fpmm["fpmm_address"]},
-                subgraph_url=SUBGRAPH_URL,
-                api_key=os.getenv("API_KEY"),
+            collection.find(
+                {"conditionId": {"$in": [None, ""]}}, {"fpmm_address": 1}
             )
-            # print(data["data"]["fpmms"])
+        )
+        logger.info("FPMMs missing conditionId", extra={"fpmms": len(fpmms)})
+        if not fpmms:
+            return
 
-            # Update the document if data is valid
-            # if data and "fpmms" in data and data["fpmms"]:
-            condition_id = data["data"]["fpmms"][0].get("conditionId")
-            if condition_id:
-                collection.update_one(
-                    {"fpmm_address": fpmm["fpmm_address"]},
-                    {"$set": {"conditionId": condition_id}},
-                )
-                print(f"Updated {fpmm['fpmm_address']} with conditionId {condition_id}")
-            else:
-                print(f"No conditionId found for {fpmm['fpmm_address']}")
-            # else:
-            #     print(f"No data for {fpmm['fpmm_address']}")
+        # Subgraph ids are lowercase addresses
+        addresses = {
+            fpmm["fpmm_address"].lower(): fpmm["fpmm_address"] for fpmm in fpmms
+        }
+        ids = list(addresses)
+        batches = [ids[i : i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
 
-        # Use ThreadPoolExecutor to process in parallel
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(process_single_fpmm, fpmm) for fpmm in fpmms]
-            for future in as_completed(futures):
-                # This will re-raise any exceptions from the threads
-                future.result()
+        # Fetch data from The Graph, one id_in query per batch
+        results = query_subgraph_many(
+            [
+                {
+                    "query": FPMMS_QUERY,
+                    "variables": {"ids": batch},
+                    "subgraph_url": SUBGRAPH_URL,
+                    "api_key": api_key,
+                }
+                for batch in batches
+            ]
+        )
 
-    # Store in MongoDB
-    # store_batch_to_mongodb(data, collection)
+        operations = []
+        for batch, data in zip(batches, results):
+            if isinstance(data, Exception):
+                logger.error(
+                    "Failed to resolve a batch of FPMMs",
+                    extra={"fpmms": len(batch), "error": str(data)},
+                )
+                continue
+            for fpmm in data["data"]["fpmms"]:
+                condition_id = fpmm.get("conditionId")
+                if condition_id:
+                    operations.append(
+                        UpdateOne(
+                            {"fpmm_address": addresses[fpmm["id"]]},
+                            {"$set": {"conditionId": condition_id}},
+                        )
+                    )
+
+        if operations:
+            result = collection.bulk_write(operations, ordered=False)
+            logger.info(
+                "Updated FPMMs with their conditionId",
+                extra={"fpmms": result.modified_count},
+            )
+        logger.info(
+            "No conditionId found", extra={"fpmms": len(fpmms) - len(operations)}
+        )
 
 
 if __name__ == "__main__":
+    configure_logging()
     process_fpmms()
@@ -0,0 +1,170 @@
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.checkpoint import clear_checkpoint, load_checkpoint, save_checkpoint
+from utils.pipeline import run_pipeline, write_batch
+from utils.schema import DocumentSchema
+from utils.pagination import build_timestamp_query, iter_timestamp_pages
+from utils.storage import StorageCollection
+from utils.subgraph_query import query_subgraph, selection_rows
+
+# Checkpoint name of the windows of an unfinished backfill (and prefix of theirs)
+BACKFILL_CHECKPOINT = "backfill"
+# Cursor of a window that was fetched completely
+WINDOW_DONE = "done"
+
+logger = logging.getLogger(__name__)
+
+
+def split_time_windows(start: int, end: int, shards: int) -> List[Tuple[int, int]]:
+    """
+    Split [start, end) into at most `shards` contiguous, non-overlapping windows
+    """
+    if end <= start:
+        return []
+    shards = max(1, min(shards, end - start))
+    width = (end - start + shards - 1) // shards
+    return [(lo, min(lo + width, end)) for lo in range(start, end, width)]
+
+
+def get_first_timestamp(
+    entity: str, fields: str, subgraph_url: str, api_key: str
+) -> Optional[int]:
+    """Get the lowest timestamp the subgraph holds for an entity"""
+    result = query_subgraph(
+        query=build_timestamp_query(entity, fields, page_size=1),
+        variables={"timestamp": 0, "id": "", "timestampEnd": int(time.time()) + 1},
+        subgraph_url=subgraph_url,
+        api_key=api_key,
+    )
+    rows = selection_rows(result, entity)
+    return int(rows[0]["timestamp"]) if rows else None
+
+
+def fetch_window(
+    collection: StorageCollection,
+    entity: str,
+    fields: str,
+    window: Tuple[int, int],
+    subgraph_url: str,
+    api_key: str,
+    write_mode: str = "upsert",
+    schema: Optional[DocumentSchema] = None,
+) -> int:
+    """
+    Page through a single [start, end) timestamp window with its own cursor
+    and store every page in the collection. The window's cursor is
+    checkpointed after every write, so an interrupted window resumes exactly
+    where it stopped. Returns the number of records stored.
+    """
+    window_start, window_end = window
+    checkpoint = f"{BACKFILL_CHECKPOINT}:{window_start}"
+    cursor = load_checkpoint(collection, checkpoint)
+    if cursor == WINDOW_DONE:
+        logger.info("Window already done", extra={"entity": entity, "window": window})
+        return 0
+    start, start_id = cursor or (window_start, "")
+
+    def write(batch: List[Dict]) -> None:
+        write_batch(collection, entity, batch, write_mode, schema)
+        last = batch[-1]
+        save_checkpoint(collection, checkpoint, [int(last["timestamp"]), last["id"]])
+
+    pages = iter_timestamp_pages(
+        entity,
+        fields,
+        subgraph_url,
+        api_key,
+        start=start,
+        start_id=start_id,
+        end=window_end,
+    )
+    total_processed = run_pipeline(pages, write)
+    save_checkpoint(collection, checkpoint, WINDOW_DONE)
+
+    logger.info(
+        "Window done",
+        extra={"entity": entity, "window": window, "processed": total_processed},
+    )
+    return total_processed
+
+
+def backfill_by_timestamp(
+    collection: StorageCollection,
+    entity: str,
+    fields: str,
+    subgraph_url: str,
+    api_key: str,
+    shards: int,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    write_mode: str = "upsert",
+    schema: Optional[DocumentSchema] = None,
+) -> int:
+    """
+    Backfill an entity by splitting [start, end) into timestamp windows that
+    are fetched concurrently and stored into the same collection.
+    The windows are checkpointed: after a failure, the next backfill of the
+    collection reuses them and resumes each one from its own cursor.
+    Args:
+        shards: Number of windows fetched in parallel
+        start: First timestamp to fetch (defaults to the first one in the subgraph)
+        end: Timestamp to stop at (defaults to now)
+        write_mode: Write mode passed to StorageCollection.store_batch
+        schema: Normalization applied before writing (see utils.schema)
+    """
+    plan = load_checkpoint(collection, BACKFILL_CHECKPOINT)
+    if plan:
+        windows = [(window_start, window_end) for window_start, window_end in plan]
+        logger.info(
+            "Resuming interrupted backfill",
+            extra={"entity": entity, "windows": len(windows)},
+        )
+    else:
+        if start is None:
+            start = get_first_timestamp(entity, fields, subgraph_url, api_key)
+            if start is None:
+                logger.info("Nothing to backfill", extra={"entity": entity})
+                return 0
+        if end is None:
+            end = int(time.time()) + 1
+
+        windows = split_time_windows(start, end, shards)
+        if not windows:
+            return 0
+        save_checkpoint(collection, BACKFILL_CHECKPOINT, [list(w) for w in windows])
+        logger.info(
+            "Backfilling",
+            extra={
+                "entity": entity,
+                "start": start,
+                "end": end,
+                "windows": len(windows),
+            },
+        )
+
+    total_processed = 0
+    with ThreadPoolExecutor(max_workers=len(windows)) as executor:
+        futures = [
+            executor.submit(
+                fetch_window,
+                collection,
+                entity,
+                fields,
+                window,
+                subgraph_url,
+                api_key,
+                write_mode,
+                schema,
+            )
+            for window in windows
+        ]
+        for future in as_completed(futures):
+            total_processed += future.result()
+
+    # Every window is done, the next backfill starts a new plan
+    for window_start, _ in windows:
+        clear_checkpoint(collection, f"{BACKFILL_CHECKPOINT}:{window_start}")
+    clear_checkpoint(collection, BACKFILL_CHECKPOINT)
+    return total_processed
@@ -0,0 +1,156 @@
+import json
+import os
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from utils.checkpoint import CHECKPOINT_COLLECTION
+from utils.ingest import ingest_entity
+from utils.registry import ENTITIES
+from utils.replay_server import ReplayServer, subgraph_id
+from utils.storage import Storage, StorageCollection
+
+# Prefix of the databases benchmark runs write to
+BENCH_DB_PREFIX = "bench-"
+
+
+class TimedCollection(StorageCollection):
+    """StorageCollection wrapper adding up the time spent in bulk writes"""
+
+    def __init__(self, collection: StorageCollection):
+        self.collection = collection
+        self.name = collection.name
+        self.write_seconds = 0.0
+        self.writes = 0
+
+    def store_batch(self, records: List[Dict], mode: str = "upsert") -> Dict[str, int]:
+        started = time.perf_counter()
+        try:
+            return self.collection.store_batch(records, mode=mode)
+        finally:
+            self.write_seconds += time.perf_counter() - started
+            self.writes += 1
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        return self.collection.find(query, projection, sort, limit)
+
+    def count_documents(self, query: Dict) -> int:
+        return self.collection.count_documents(query)
+
+    def distinct(self, field: str, query: Optional[Dict] = None) -> List[Any]:
+        return self.collection.distinct(field, query)
+
+    def group_sum(self, group_field, sum_field, query=None):
+        return self.collection.group_sum(group_field, sum_field, query)
+
+    def delete_many(self, query: Dict) -> int:
+        return self.collection.delete_many(query)
+
+    def create_indexes(self, indexes) -> None:
+        self.collection.create_indexes(indexes)
+
+    def sibling(self, name: str) -> StorageCollection:
+        return self.collection.sibling(name)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in [0, 100]) of a list of values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def _round(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds, 4)
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree, suffixed with '-dirty' when it has changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def run_benchmark(
+    server: ReplayServer, storage: Storage, name: str, shards: int = 1
+) -> Dict:
+    """
+    Ingest a registered entity from the replay server into an emptied
+    benchmark collection and measure it. The gateway pool must already point
+    at the server (GATEWAY_URLS).
+    Returns rows/s, page latency percentiles (seconds, as served) and the
+    time spent in bulk writes.
+    """
+    spec = ENTITIES[name]
+    recorded = server.entity(subgraph_id(spec.subgraph_url), spec.entity)
+    recorded.sorted_by(spec.cursor)  # Sort before the clock starts
+
+    collection = storage.collection(
+        f"{BENCH_DB_PREFIX}{spec.db_name}", spec.collection_name
+    )
+    collection.delete_many({})
+    collection.sibling(CHECKPOINT_COLLECTION).delete_many({})
+    timed = TimedCollection(collection)
+
+    server.reset_stats()
+    started = time.perf_counter()
+    rows = ingest_entity(spec, timed, api_key="bench", shards=shards)
+    seconds = time.perf_counter() - started
+
+    return {
+        "entity": name,
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1) if seconds else None,
+        "requests": server.requests,
+        "errors": server.errors,
+        "throttled": server.throttled,
+        "page_latency_p50": _round(percentile(server.latencies, 50)),
+        "page_latency_p99": _round(percentile(server.latencies, 99)),
+        "write_seconds": round(timed.write_seconds, 3),
+        "writes": timed.writes,
+    }
+
+
+def load_results(path: str) -> List[Dict]:
+    """Results of earlier runs, oldest first"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_result(path: str, result: Dict, config: Dict) -> Dict:
+    """Record a result with the commit and settings it was measured with"""
+    entry = {
+        "commit": git_commit(),
+        "measuredAt": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": config,
+        **result,
+    }
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def previous_result(results: List[Dict], entry: Dict) -> Optional[Dict]:
+    """Latest earlier result of the same entity measured with the same settings"""
+    for result in reversed(results):
+        if result["entity"] == entry["entity"] and result["config"] == entry["config"]:
+            return result
+    return None
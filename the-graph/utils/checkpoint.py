@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+from typing import Any, Optional
+from utils.storage import StorageCollection
+
+# Collection, next to the synced ones, holding the cursors of unfinished runs
+CHECKPOINT_COLLECTION = "_sync_checkpoints"
+
+
+def _checkpoint_id(collection: StorageCollection, name: str) -> str:
+    return f"{collection.name}:{name}"
+
+
+def load_checkpoint(collection: StorageCollection, name: str) -> Optional[Any]:
+    """Get the cursor an interrupted run of `name` stopped at, if any"""
+    checkpoint = collection.sibling(CHECKPOINT_COLLECTION).find_one(
+        {"id": _checkpoint_id(collection, name)}
+    )
+    return checkpoint["cursor"] if checkpoint else None
+
+
+def save_checkpoint(collection: StorageCollection, name: str, cursor: Any) -> None:
+    """Record the cursor of the last batch written by a run"""
+    collection.sibling(CHECKPOINT_COLLECTION).store_batch(
+        [
+            {
+                "id": _checkpoint_id(collection, name),
+                "cursor": cursor,
+                "updatedAt": datetime.now(timezone.utc),
+            }
+        ],
+        mode="upsert",
+    )
+
+
+def clear_checkpoint(collection: StorageCollection, name: str) -> None:
+    """Forget the cursor once a run has completed"""
+    collection.sibling(CHECKPOINT_COLLECTION).delete_many(
+        {"id": _checkpoint_id(collection, name)}
+    )
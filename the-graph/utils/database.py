@@ -1,53 +1,114 @@
-import os
-from typing import List, Dict
-from pymongo import MongoClient, UpdateOne
-from dotenv import load_dotenv
-from contextlib import contextmanager
-
-def get_database_connection():
-    """
-    Create and return a MongoDB connection using environment variables
-    """
-    load_dotenv()
-    
-    mongo_uri = os.getenv('MONGO_URI')
-    if not mongo_uri:
-        raise ValueError("MONGO_URI not found in environment variables")
-    
-    return MongoClient(mongo_uri)
-
-@contextmanager
-def database_connection(db_name: str, collection_name: str):
-    """
-    Context manager for database connections
-    Args:
-        db_name: Name of the database
-        collection_name: Name of the collection
-    """
-    client = get_database_connection()
-    try:
-        yield client[db_name][collection_name]
-    finally:
-        client.close()
-
-def store_batch_to_mongodb(collection, batch_data: List[Dict]) -> None:
-    """
-    Store a batch of records in MongoDB using bulk operations
-    """
-    try:
-        operations = []
-        for record in batch_data:
-            operations.append(
-                UpdateOne(
-                    {'id': record['id']},  # Using 'id' as the unique identifier
-                    {'$set': record},
-                    upsert=True
-                )
-            )
-        
-        if operations:
-            result = collection.bulk_write(operations, ordered=False)
-            print(f"Successfully stored batch of {len(batch_data)} records")
-            print(f"Inserted: {result.upserted_count}, Modified: {result.modified_count}")
-    except Exception as e:
-        print(f"Error storing batch in MongoDB: {str(e)}")
+import os
+import json
+import hashlib
+from typing import List, Dict
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+from contextlib import contextmanager
+
+# Server error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+def get_database_connection():
+    """
+    Create and return a MongoDB connection using environment variables
+    """
+    load_dotenv()
+    
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        raise ValueError("MONGO_URI not found in environment variables")
+    
+    return MongoClient(mongo_uri)
+
+@contextmanager
+def database_connection(db_name: str, collection_name: str):
+    """
+    Context manager for database connections
+    Args:
+        db_name: Name of the database
+        collection_name: Name of the collection
+    """
+    client = get_database_connection()
+    try:
+        yield client[db_name][collection_name]
+    finally:
+        client.close()
+
+def content_hash(record: Dict) -> str:
+    """Stable hash of a record's content, ignoring Mongo bookkeeping fields"""
+    content = {k: v for k, v in record.items() if k not in ("_id", "_hash")}
+    encoded = json.dumps(content, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()
+
+def store_batch_to_mongodb(
+    collection, batch_data: List[Dict], mode: str = "upsert"
+) -> Dict[str, int]:
+    """
+    Store a batch of records in MongoDB using bulk operations
+    Args:
+        collection: MongoDB collection to write to
+        batch_data: Records keyed by their 'id' field
+        mode: 'upsert' rewrites every record,
+              'insert' blind-inserts immutable records and skips those already stored,
+              'hash' only rewrites records whose content hash changed
+    Returns the number of inserted, updated and unchanged records. Write
+    failures (other than duplicates in 'insert' mode) are raised, so callers
+    never record progress past records that were not stored.
+    """
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not batch_data:
+        return counts
+
+    if mode == "insert":
+        try:
+            result = collection.insert_many(
+                [dict(record) for record in batch_data], ordered=False
+            )
+            counts["inserted"] = len(result.inserted_ids)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in write_errors):
+                raise
+            counts["inserted"] = e.details["nInserted"]
+            counts["unchanged"] = len(write_errors)
+        return counts
+
+    if mode == "hash":
+        hashes = {record['id']: content_hash(record) for record in batch_data}
+        stored = {
+            doc['id']: doc.get('_hash')
+            for doc in collection.find(
+                {'id': {'$in': list(hashes)}}, {'id': 1, '_hash': 1}
+            )
+        }
+        changed = [r for r in batch_data if stored.get(r['id']) != hashes[r['id']]]
+        counts["unchanged"] = len(batch_data) - len(changed)
+        operations = [
+            UpdateOne(
+                {'id': record['id']},
+                {'$set': {**record, '_hash': hashes[record['id']]}},
+                upsert=True
+            )
+            for record in changed
+        ]
+    else:
+        operations = [
+            UpdateOne(
+                {'id': record['id']},  # Using 'id' as the unique identifier
+                {'$set': record},
+                upsert=True
+            )
+            for record in batch_data
+        ]
+
+    if operations:
+        result = collection.bulk_write(operations, ordered=False)
+        counts["inserted"] += result.upserted_count
+        counts["updated"] += result.modified_count
+        counts["unchanged"] += (
+            len(operations) - result.upserted_count - result.modified_count
+        )
+
+    return counts
@@ -0,0 +1,48 @@
+from typing import Dict, List
+
+
+class SubgraphError(Exception):
+    """A subgraph query failed (as opposed to returning no more data)"""
+
+
+class TransientSubgraphError(SubgraphError):
+    """A failure worth retrying: throttling, gateway/indexer overload, network"""
+
+
+class PermanentSubgraphError(SubgraphError):
+    """A failure retrying cannot fix, such as an invalid query"""
+
+
+# Statuses of a failed request that are worth retrying
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# GraphQL error messages reported by overloaded or lagging indexers
+TRANSIENT_ERROR_MESSAGES = (
+    "timeout",
+    "timed out",
+    "too many",
+    "unavailable",
+    "overloaded",
+    "bad indexers",
+    "indexing",
+    "connection",
+)
+
+
+def classify_status(status_code: int, text: str) -> SubgraphError:
+    """Build the error matching a non-200 response"""
+    message = f"HTTP {status_code}: {text[:200]}"
+    if status_code in TRANSIENT_STATUS_CODES:
+        return TransientSubgraphError(message)
+    return PermanentSubgraphError(message)
+
+
+def classify_graphql_errors(errors: List[Dict]) -> SubgraphError:
+    """
+    Build the error matching the `errors` of a response that has no data, or
+    null selections
+    """
+    message = "; ".join(str(error.get("message", error)) for error in errors)
+    if any(text in message.lower() for text in TRANSIENT_ERROR_MESSAGES):
+        return TransientSubgraphError(message)
+    return PermanentSubgraphError(message)
@@ -0,0 +1,182 @@
+import logging
+import os
+import sys
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, TextIO
+from bson import json_util
+from utils.pagination import (
+    get_high_water_mark,
+    get_timestamp_high_water_mark,
+    iter_pages,
+    iter_timestamp_pages,
+)
+from utils.pipeline import run_pipeline, write_batch
+from utils.registry import ENTITIES, EntitySpec
+from utils.storage import StorageCollection, open_storage
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two polls of the subgraph head once caught up
+POLL_INTERVAL = float(os.getenv("FOLLOW_POLL_INTERVAL", "5"))
+
+# Called with the entity name and the normalized records of every write
+Consumer = Callable[[str, List[Dict]], None]
+
+
+def is_followable(spec: EntitySpec) -> bool:
+    """
+    Whether new rows of an entity can be picked up from a cursor. Entities
+    re-scanned from the start (hash-keyed state) have to be synced instead.
+    """
+    return spec.cursor == "timestamp" or spec.resume
+
+
+def json_lines_consumer(stream: TextIO = sys.stdout) -> Consumer:
+    """Consumer writing each record as one JSON line (Extended JSON numbers)"""
+    lock = threading.Lock()
+
+    def consume(name: str, records: List[Dict]) -> None:
+        lines = "".join(
+            json_util.dumps({"entity": name, "record": record}) + "\n"
+            for record in records
+        )
+        with lock:
+            stream.write(lines)
+            stream.flush()
+
+    return consume
+
+
+def follow_entity(
+    name: str,
+    collection: StorageCollection,
+    api_key: str,
+    interval: float = POLL_INTERVAL,
+    consumers: Sequence[Consumer] = (),
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """
+    Keep a collection at the subgraph head until `stop` is set. The cursor is
+    read from the collection once and then kept in memory: every poll fetches
+    the rows after it, writes them and hands them to the consumers. The
+    cursor only moves once a batch is written: after a failed write the next
+    poll fetches the same rows again.
+    Returns the number of records written.
+    Args:
+        name: Registered entity name (see utils.registry)
+        interval: Seconds to wait between polls once caught up
+        consumers: Callables receiving (name, records) after each write
+    """
+    spec = ENTITIES[name]
+    if not is_followable(spec):
+        raise ValueError(
+            f"{name} is re-scanned from the start and cannot be followed"
+        )
+
+    stop = stop or threading.Event()
+    if spec.indexes:
+        collection.create_indexes(spec.indexes)
+
+    if spec.cursor == "timestamp":
+        cursor = get_timestamp_high_water_mark(collection) or (0, "")
+    else:
+        cursor = get_high_water_mark(collection, spec.cursor) or ""
+    logger.info("Following", extra={"entity": name, "cursor": cursor})
+
+    schema = spec.schema
+    total_written = 0
+
+    def write(batch: List[Dict]) -> None:
+        nonlocal cursor, total_written
+        # Raises when the write fails, before the cursor moves past the batch
+        records, _ = write_batch(
+            collection, spec.entity, batch, spec.write_mode, schema
+        )
+
+        last = batch[-1]
+        if spec.cursor == "timestamp":
+            cursor = (int(last["timestamp"]), last["id"])
+        else:
+            cursor = last[spec.cursor]
+        total_written += len(batch)
+
+        for consumer in consumers:
+            try:
+                consumer(name, records)
+            except Exception as e:
+                logger.exception("Error in consumer", extra={"entity": name})
+
+    while not stop.is_set():
+        if spec.cursor == "timestamp":
+            pages = iter_timestamp_pages(
+                spec.entity,
+                spec.fields,
+                spec.subgraph_url,
+                api_key,
+                start=cursor[0],
+                start_id=cursor[1],
+            )
+        else:
+            pages = iter_pages(
+                spec.entity,
+                spec.fields,
+                spec.subgraph_url,
+                api_key,
+                cursor_field=spec.cursor,
+                start=cursor,
+            )
+
+        try:
+            fetched = run_pipeline(pages, write)
+        except Exception as e:
+            # The cursor only moves past written rows, the next poll retries
+            logger.exception("Error following", extra={"entity": name})
+            fetched = 0
+
+        if fetched:
+            logger.info(
+                "New records",
+                extra={"entity": name, "fetched": fetched, "total": total_written},
+            )
+        stop.wait(interval)
+
+    return total_written
+
+
+def follow_entities(
+    names: List[str],
+    api_key: str,
+    interval: float = POLL_INTERVAL,
+    consumers: Sequence[Consumer] = (),
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """
+    Follow several registered entities in this process until interrupted.
+    All entities share one storage backend and the HTTP connection pool.
+    """
+    stop = stop or threading.Event()
+    storage = open_storage()
+    threads = []
+    try:
+        for name in names:
+            spec = ENTITIES[name]
+            collection = storage.collection(spec.db_name, spec.collection_name)
+            thread = threading.Thread(
+                target=follow_entity,
+                args=(name, collection, api_key, interval, consumers, stop),
+                name=f"follow-{name}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+    except KeyboardInterrupt:
+        logger.info("Stopping, waiting for in-flight writes")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        storage.close()
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from utils.errors import SubgraphError
+
+# Status codes with which the gateway rejects a key (invalid, unpaid, out of quota)
+KEY_REJECTED_STATUS_CODES = {401, 402, 403}
+# Error messages with which the gateway rejects a key in a 200 response
+KEY_REJECTED_MESSAGES = ("auth error", "payment required", "quota", "billing")
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayExhaustedError(SubgraphError):
+    """Every API key of the pool is out of budget or rejected by the gateway"""
+
+
+@dataclass
+class GatewayEndpoint:
+    """
+    One API key on one gateway
+    Args:
+        gateway: Base URL (scheme and host) replacing the host of subgraph
+            URLs, or None to keep the host of each URL
+        api_key: Key formatted into the subgraph URL template
+        key_name: Name of the key in logs, so the key itself is never printed
+    """
+
+    gateway: Optional[str]
+    api_key: str
+    key_name: str
+    failures: int = 0
+    available_at: float = 0.0
+
+    @property
+    def label(self) -> str:
+        """Short name used in logs and for the endpoint's rate limiter"""
+        host = urlparse(self.gateway).netloc if self.gateway else "gateway"
+        return f"{host}/{self.key_name}"
+
+    def url_for(self, subgraph_url: str) -> str:
+        """Format a subgraph URL template for this gateway and key"""
+        if self.gateway:
+            base = urlparse(self.gateway)
+            subgraph_url = (
+                urlparse(subgraph_url)
+                ._replace(scheme=base.scheme, netloc=base.netloc)
+                .geturl()
+            )
+        return subgraph_url.format(self.api_key)
+
+
+def is_key_rejected(result: Dict) -> bool:
+    """Whether a 200 response reports an error about the key rather than the query"""
+    for error in result.get("errors") or []:
+        message = str(error.get("message", error)).lower()
+        if any(text in message for text in KEY_REJECTED_MESSAGES):
+            return True
+    return False
+
+
+class GatewayPool:
+    """
+    Pool of API keys across one or more gateways. Requests are spread round
+    robin over the endpoints that are available. An endpoint that fails or
+    throttles is benched for an exponentially growing cooldown; a key that
+    runs out of budget or is rejected by the gateway is retired for good.
+    When every key is retired, acquire() raises GatewayExhaustedError so the
+    caller can tell "out of quota" apart from "no more data".
+    Args:
+        endpoints: Endpoints to spread requests over
+        budget: Maximum number of requests per key in this process (None for
+            no limit)
+        base_cooldown: Seconds an endpoint is benched after its first failure
+        max_cooldown: Upper bound of the cooldown
+    """
+
+    def __init__(
+        self,
+        endpoints: List[GatewayEndpoint],
+        budget: Optional[int] = None,
+        base_cooldown: float = 1.0,
+        max_cooldown: float = 60.0,
+    ):
+        if not endpoints:
+            raise ValueError("A gateway pool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.budget = budget
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._used: Dict[str, int] = {}
+        self._retired: Dict[str, str] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.endpoints)
+
+    def acquire(self) -> GatewayEndpoint:
+        """Pick the next available endpoint, waiting out cooldowns if needed"""
+        while True:
+            with self._lock:
+                candidates = [
+                    e for e in self.endpoints if e.api_key not in self._retired
+                ]
+                if not candidates:
+                    reasons = "; ".join(sorted(set(self._retired.values())))
+                    raise GatewayExhaustedError(f"All API keys exhausted ({reasons})")
+
+                now = time.monotonic()
+                for offset in range(len(self.endpoints)):
+                    endpoint = self.endpoints[(self._next + offset) % self.size]
+                    if (
+                        endpoint.api_key not in self._retired
+                        and endpoint.available_at <= now
+                    ):
+                        self._next = (self._next + offset + 1) % self.size
+                        self._charge(endpoint.api_key)
+                        return endpoint
+
+                wait = min(e.available_at for e in candidates) - now
+            time.sleep(max(wait, 0.0))
+
+    def _charge(self, api_key: str) -> None:
+        used = self._used.get(api_key, 0) + 1
+        self._used[api_key] = used
+        if self.budget is not None and used >= self.budget:
+            self._retired[api_key] = f"budget of {self.budget} requests used"
+
+    def record_success(self, endpoint: GatewayEndpoint) -> None:
+        with self._lock:
+            endpoint.failures = 0
+
+    def record_failure(self, endpoint: GatewayEndpoint) -> None:
+        """Bench an endpoint that errored, timed out or throttled"""
+        with self._lock:
+            endpoint.failures += 1
+            cooldown = min(
+                self.max_cooldown, self.base_cooldown * 2 ** (endpoint.failures - 1)
+            )
+            endpoint.available_at = time.monotonic() + cooldown
+        logger.warning(
+            "Gateway endpoint benched",
+            extra={"provider": endpoint.label, "cooldown": round(cooldown)},
+        )
+
+    def record_rejected(self, endpoint: GatewayEndpoint, reason: str) -> None:
+        """Retire a key the gateway refuses (invalid, unpaid or out of quota)"""
+        with self._lock:
+            self._retired[endpoint.api_key] = reason
+        logger.warning(
+            "API key retired", extra={"provider": endpoint.label, "reason": reason}
+        )
+
+    def is_exhausted(self) -> bool:
+        with self._lock:
+            return all(e.api_key in self._retired for e in self.endpoints)
+
+    def usage(self) -> Dict[str, int]:
+        """Number of requests sent with each key, by key name"""
+        with self._lock:
+            return {e.key_name: self._used.get(e.api_key, 0) for e in self.endpoints}
+
+
+def build_gateway_pool(api_key: Optional[str] = None) -> GatewayPool:
+    """
+    Build a pool from the environment: API_KEYS (comma separated, defaults to
+    api_key), GATEWAY_URLS (comma separated gateway base URLs, defaults to the
+    host of each subgraph URL) and API_KEY_BUDGET (requests per key)
+    """
+    keys = [k.strip() for k in os.getenv("API_KEYS", "").split(",") if k.strip()]
+    if api_key and api_key not in keys:
+        keys.insert(0, api_key)
+    gateways = [
+        g.strip() for g in os.getenv("GATEWAY_URLS", "").split(",") if g.strip()
+    ] or [None]
+    budget = os.getenv("API_KEY_BUDGET")
+
+    endpoints = []
+    for gateway in gateways:
+        for index, key in enumerate(keys):
+            endpoints.append(GatewayEndpoint(gateway, key, f"key{index}"))
+    return GatewayPool(endpoints, budget=int(budget) if budget else None)
+
+
+_pool: Optional[GatewayPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_gateway_pool(api_key: Optional[str] = None) -> GatewayPool:
+    """
+    Return the process-wide gateway pool, building it on first use. Every
+    query shares the pool, so the api_key of later calls is not used.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = build_gateway_pool(api_key)
+        return _pool
@@ -0,0 +1,150 @@
+import logging
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.backfill import backfill_by_timestamp
+from utils.batching import sync_batched
+from utils.pagination import sync_entity, sync_timestamp_entity
+from utils.registry import ENTITIES, EntitySpec
+from utils.storage import Storage, StorageCollection, open_storage
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_entity(
+    spec: EntitySpec,
+    collection: StorageCollection,
+    api_key: str,
+    shards: int = 1,
+    start: Optional[int] = None,
+) -> int:
+    """
+    Create the entity's indexes and fetch it into the collection with the
+    pagination its cursor calls for. Returns the number of records processed.
+    Args:
+        shards: Number of timestamp windows to backfill concurrently
+        start: Timestamp to start a sharded backfill from
+    """
+    if spec.indexes:
+        collection.create_indexes(spec.indexes)
+
+    if spec.cursor == "timestamp":
+        if shards > 1:
+            return backfill_by_timestamp(
+                collection,
+                spec.entity,
+                spec.fields,
+                spec.subgraph_url,
+                api_key,
+                shards=shards,
+                start=start,
+                write_mode=spec.write_mode,
+                schema=spec.schema,
+            )
+        return sync_timestamp_entity(
+            collection,
+            spec.entity,
+            spec.fields,
+            spec.subgraph_url,
+            api_key,
+            write_mode=spec.write_mode,
+            schema=spec.schema,
+        )
+
+    return sync_entity(
+        collection,
+        spec.entity,
+        spec.fields,
+        spec.subgraph_url,
+        api_key,
+        cursor_field=spec.cursor,
+        resume=spec.resume,
+        write_mode=spec.write_mode,
+        schema=spec.schema,
+    )
+
+
+def group_by_subgraph(names: List[str], shards: int = 1) -> List[List[str]]:
+    """
+    Group entities that can share requests: entities of one subgraph are
+    fetched together, except timestamp entities backfilled in shards
+    """
+    groups: List[List[str]] = []
+    by_subgraph: Dict[str, List[str]] = {}
+    for name in names:
+        spec = ENTITIES[name]
+        if shards > 1 and spec.cursor == "timestamp":
+            groups.append([name])
+        else:
+            by_subgraph.setdefault(spec.subgraph_url, []).append(name)
+    return groups + list(by_subgraph.values())
+
+
+def ingest_group(
+    names: List[str], storage: Storage, api_key: str, shards: int = 1
+) -> Dict[str, int]:
+    """Ingest one entity on its own, or several sharing batched requests"""
+    collections = {}
+    for name in names:
+        spec = ENTITIES[name]
+        collections[name] = storage.collection(spec.db_name, spec.collection_name)
+
+    if len(names) == 1:
+        name = names[0]
+        return {
+            name: ingest_entity(
+                ENTITIES[name], collections[name], api_key, shards=shards
+            )
+        }
+
+    for name in names:
+        if ENTITIES[name].indexes:
+            collections[name].create_indexes(ENTITIES[name].indexes)
+    return sync_batched(names, collections, api_key)
+
+
+def ingest_entities(
+    names: List[str], api_key: str, shards: int = 1, batch: bool = True
+) -> Dict[str, Optional[int]]:
+    """
+    Ingest several registered entities concurrently in this process.
+    All entities share one storage backend and the HTTP connection pool.
+    Returns the number of records processed per entity (None if it failed).
+    Args:
+        batch: Fetch entities that share a subgraph with one request per page
+            step instead of one request per entity
+    """
+    if batch:
+        groups = group_by_subgraph(names, shards)
+    else:
+        groups = [[name] for name in names]
+
+    storage = open_storage()
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            futures = {}
+            for group in groups:
+                future = executor.submit(
+                    ingest_group, group, storage, api_key, shards=shards
+                )
+                futures[future] = group
+
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    counts = {name: None for name in group}
+                    logger.exception(
+                        "Error ingesting", extra={"entities": ", ".join(group)}
+                    )
+                for name, count in counts.items():
+                    results[name] = count
+                    if count is not None:
+                        logger.info(
+                            "Completed", extra={"entity": name, "processed": count}
+                        )
+    finally:
+        storage.close()
+
+    return results
@@ -0,0 +1,212 @@
+import atexit
+import bisect
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Seconds between two dumps of the metrics file
+DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "15"))
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Distribution of observed values per label set, in cumulative buckets"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: count per bucket (plus +Inf), sum and count
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(
+                key, [[0] * (len(self.buckets) + 1), 0.0, 0]
+            )
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    labels = _labels(self.labelnames, key, le=bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        metric = Counter(name, help, tuple(labelnames))
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames=()) -> Histogram:
+        metric = Histogram(name, help, tuple(labelnames))
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Stages a page goes through: HTTP fetch, JSON decode, transform, bulk write
+STAGE_SECONDS = REGISTRY.histogram(
+    "ingest_stage_seconds",
+    "Seconds spent in each pipeline stage",
+    ("stage", "entity", "provider"),
+)
+STAGE_ROWS = REGISTRY.counter(
+    "ingest_stage_rows_total",
+    "Rows through each pipeline stage",
+    ("stage", "entity", "provider"),
+)
+REQUESTS = REGISTRY.counter(
+    "ingest_requests_total",
+    "Upstream requests by outcome (HTTP status or 'error')",
+    ("entity", "provider", "status"),
+)
+
+
+@contextmanager
+def timed_stage(
+    stage: str, entity: str = "", provider: str = "", rows: int = 0
+) -> Iterator[None]:
+    """Time a pipeline stage and count the rows it handled"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(
+            time.perf_counter() - started,
+            stage=stage,
+            entity=entity,
+            provider=provider,
+        )
+        if rows:
+            STAGE_ROWS.inc(rows, stage=stage, entity=entity, provider=provider)
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve the metrics for Prometheus to scrape at http://host:port/metrics"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Serving metrics", extra={"port": server.server_address[1]})
+    return server
+
+
+def dump_metrics(path: str) -> None:
+    """Write the metrics to a file, replacing it atomically"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+def export_metrics(port: Optional[int] = None, path: Optional[str] = None) -> None:
+    """
+    Expose the metrics of this process
+    Args:
+        port: Serve them over HTTP on this port, defaults to METRICS_PORT
+        path: Dump them to this file every METRICS_DUMP_INTERVAL seconds and
+            on exit, defaults to METRICS_FILE
+    """
+    port = port if port is not None else os.getenv("METRICS_PORT")
+    path = path or os.getenv("METRICS_FILE")
+    if port:
+        start_metrics_server(int(port))
+    if path:
+
+        def dump_periodically() -> None:
+            while True:
+                time.sleep(DUMP_INTERVAL)
+                dump_metrics(path)
+
+        threading.Thread(target=dump_periodically, daemon=True).start()
+        atexit.register(dump_metrics, path)
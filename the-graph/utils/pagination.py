@@ -0,0 +1,303 @@
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from utils.checkpoint import clear_checkpoint, load_checkpoint, save_checkpoint
+from utils.pipeline import store_pages
+from utils.schema import DocumentSchema
+from utils.storage import StorageCollection
+from utils.subgraph_query import query_subgraph, selection_rows
+
+PAGE_SIZE = 1000
+# Upper bound for an open-ended timestamp range (GraphQL Int is 32-bit)
+MAX_TIMESTAMP = 2**31 - 1
+# Checkpoint name of the cursor of an unfinished keyset sync
+SYNC_CHECKPOINT = "sync"
+
+logger = logging.getLogger(__name__)
+
+
+def keyset_selection(
+    entity: str,
+    fields: str,
+    cursor_field: str = "id",
+    variable: str = "cursor",
+    page_size: int = PAGE_SIZE,
+    alias: Optional[str] = None,
+) -> str:
+    """
+    Build the selection of one page of an entity by `<cursor_field>_gt`
+    Args:
+        variable: Name of the query variable holding the cursor
+        alias: Response key for the selection, needed when several
+            selections share one document
+    """
+    name = f"{alias}: {entity}" if alias else entity
+    return f"""{name}(
+            first: {page_size},
+            orderBy: {cursor_field},
+            orderDirection: asc,
+            where: {{ {cursor_field}_gt: ${variable} }}
+        ) {{
+            {fields.strip()}
+        }}"""
+
+
+def build_keyset_query(
+    entity: str,
+    fields: str,
+    cursor_field: str = "id",
+    cursor_type: str = "String",
+    page_size: int = PAGE_SIZE,
+) -> str:
+    """
+    Build a GraphQL query that pages through an entity by `<cursor_field>_gt`
+    Args:
+        entity: Name of the entity collection in the subgraph (e.g. 'conditions')
+        fields: GraphQL selection set for a single entity
+        cursor_field: Unique, monotonic field used as the cursor
+        cursor_type: GraphQL type of the cursor variable
+    """
+    selection = keyset_selection(entity, fields, cursor_field, page_size=page_size)
+    return f"""
+    query Page($cursor: {cursor_type}!) {{
+        {selection}
+    }}
+"""
+
+
+def get_high_water_mark(
+    collection: StorageCollection, cursor_field: str = "id"
+) -> Optional[Any]:
+    """Get the highest cursor value already stored in the collection"""
+    last_record = collection.find_one(
+        sort=[(cursor_field, -1)], projection={cursor_field: 1}
+    )
+    return last_record[cursor_field] if last_record else None
+
+
+def iter_pages(
+    entity: str,
+    fields: str,
+    subgraph_url: str,
+    api_key: str,
+    cursor_field: str = "id",
+    cursor_type: str = "String",
+    start: Any = "",
+    page_size: int = PAGE_SIZE,
+) -> Iterator[List[Dict]]:
+    """
+    Yield pages of an entity in cursor order, starting after `start`.
+    Each page costs the same on the server regardless of how deep it is.
+    """
+    query = build_keyset_query(entity, fields, cursor_field, cursor_type, page_size)
+    cursor = start
+
+    while True:
+        result = query_subgraph(
+            query=query,
+            variables={"cursor": cursor},
+            subgraph_url=subgraph_url,
+            api_key=api_key,
+        )
+
+        page = selection_rows(result, entity)
+        if not page:
+            return
+        yield page
+
+        if len(page) < page_size:  # Less than max results means we're done
+            return
+
+        cursor = page[-1][cursor_field]
+
+
+def sync_entity(
+    collection: StorageCollection,
+    entity: str,
+    fields: str,
+    subgraph_url: str,
+    api_key: str,
+    cursor_field: str = "id",
+    cursor_type: str = "String",
+    resume: bool = True,
+    write_mode: str = "upsert",
+    schema: Optional[DocumentSchema] = None,
+) -> int:
+    """
+    Fetch every record after the collection's high-water mark and store it,
+    overlapping page fetches with bulk writes. The cursor of every stored
+    batch is checkpointed, so a run that fails resumes where it stopped
+    instead of re-scanning.
+    Returns the number of records processed.
+    Args:
+        resume: Start after the stored high-water mark instead of re-scanning
+        write_mode: Write mode passed to StorageCollection.store_batch
+        schema: Normalization applied before writing (see utils.schema)
+    """
+    start = load_checkpoint(collection, SYNC_CHECKPOINT)
+    if start is not None:
+        logger.info(
+            "Resuming interrupted run",
+            extra={"entity": entity, "cursor_field": cursor_field, "cursor": start},
+        )
+    elif resume:
+        start = get_high_water_mark(collection, cursor_field)
+        if start is not None:
+            logger.info(
+                "Resuming",
+                extra={"entity": entity, "cursor_field": cursor_field, "cursor": start},
+            )
+    if start is None:
+        start = "" if cursor_type == "String" else 0
+
+    pages = iter_pages(
+        entity,
+        fields,
+        subgraph_url,
+        api_key,
+        cursor_field=cursor_field,
+        cursor_type=cursor_type,
+        start=start,
+    )
+    total_processed = store_pages(
+        collection,
+        entity,
+        pages,
+        write_mode,
+        schema,
+        on_write=lambda batch: save_checkpoint(
+            collection, SYNC_CHECKPOINT, batch[-1][cursor_field]
+        ),
+    )
+    clear_checkpoint(collection, SYNC_CHECKPOINT)
+    return total_processed
+
+
+def timestamp_selection(
+    entity: str,
+    fields: str,
+    prefix: str = "",
+    page_size: int = PAGE_SIZE,
+    alias: Optional[str] = None,
+) -> str:
+    """
+    Build the selection of one page of an entity on the compound
+    (timestamp, id) key, reading `$<prefix>timestamp`, `$<prefix>id` and
+    `$<prefix>timestampEnd`
+    """
+    name = f"{alias}: {entity}" if alias else entity
+    return f"""{name}(
+            first: {page_size},
+            orderBy: timestamp,
+            orderDirection: asc,
+            where: {{
+                or: [
+                    {{ timestamp: ${prefix}timestamp, id_gt: ${prefix}id }},
+                    {{
+                        timestamp_gt: ${prefix}timestamp,
+                        timestamp_lt: ${prefix}timestampEnd
+                    }}
+                ]
+            }}
+        ) {{
+            {fields.strip()}
+        }}"""
+
+
+def build_timestamp_query(entity: str, fields: str, page_size: int = PAGE_SIZE) -> str:
+    """
+    Build a GraphQL query that pages through an entity on the compound
+    (timestamp, id) key. graph-node breaks ties on `orderBy` by id, so rows
+    sharing the boundary timestamp are resumed by id instead of re-fetched.
+    The entity's fields must include `id` and `timestamp`.
+    """
+    selection = timestamp_selection(entity, fields, page_size=page_size)
+    return f"""
+    query Page($timestamp: Int!, $id: String!, $timestampEnd: Int!) {{
+        {selection}
+    }}
+"""
+
+
+def get_timestamp_high_water_mark(
+    collection: StorageCollection,
+) -> Optional[Tuple[int, str]]:
+    """Get the highest (timestamp, id) pair already stored in the collection"""
+    last_record = collection.find_one(
+        sort=[("timestamp", -1), ("id", -1)], projection={"timestamp": 1, "id": 1}
+    )
+    if not last_record:
+        return None
+    return int(last_record["timestamp"]), last_record["id"]
+
+
+def iter_timestamp_pages(
+    entity: str,
+    fields: str,
+    subgraph_url: str,
+    api_key: str,
+    start: int = 0,
+    start_id: str = "",
+    end: int = MAX_TIMESTAMP,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[List[Dict]]:
+    """
+    Yield pages of an entity in (timestamp, id) order, strictly after
+    (start, start_id) and before `end`. Every row is downloaded exactly once,
+    even when more than a page of rows share one timestamp.
+    """
+    query = build_timestamp_query(entity, fields, page_size)
+    last_timestamp, last_id = start, start_id
+
+    while True:
+        result = query_subgraph(
+            query=query,
+            variables={
+                "timestamp": last_timestamp,
+                "id": last_id,
+                "timestampEnd": end,
+            },
+            subgraph_url=subgraph_url,
+            api_key=api_key,
+        )
+
+        page = selection_rows(result, entity)
+        if not page:
+            return
+        yield page
+
+        if len(page) < page_size:  # Less than max results means we're done
+            return
+
+        last_timestamp, last_id = int(page[-1]["timestamp"]), page[-1]["id"]
+
+
+def sync_timestamp_entity(
+    collection: StorageCollection,
+    entity: str,
+    fields: str,
+    subgraph_url: str,
+    api_key: str,
+    write_mode: str = "upsert",
+    schema: Optional[DocumentSchema] = None,
+) -> int:
+    """
+    Fetch every record after the collection's (timestamp, id) high-water mark
+    and store it, overlapping page fetches with bulk writes.
+    Returns the number of records processed.
+    Args:
+        write_mode: Write mode passed to StorageCollection.store_batch
+        schema: Normalization applied before writing (see utils.schema)
+    """
+    start, start_id = 0, ""
+    high_water_mark = get_timestamp_high_water_mark(collection)
+    if high_water_mark:
+        start, start_id = high_water_mark
+        logger.info(
+            "Resuming",
+            extra={"entity": entity, "timestamp": start, "id": start_id},
+        )
+
+    pages = iter_timestamp_pages(
+        entity, fields, subgraph_url, api_key, start=start, start_id=start_id
+    )
+    return store_pages(collection, entity, pages, write_mode, schema)
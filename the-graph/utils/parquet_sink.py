@@ -0,0 +1,326 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Any, Callable, Dict, List, Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from bson.decimal128 import Decimal128
+from utils.metrics import timed_stage
+from utils.pagination import iter_pages, iter_timestamp_pages
+from utils.pipeline import run_pipeline
+from utils.registry import ENTITIES, EntitySpec
+from utils.schema import DocumentSchema, convert_batch
+
+# Rows per row group; each row group carries min/max statistics per column
+ROW_GROUP_SIZE = 100_000
+# Files a day partition may collect (e.g. from the live tail) before compaction
+MAX_FILES_PER_PARTITION = 32
+# Subgraph BigDecimals are stored with 18 fractional digits
+DECIMAL_TYPE = pa.decimal128(38, 18)
+DECIMAL_QUANTUM = Decimal(1).scaleb(-18)
+
+PARTITION_COLUMN = "day"
+PARTITIONING = ds.partitioning(
+    pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"
+)
+
+logger = logging.getLogger(__name__)
+
+ARROW_TYPES = {
+    "int64": pa.int64(),
+    "micro_usdc": pa.int64(),
+    "decimal": DECIMAL_TYPE,
+}
+
+
+def selected_fields(spec: EntitySpec) -> List[str]:
+    """Top-level field names of an entity's GraphQL selection set"""
+    names, depth = [], 0
+    for token in re.findall(r"\w+|[{}]", spec.fields):
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+        elif depth == 0:
+            names.append(token)
+    return names
+
+
+def arrow_schema(spec: EntitySpec) -> pa.Schema:
+    """
+    Typed Arrow schema of an entity as it is stored: numeric fields use their
+    declared type, references and other fields are strings
+    """
+    columns = []
+    for name in selected_fields(spec):
+        arrow_type = ARROW_TYPES.get(spec.numeric_fields.get(name), pa.string())
+        if name in spec.list_fields:
+            arrow_type = pa.list_(arrow_type)
+        columns.append(pa.field(name, arrow_type))
+    return pa.schema(columns)
+
+
+def _to_int(value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    return int(value)
+
+
+def _to_decimal(value: Any) -> Optional[Decimal]:
+    if value is None:
+        return None
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    return Decimal(str(value)).quantize(DECIMAL_QUANTUM, rounding=ROUND_HALF_EVEN)
+
+
+def _to_string(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _converter(arrow_type: pa.DataType) -> Callable[[Any], Any]:
+    if pa.types.is_list(arrow_type):
+        convert = _converter(arrow_type.value_type)
+        return lambda value: None if value is None else [convert(v) for v in value]
+    if pa.types.is_integer(arrow_type):
+        return _to_int
+    if pa.types.is_decimal(arrow_type):
+        return _to_decimal
+    return _to_string
+
+
+def day_of(timestamp: Any) -> str:
+    """Day partition (UTC) of a unix timestamp"""
+    return datetime.fromtimestamp(_to_int(timestamp), timezone.utc).strftime(
+        "%Y-%m-%d"
+    )
+
+
+def read_entity(
+    root: str,
+    name: str,
+    filter: Optional[ds.Expression] = None,
+    columns: Optional[List[str]] = None,
+) -> pa.Table:
+    """
+    Read an entity written by ParquetSink. The filter is pushed down: day
+    partitions are pruned from their directory names and row groups from
+    their min/max statistics, so only matching data is decoded.
+    Example: read_entity(root, "enrichedOrderFilleds",
+        filter=(ds.field("day") >= "2024-01-01") & (ds.field("market") == m))
+    """
+    dataset = ds.dataset(
+        os.path.join(root, name), format="parquet", partitioning=PARTITIONING
+    )
+    return dataset.to_table(filter=filter, columns=columns)
+
+
+class ParquetSink:
+    """
+    Appends one entity's records to Parquet files under <root>/<name>.
+    Entities with a timestamp are partitioned by day (`day=YYYY-MM-DD/`).
+    Records are buffered per partition and written as a new file on flush,
+    so the sink can be appended to by the live cursor; partitions that
+    collect too many small files are compacted into one.
+    Args:
+        root: Directory holding one sub-directory per entity
+        name: Registered entity name (see utils.registry)
+        path: Write to this directory instead of <root>/<name>
+    """
+
+    def __init__(
+        self,
+        root: str,
+        name: str,
+        path: Optional[str] = None,
+        row_group_size: int = ROW_GROUP_SIZE,
+    ):
+        self.spec = ENTITIES[name]
+        self.path = path or os.path.join(root, name)
+        self.row_group_size = row_group_size
+        self.schema = arrow_schema(self.spec)
+        self.partitioned = "timestamp" in self.schema.names
+
+        self._flatten = DocumentSchema(references=self.spec.references)
+        self._converters = {
+            field.name: _converter(field.type) for field in self.schema
+        }
+        self._buffers: Dict[Optional[str], List[Dict]] = {}
+        self._buffered = 0
+        self._lock = threading.Lock()
+
+    def write(self, records: List[Dict]) -> None:
+        """Buffer records (raw or normalized), flushing full row groups"""
+        with timed_stage("transform", self.spec.entity, rows=len(records)):
+            records = convert_batch(records, self._flatten)
+        with self._lock:
+            for record in records:
+                day = day_of(record["timestamp"]) if self.partitioned else None
+                self._buffers.setdefault(day, []).append(record)
+            self._buffered += len(records)
+            if self._buffered >= self.row_group_size:
+                self._flush()
+
+    def flush(self) -> None:
+        """Write every buffered record to a new file in its partition"""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        self.flush()
+
+    def _partition_path(self, day: Optional[str]) -> str:
+        if day is None:
+            return self.path
+        return os.path.join(self.path, f"{PARTITION_COLUMN}={day}")
+
+    def _to_table(self, records: List[Dict]) -> pa.Table:
+        columns = {
+            name: [convert(record.get(name)) for record in records]
+            for name, convert in self._converters.items()
+        }
+        return pa.Table.from_pydict(columns, schema=self.schema)
+
+    def _flush(self) -> None:
+        for day, records in self._buffers.items():
+            directory = self._partition_path(day)
+            os.makedirs(directory, exist_ok=True)
+            with timed_stage("write", self.spec.entity, rows=len(records)):
+                table = self._to_table(records)
+                pq.write_table(
+                    table,
+                    os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet"),
+                    row_group_size=self.row_group_size,
+                    compression="zstd",
+                )
+            self._compact(directory)
+        self._buffers = {}
+        self._buffered = 0
+
+    def _compact(self, directory: str) -> None:
+        files = sorted(
+            os.path.join(directory, f)
+            for f in os.listdir(directory)
+            if f.endswith(".parquet")
+        )
+        if len(files) <= MAX_FILES_PER_PARTITION:
+            return
+
+        table = pa.concat_tables(pq.read_table(f, schema=self.schema) for f in files)
+        if self.partitioned:
+            table = table.sort_by([("timestamp", "ascending"), ("id", "ascending")])
+        target = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+        pq.write_table(
+            table,
+            f"{target}.tmp",
+            row_group_size=self.row_group_size,
+            compression="zstd",
+        )
+        os.replace(f"{target}.tmp", target)
+        for f in files:
+            os.remove(f)
+
+    def high_water_mark(self) -> Optional[Any]:
+        """
+        Cursor of the last stored record: (timestamp, id) for timestamp
+        entities, the cursor field otherwise. Only the latest day is scanned.
+        """
+        if not os.path.isdir(self.path):
+            return None
+
+        if self.spec.cursor != "timestamp":
+            table = read_entity(
+                os.path.dirname(self.path),
+                os.path.basename(self.path),
+                columns=[self.spec.cursor],
+            )
+            return pc.max(table[self.spec.cursor]).as_py()
+
+        days = sorted(
+            d for d in os.listdir(self.path) if d.startswith(f"{PARTITION_COLUMN}=")
+        )
+        if not days:
+            return None
+        table = pq.read_table(
+            os.path.join(self.path, days[-1]), columns=["timestamp", "id"]
+        )
+        timestamp = pc.max(table["timestamp"]).as_py()
+        last = table.filter(pc.equal(table["timestamp"], timestamp))
+        return timestamp, pc.max(last["id"]).as_py()
+
+
+def sync_to_parquet(root: str, name: str, api_key: str) -> int:
+    """
+    Fetch an entity into Parquet instead of MongoDB. Entities with a cursor
+    are appended to from the last stored record. Hash-keyed state entities
+    are rewritten as a snapshot that replaces the previous one when complete.
+    Returns the number of records written.
+    """
+    spec = ENTITIES[name]
+    target = os.path.join(root, name)
+    snapshot = spec.cursor != "timestamp" and not spec.resume
+    if snapshot:
+        path = f"{target}.partial"
+        shutil.rmtree(path, ignore_errors=True)
+        sink = ParquetSink(root, name, path=path)
+    else:
+        sink = ParquetSink(root, name)
+
+    cursor = None if snapshot else sink.high_water_mark()
+    if cursor is not None:
+        logger.info("Resuming Parquet", extra={"entity": name, "cursor": cursor})
+
+    if spec.cursor == "timestamp":
+        start, start_id = cursor or (0, "")
+        pages = iter_timestamp_pages(
+            spec.entity,
+            spec.fields,
+            spec.subgraph_url,
+            api_key,
+            start=start,
+            start_id=start_id,
+        )
+    else:
+        pages = iter_pages(
+            spec.entity,
+            spec.fields,
+            spec.subgraph_url,
+            api_key,
+            cursor_field=spec.cursor,
+            start=cursor or "",
+        )
+
+    total_written = run_pipeline(pages, sink.write)
+    sink.close()
+
+    if snapshot:
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(sink.path, target)
+    logger.info(
+        "Written to Parquet", extra={"entity": name, "processed": total_written}
+    )
+    return total_written
+
+
+def parquet_consumer(root: str) -> Callable[[str, List[Dict]], None]:
+    """Follow-mode consumer appending every written batch to Parquet"""
+    sinks: Dict[str, ParquetSink] = {}
+    lock = threading.Lock()
+
+    def consume(name: str, records: List[Dict]) -> None:
+        with lock:
+            if name not in sinks:
+                sinks[name] = ParquetSink(root, name)
+        sinks[name].write(records)
+        sinks[name].flush()
+
+    return consume
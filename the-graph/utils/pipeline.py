@@ -0,0 +1,128 @@
+import logging
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from utils.metrics import timed_stage
+from utils.schema import DocumentSchema, convert_batch
+from utils.storage import StorageCollection
+
+# Pages fetched ahead of the writer before the fetcher blocks
+MAX_PENDING_PAGES = 4
+# Records coalesced into a single bulk write when the writer falls behind
+MAX_WRITE_BATCH = 5000
+
+_DONE = object()
+
+logger = logging.getLogger(__name__)
+
+
+def run_pipeline(
+    pages: Iterable[List[Dict]],
+    write: Callable[[List[Dict]], None],
+    max_pending: int = MAX_PENDING_PAGES,
+    max_write_batch: int = MAX_WRITE_BATCH,
+) -> int:
+    """
+    Consume `pages` in the calling thread while a writer thread stores them,
+    so fetching the next page overlaps with writing the previous one.
+    The queue between the stages is bounded: when the writer falls behind the
+    fetcher blocks instead of buffering pages in memory. Pages that queue up
+    are coalesced into one write of up to `max_write_batch` records.
+    Returns the number of records fetched. Re-raises the first write error.
+    """
+    pending: queue.Queue = queue.Queue(maxsize=max_pending)
+    errors: List[Exception] = []
+
+    def writer() -> None:
+        done = False
+        while not done:
+            batch = pending.get()
+            if batch is _DONE:
+                return
+            batch = list(batch)
+            while len(batch) < max_write_batch:
+                try:
+                    page = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if page is _DONE:
+                    done = True
+                    break
+                batch.extend(page)
+            if errors:
+                continue  # Keep draining so the fetcher never blocks forever
+            try:
+                write(batch)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+
+    total_fetched = 0
+    try:
+        for page in pages:
+            if errors:
+                break
+            pending.put(page)
+            total_fetched += len(page)
+    finally:
+        pending.put(_DONE)
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return total_fetched
+
+
+def write_batch(
+    collection: StorageCollection,
+    entity: str,
+    batch: List[Dict],
+    write_mode: str = "upsert",
+    schema: Optional[DocumentSchema] = None,
+) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Normalize a fetched batch and bulk write it, timing both stages.
+    Returns the written records and the counts of the write.
+    """
+    with timed_stage("transform", entity, rows=len(batch)):
+        records = convert_batch(batch, schema)
+    with timed_stage("write", entity, rows=len(records)):
+        counts = collection.store_batch(records, mode=write_mode)
+    return records, counts
+
+
+def store_pages(
+    collection: StorageCollection,
+    entity: str,
+    pages: Iterable[List[Dict]],
+    write_mode: str = "upsert",
+    schema: Optional[DocumentSchema] = None,
+    on_write: Optional[Callable[[List[Dict]], None]] = None,
+) -> int:
+    """
+    Store pages into the collection through a fetch/write pipeline.
+    Returns the number of records processed.
+    Args:
+        write_mode: Write mode passed to StorageCollection.store_batch
+        schema: Normalization applied before writing (see utils.schema)
+        on_write: Called with each batch (as fetched) once it is stored
+    """
+    total_processed = 0
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0}
+
+    def write(batch: List[Dict]) -> None:
+        nonlocal total_processed
+        _, counts = write_batch(collection, entity, batch, write_mode, schema)
+        total_processed += len(batch)
+        for key, value in counts.items():
+            totals[key] += value
+        if on_write:
+            on_write(batch)
+        logger.info(
+            "Stored batch",
+            extra={"entity": entity, "processed": total_processed, **totals},
+        )
+
+    return run_pipeline(pages, write)
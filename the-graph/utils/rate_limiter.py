@@ -0,0 +1,122 @@
+import asyncio
+import time
+import threading
+from typing import Dict, Optional
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts to the upstream (AIMD).
+    The rate grows additively while responses are healthy and is cut
+    multiplicatively on throttling (HTTP 429 / overload) or rising latency.
+    Args:
+        rate: Initial number of requests per second
+        min_rate: Lowest rate the limiter backs off to
+        max_rate: Highest rate the limiter ramps up to
+        increase_step: Requests per second added after each healthy response
+        decrease_factor: Multiplier applied to the rate when throttled
+        latency_factor: A response slower than this multiple of the baseline
+            latency counts as pressure
+        cooldown: Minimum seconds between two rate decreases, so one burst of
+            failing in-flight requests only backs off once
+    """
+
+    def __init__(
+        self,
+        rate: float = 20.0,
+        min_rate: float = 0.5,
+        max_rate: float = 200.0,
+        increase_step: float = 0.2,
+        decrease_factor: float = 0.5,
+        latency_factor: float = 3.0,
+        cooldown: float = 1.0,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._baseline_latency: Optional[float] = None
+
+    def _refill(self, now: float) -> None:
+        capacity = max(1.0, self.rate)  # Allow bursts of up to one second
+        self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate * factor)
+        self._tokens = min(self._tokens, 1.0)
+        self._last_decrease = now
+
+    def _take(self) -> float:
+        """Take a token if one is available, else return the seconds to wait"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        """Block until a request may be sent"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """acquire() for asyncio code, waiting without blocking the event loop"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def record_success(self, latency: float) -> None:
+        """Report a healthy response and how long it took (seconds)"""
+        with self._lock:
+            baseline = self._baseline_latency
+            if baseline is not None and latency > self.latency_factor * baseline:
+                # Slow but successful: back off gently and keep the baseline
+                self._decrease(0.9)
+                return
+
+            self._baseline_latency = (
+                latency if baseline is None else 0.9 * baseline + 0.1 * latency
+            )
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def record_throttle(self) -> None:
+        """Report an HTTP 429 or an overloaded upstream"""
+        with self._lock:
+            self._decrease(self.decrease_factor)
+
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, **kwargs) -> AdaptiveRateLimiter:
+    """
+    Return the process-wide limiter for an upstream, creating it on first use
+    Args:
+        name: Upstream identifier (e.g. gateway host or RPC endpoint)
+        kwargs: AdaptiveRateLimiter settings used when the limiter is created
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveRateLimiter(**kwargs)
+        return _limiters[name]
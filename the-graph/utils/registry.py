@@ -0,0 +1,320 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from pymongo import ASCENDING, IndexModel
+from utils.schema import DocumentSchema
+
+# The Graph API endpoints
+ORDERBOOK_SUBGRAPH_URL = "https://gateway.thegraph.com/api/{}/subgraphs/id/81Dm16JjuFSrqz813HysXoUPvzTwE7fsfPk2RTf66nyC"
+ACTIVITY_SUBGRAPH_URL = "https://gateway.thegraph.com/api/{}/subgraphs/id/Bx1W4S7kDVxs9gC3s2G6DS8kdNBJNVhMviCtin2DiBp"
+
+# Database names
+ORDERBOOK_DB_NAME = "the-graph-polymarket-orderbook"
+ACTIVITY_DB_NAME = "the-graph-polymarket-activity"
+
+
+def id_index() -> IndexModel:
+    return IndexModel([("id", ASCENDING)], unique=True)
+
+
+def timestamp_id_index() -> IndexModel:
+    return IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)])
+
+
+def reference_timestamp_index(reference: str) -> IndexModel:
+    """Index for "events of these markets/conditions in a time range" queries"""
+    return IndexModel([(reference, ASCENDING), ("timestamp", ASCENDING)])
+
+
+@dataclass(frozen=True)
+class EntitySpec:
+    """
+    Declaration of a subgraph entity and where it is stored
+    Args:
+        entity: Name of the entity collection in the subgraph
+        fields: GraphQL selection set fetched for each record
+        subgraph_url: Gateway URL template, formatted with the API key
+        db_name: Target MongoDB database
+        collection_name: Target MongoDB collection
+        cursor: 'timestamp' for (timestamp, id) pagination, 'id' for keyset on id
+        resume: Resume an 'id' cursor from the stored high-water mark. Entities
+            keyed by hashes get new IDs anywhere in the key space, so they are
+            re-scanned from the start instead.
+        write_mode: How pages are written (see store_batch_to_mongodb): 'insert'
+            for immutable events, 'hash' for entities updated in place
+        numeric_fields: Field name -> 'int64', 'decimal' or 'micro_usdc'; these
+            subgraph BigInt/BigDecimal strings are stored as BSON numbers
+        references: Fields selected as `{ id }` that are stored as the bare id
+        list_fields: Fields holding lists (of numbers or references), for
+            typed columnar schemas
+        dropped_fields: Fields earlier versions stored but nothing reads; they
+            are no longer fetched and the migration removes them
+        indexes: Indexes created on the target collection
+    """
+
+    entity: str
+    fields: str
+    subgraph_url: str
+    db_name: str
+    collection_name: str
+    cursor: str = "id"
+    resume: bool = True
+    write_mode: str = "upsert"
+    numeric_fields: Dict[str, str] = field(default_factory=dict)
+    references: Tuple[str, ...] = ()
+    list_fields: Tuple[str, ...] = ()
+    dropped_fields: Tuple[str, ...] = ()
+    indexes: List[IndexModel] = field(default_factory=lambda: [id_index()])
+
+    @property
+    def schema(self) -> DocumentSchema:
+        return DocumentSchema(self.numeric_fields, self.references)
+
+
+CONDITIONS_FIELDS = """
+    resolutionTimestamp
+    resolutionHash
+    questionId
+    payouts
+    payoutNumerators
+    payoutDenominator
+    outcomeSlotCount
+    oracle
+    id
+    fixedProductMarketMakers {
+        id
+    }
+"""
+
+# USDC amounts are BigInts in 6-decimal base units, i.e. already micro-USDC
+CONDITIONS_NUMERIC_FIELDS = {
+    "resolutionTimestamp": "int64",
+    "outcomeSlotCount": "int64",
+    "payoutNumerators": "int64",
+    "payoutDenominator": "int64",
+    "payouts": "decimal",
+}
+
+CONDITIONS_LIST_FIELDS = ("payouts", "payoutNumerators", "fixedProductMarketMakers")
+
+ENTITIES: Dict[str, EntitySpec] = {
+    "accounts": EntitySpec(
+        entity="accounts",
+        fields="""
+            id
+            creationTimestamp
+            lastSeenTimestamp
+            collateralVolume
+            scaledCollateralVolume
+            profit
+            numTrades
+            lastTradedTimestamp
+            fpmmPoolMemberships {
+                id
+            }
+            scaledProfit
+        """,
+        subgraph_url=ORDERBOOK_SUBGRAPH_URL,
+        db_name=ORDERBOOK_DB_NAME,
+        collection_name="accounts",
+        resume=False,
+        write_mode="hash",
+        numeric_fields={
+            "creationTimestamp": "int64",
+            "lastSeenTimestamp": "int64",
+            "lastTradedTimestamp": "int64",
+            "numTrades": "int64",
+            "collateralVolume": "int64",
+            "profit": "int64",
+            "scaledCollateralVolume": "decimal",
+            "scaledProfit": "decimal",
+        },
+        references=("fpmmPoolMemberships",),
+        list_fields=("fpmmPoolMemberships",),
+    ),
+    "conditions": EntitySpec(
+        entity="conditions",
+        fields=CONDITIONS_FIELDS,
+        subgraph_url=ORDERBOOK_SUBGRAPH_URL,
+        db_name=ORDERBOOK_DB_NAME,
+        collection_name="conditions",
+        resume=False,
+        write_mode="hash",
+        numeric_fields=CONDITIONS_NUMERIC_FIELDS,
+        references=("fixedProductMarketMakers",),
+        list_fields=CONDITIONS_LIST_FIELDS,
+    ),
+    "conditions-new": EntitySpec(
+        entity="conditions",
+        fields=CONDITIONS_FIELDS,
+        subgraph_url=ORDERBOOK_SUBGRAPH_URL,
+        db_name=ORDERBOOK_DB_NAME,
+        collection_name="conditions-new",
+        resume=False,
+        write_mode="hash",
+        numeric_fields=CONDITIONS_NUMERIC_FIELDS,
+        references=("fixedProductMarketMakers",),
+        list_fields=CONDITIONS_LIST_FIELDS,
+    ),
+    "enrichedOrderFilleds": EntitySpec(
+        entity="enrichedOrderFilleds",
+        fields="""
+            transactionHash
+            timestamp
+            size
+            side
+            price
+            id
+            market {
+                id
+            }
+            maker {
+                id
+            }
+            taker {
+                id
+            }
+        """,
+        subgraph_url=ORDERBOOK_SUBGRAPH_URL,
+        db_name=ORDERBOOK_DB_NAME,
+        collection_name="enrichedOrderFills_new",
+        cursor="timestamp",
+        write_mode="insert",
+        numeric_fields={"timestamp": "int64", "size": "int64", "price": "decimal"},
+        references=("market", "maker", "taker"),
+        # The id is "<transactionHash>_<orderHash>"
+        dropped_fields=("orderHash",),
+        indexes=[
+            id_index(),
+            timestamp_id_index(),
+            reference_timestamp_index("market"),
+        ],
+    ),
+    "merges": EntitySpec(
+        entity="merges",
+        fields="""
+            timestamp
+            stakeholder {
+                id
+            }
+            partition
+            id
+            condition {
+                id
+            }
+            amount
+        """,
+        subgraph_url=ORDERBOOK_SUBGRAPH_URL,
+        db_name=ORDERBOOK_DB_NAME,
+        collection_name="merges",
+        cursor="timestamp",
+        write_mode="insert",
+        numeric_fields={"timestamp": "int64", "amount": "int64", "partition": "int64"},
+        references=("stakeholder", "condition"),
+        list_fields=("partition",),
+        # Always USDC and the root collection for Polymarket positions
+        dropped_fields=("collateralToken", "parentCollectionId"),
+        indexes=[
+            id_index(),
+            timestamp_id_index(),
+            reference_timestamp_index("condition"),
+        ],
+    ),
+    "redemptions": EntitySpec(
+        entity="redemptions",
+        fields="""
+            timestamp
+            payout
+            indexSets
+            id
+            condition {
+                id
+            }
+            redeemer {
+                id
+            }
+        """,
+        subgraph_url=ORDERBOOK_SUBGRAPH_URL,
+        db_name=ORDERBOOK_DB_NAME,
+        collection_name="redemptions",
+        cursor="timestamp",
+        write_mode="insert",
+        numeric_fields={
+            "timestamp": "int64",
+            "payout": "int64",
+            "indexSets": "int64",
+        },
+        references=("condition", "redeemer"),
+        list_fields=("indexSets",),
+        dropped_fields=("parentCollectionId",),
+        indexes=[
+            id_index(),
+            timestamp_id_index(),
+            reference_timestamp_index("condition"),
+        ],
+    ),
+    "splits": EntitySpec(
+        entity="splits",
+        fields="""
+            timestamp
+            partition
+            id
+            amount
+            stakeholder {
+                id
+            }
+            condition {
+                id
+            }
+        """,
+        subgraph_url=ORDERBOOK_SUBGRAPH_URL,
+        db_name=ORDERBOOK_DB_NAME,
+        collection_name="splits",
+        cursor="timestamp",
+        write_mode="insert",
+        numeric_fields={"timestamp": "int64", "amount": "int64", "partition": "int64"},
+        references=("stakeholder", "condition"),
+        list_fields=("partition",),
+        # Always USDC and the root collection for Polymarket positions
+        dropped_fields=("collateralToken", "parentCollectionId"),
+        indexes=[
+            id_index(),
+            timestamp_id_index(),
+            reference_timestamp_index("condition"),
+        ],
+    ),
+    "fpmms": EntitySpec(
+        entity="fixedProductMarketMakers",
+        fields="""
+            id
+        """,
+        subgraph_url=ACTIVITY_SUBGRAPH_URL,
+        db_name=ACTIVITY_DB_NAME,
+        collection_name="fpmms",
+        resume=False,
+        write_mode="hash",
+    ),
+    "negRiskConversions": EntitySpec(
+        entity="negRiskConversions",
+        fields="""
+            timestamp
+            stakeholder
+            questionCount
+            negRiskMarketId
+            indexSet
+            id
+            amount
+        """,
+        subgraph_url=ACTIVITY_SUBGRAPH_URL,
+        db_name=ACTIVITY_DB_NAME,
+        collection_name="negRiskConversions",
+        cursor="timestamp",
+        write_mode="insert",
+        numeric_fields={
+            "timestamp": "int64",
+            "amount": "int64",
+            "indexSet": "int64",
+            "questionCount": "int64",
+        },
+        indexes=[id_index(), timestamp_id_index()],
+    ),
+}
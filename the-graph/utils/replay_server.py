@@ -0,0 +1,325 @@
+import bisect
+import gzip
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from utils.pagination import iter_pages, iter_timestamp_pages
+from utils.registry import ENTITIES
+
+# Block reported by `_meta` queries against the replay server
+REPLAY_BLOCK = 1
+
+logger = logging.getLogger(__name__)
+
+# Top-level collection fields: `[alias:] entity(arguments) {`
+_SELECTION = re.compile(r"(?:(\w+)\s*:\s*)?(\w+)\(([^()]*)\)\s*\{")
+# Filter conditions on a query variable: `field[_op]: $variable`
+_CONDITION = re.compile(r"(\w+?)(?:_(gt|gte|lt|lte|in))?\s*:\s*\$(\w+)")
+# Branches of an `or: [{...}, {...}]` filter
+_OR = re.compile(r"or\s*:\s*\[(.*)\]", re.S)
+_BRANCH = re.compile(r"\{([^{}]*)\}")
+
+Condition = Tuple[str, str, str]
+
+
+def subgraph_id(subgraph_url: str) -> str:
+    """Last path segment of a subgraph URL, naming its recordings directory"""
+    return urlparse(subgraph_url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def recording_path(directory: str, subgraph_url: str, entity: str) -> str:
+    return os.path.join(directory, subgraph_id(subgraph_url), f"{entity}.jsonl.gz")
+
+
+def record_entity(
+    directory: str, name: str, api_key: str, limit: Optional[int] = None
+) -> int:
+    """
+    Record the rows of a registered entity from the live gateway, in cursor
+    order, for the replay server. Returns the number of rows recorded.
+    Args:
+        limit: Stop after this many rows (whole pages)
+    """
+    spec = ENTITIES[name]
+    if spec.cursor == "timestamp":
+        pages = iter_timestamp_pages(
+            spec.entity, spec.fields, spec.subgraph_url, api_key
+        )
+    else:
+        pages = iter_pages(
+            spec.entity,
+            spec.fields,
+            spec.subgraph_url,
+            api_key,
+            cursor_field=spec.cursor,
+        )
+
+    path = recording_path(directory, spec.subgraph_url, spec.entity)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    total_recorded = 0
+    with gzip.open(f"{path}.tmp", "wt") as f:
+        for page in pages:
+            for row in page:
+                f.write(json.dumps(row) + "\n")
+            total_recorded += len(page)
+            logger.info("Recorded", extra={"entity": name, "recorded": total_recorded})
+            if limit and total_recorded >= limit:
+                break
+    os.replace(f"{path}.tmp", path)
+    return total_recorded
+
+
+def load_recording(path: str) -> List[Dict]:
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+def _value(value: Any, like: Any) -> Any:
+    """Coerce a row value to the type of the variable it is compared with"""
+    if isinstance(like, int) and isinstance(value, str):
+        return int(value)
+    if isinstance(value, dict):
+        return value.get("id")
+    return value
+
+
+def _matches(row: Dict, conditions: List[Condition], variables: Dict) -> bool:
+    for field, op, variable in conditions:
+        expected = variables[variable]
+        value = _value(row.get(field), expected)
+        if value is None:
+            matched = expected is None
+        elif op == "in":
+            matched = value in expected
+        elif op == "gt":
+            matched = value > expected
+        elif op == "gte":
+            matched = value >= expected
+        elif op == "lt":
+            matched = value < expected
+        elif op == "lte":
+            matched = value <= expected
+        else:
+            matched = value == expected
+        if not matched:
+            return False
+    return True
+
+
+class RecordedEntity:
+    """
+    Recorded rows of one entity, sorted once per `orderBy` field so a page
+    after a cursor is found by bisection instead of a scan
+    """
+
+    def __init__(self, rows: List[Dict]):
+        self.rows = rows
+        self._orders: Dict[str, Tuple[List[Tuple], List[Dict], bool]] = {}
+        self._lock = threading.Lock()
+
+    def sorted_by(self, field: str) -> Tuple[List[Tuple], List[Dict], bool]:
+        """(field, id) keys and rows in that order, and whether field is numeric"""
+        with self._lock:
+            if field not in self._orders:
+                numeric = field != "id" and all(
+                    str(row.get(field, "")).isdigit() for row in self.rows
+                )
+
+                def key(row: Dict) -> Tuple:
+                    value = row.get(field)
+                    return (int(value) if numeric else value, row["id"])
+
+                rows = sorted(self.rows, key=key)
+                self._orders[field] = ([key(row) for row in rows], rows, numeric)
+            return self._orders[field]
+
+    def select(self, arguments: str, variables: Dict) -> List[Dict]:
+        """Rows answering a collection field with the given arguments"""
+        first = int(re.search(r"first:\s*(\d+)", arguments).group(1))
+        order_by = re.search(r"orderBy:\s*(\w+)", arguments)
+        field = order_by.group(1) if order_by else "id"
+        descending = re.search(r"orderDirection:\s*desc", arguments) is not None
+        keys, rows, numeric = self.sorted_by(field)
+
+        branches: List[List[Condition]] = [[]]
+        common = arguments
+        match = _OR.search(arguments)
+        if match:
+            common = arguments[: match.start()] + arguments[match.end() :]
+            branches = [
+                _CONDITION.findall(branch)
+                for branch in _BRANCH.findall(match.group(1))
+            ]
+        conditions = _CONDITION.findall(common)
+
+        start = 0
+        if not descending:
+            # Skip the rows below every branch's lower bound on the sort key
+            bounds = []
+            for branch in branches:
+                bound = None
+                for name, op, variable in conditions + branch:
+                    if name == field and op in ("", "gt", "gte"):
+                        value = variables[variable]
+                        bound = (int(value) if numeric else value, "")
+                bounds.append(bound)
+            if all(bound is not None for bound in bounds):
+                start = bisect.bisect_left(keys, min(bounds))
+
+        candidates = reversed(rows) if descending else rows[start:]
+        page = []
+        for row in candidates:
+            if _matches(row, conditions, variables) and any(
+                _matches(row, branch, variables) for branch in branches
+            ):
+                page.append(row)
+                if len(page) == first:
+                    break
+        return page
+
+
+class ReplayServer:
+    """
+    Local stand-in for the Graph gateway answering the queries the ingesters
+    send from recorded rows. Latency, errors and rate limits are injected so
+    throughput can be measured under realistic conditions.
+    Args:
+        directory: Recordings, one `<subgraph id>/<entity>.jsonl.gz` per entity
+        latency: Seconds added to every response
+        jitter: Maximum random seconds added on top of the latency
+        error_rate: Fraction of requests answered with HTTP 502
+        rate_limit: Requests per second served before answering HTTP 429
+            (None for no limit)
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: Optional[float] = None,
+    ):
+        self.directory = directory
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._entities: Dict[Tuple[str, str], RecordedEntity] = {}
+        self._lock = threading.Lock()
+        self._tokens = rate_limit or 0.0
+        self._refilled_at = time.monotonic()
+        self.reset_stats()
+
+        handler = self._handler()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "ReplayServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.latencies: List[float] = []
+            self.requests = 0
+            self.errors = 0
+            self.throttled = 0
+
+    def entity(self, subgraph: str, entity: str) -> RecordedEntity:
+        with self._lock:
+            if (subgraph, entity) not in self._entities:
+                path = os.path.join(self.directory, subgraph, f"{entity}.jsonl.gz")
+                rows = load_recording(path) if os.path.exists(path) else []
+                self._entities[(subgraph, entity)] = RecordedEntity(rows)
+            return self._entities[(subgraph, entity)]
+
+    def _admit(self) -> bool:
+        """Take a token from the rate limit bucket, False if it is empty"""
+        if self.rate_limit is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.rate_limit,
+                self._tokens + (now - self._refilled_at) * self.rate_limit,
+            )
+            self._refilled_at = now
+            if self._tokens < 1:
+                self.throttled += 1
+                return False
+            self._tokens -= 1
+            return True
+
+    def answer(self, subgraph: str, query: str, variables: Dict) -> Dict:
+        """Response body of a query against the recordings of a subgraph"""
+        data: Dict[str, Any] = {}
+        if "_meta" in query:
+            data["_meta"] = {"block": {"number": REPLAY_BLOCK}}
+        for alias, entity, arguments in _SELECTION.findall(query):
+            if "first:" not in arguments:
+                continue
+            rows = self.entity(subgraph, entity).select(arguments, variables)
+            data[alias or entity] = rows
+        return {"data": data}
+
+    def _handler(self) -> Callable:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                started = time.monotonic()
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server._lock:
+                    server.requests += 1
+
+                delay = server.latency + random.uniform(0, server.jitter)
+                if delay:
+                    time.sleep(delay)
+                if not server._admit():
+                    self._send(429, {"error": "Too many requests"})
+                    return
+                if random.random() < server.error_rate:
+                    with server._lock:
+                        server.errors += 1
+                    self._send(502, {"error": "Bad gateway"})
+                    return
+
+                response = server.answer(
+                    subgraph_id(self.path),
+                    body["query"],
+                    body.get("variables") or {},
+                )
+                self._send(200, response)
+                with server._lock:
+                    server.latencies.append(time.monotonic() - started)
+
+            def _send(self, status: int, payload: Dict) -> None:
+                encoded = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
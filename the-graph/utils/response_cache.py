@@ -0,0 +1,68 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+
+# Directory holding cached responses of block-pinned queries
+CACHE_DIR = os.getenv("SUBGRAPH_CACHE_DIR", ".subgraph-cache")
+
+# Top-level collection fields, recognised by their `first:` argument
+_COLLECTION_FIELD = re.compile(r"(\w+\()(\s*first:)")
+
+logger = logging.getLogger(__name__)
+
+
+def pin_query(query: str, block: int) -> str:
+    """Pin every collection field of a query to a block (`block: {number: N}`)"""
+    return _COLLECTION_FIELD.sub(rf"\1 block: {{ number: {block} }},\2", query)
+
+
+def cache_key(subgraph_url: str, query: str, variables: Dict) -> str:
+    """
+    Content address of a pinned query. The URL template (not the formatted
+    URL) is hashed, so the key does not depend on the API key in use.
+    """
+    content = json.dumps(
+        {"url": subgraph_url, "query": query, "variables": variables},
+        sort_keys=True,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _cache_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.json.gz")
+
+
+def load_response(key: str, cache_dir: str = CACHE_DIR) -> Optional[Dict]:
+    """Return a cached response, or None if the query was never stored"""
+    try:
+        with gzip.open(_cache_path(key, cache_dir), "rt") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(
+            "Ignoring unreadable cache entry", extra={"key": key, "error": str(e)}
+        )
+        return None
+
+
+def store_response(key: str, response: Dict, cache_dir: str = CACHE_DIR) -> None:
+    """
+    Store a response. The entry is written to a temporary file and renamed,
+    so concurrent readers never see a partial entry.
+    """
+    path = _cache_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with gzip.open(os.fdopen(fd, "wb"), "wt") as f:
+            json.dump(response, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
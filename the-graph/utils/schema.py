@@ -0,0 +1,170 @@
+from dataclasses import dataclass, field
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Any, Dict, List, Optional, Tuple
+from bson.decimal128 import Decimal128
+
+INT64_MAX = 2**63 - 1
+# Significant digits a Decimal128 holds exactly
+DECIMAL128_DIGITS = 34
+USDC_DECIMALS = 6
+
+
+def to_int64(value: Any) -> Any:
+    """
+    Convert a subgraph BigInt (or uint256) to an int64, falling back to
+    Decimal128 when it does not fit and to a string when neither holds it exactly
+    """
+    if value is None:
+        return None
+    number = int(value)
+    if abs(number) <= INT64_MAX:
+        return number
+    if len(str(abs(number))) <= DECIMAL128_DIGITS:
+        return Decimal128(str(number))
+    return str(number)
+
+
+def to_decimal(value: Any) -> Optional[Decimal128]:
+    """Convert a subgraph BigDecimal to Decimal128"""
+    if value is None:
+        return None
+    return Decimal128(Decimal(str(value)))
+
+
+def to_micro_usdc(value: Any) -> Optional[int]:
+    """Convert a decimal USDC amount to integer micro-USDC (fixed point, 6 dp)"""
+    if value is None:
+        return None
+    scaled = Decimal(str(value)).scaleb(USDC_DECIMALS)
+    return to_int64(scaled.quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+
+
+CONVERTERS = {
+    "int64": to_int64,
+    "decimal": to_decimal,
+    "micro_usdc": to_micro_usdc,
+}
+
+
+def flatten_reference(value: Any) -> Any:
+    """Replace a nested `{id}` reference (or list of them) with the bare id"""
+    if isinstance(value, dict):
+        return value.get("id")
+    if isinstance(value, list):
+        return [flatten_reference(item) for item in value]
+    return value
+
+
+@dataclass(frozen=True)
+class DocumentSchema:
+    """
+    How subgraph records are normalized before they are stored
+    Args:
+        numeric_fields: Field name -> 'int64', 'decimal' or 'micro_usdc'. List
+            values are converted element by element.
+        references: Fields selected as `{ id }` sub-objects, stored as the
+            referenced id so they can be filtered and indexed directly
+    """
+
+    numeric_fields: Dict[str, str] = field(default_factory=dict)
+    references: Tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.numeric_fields or self.references)
+
+
+def convert_record(record: Dict, schema: DocumentSchema) -> Dict:
+    """Return a copy of a record with references flattened and numbers converted"""
+    converted = dict(record)
+    for name in schema.references:
+        if name in converted:
+            converted[name] = flatten_reference(converted[name])
+    for name, kind in schema.numeric_fields.items():
+        value = converted.get(name)
+        if value is None:
+            continue
+        convert = CONVERTERS[kind]
+        if isinstance(value, list):
+            converted[name] = [convert(item) for item in value]
+        else:
+            converted[name] = convert(value)
+    return converted
+
+
+def convert_batch(batch: List[Dict], schema: Optional[DocumentSchema]) -> List[Dict]:
+    """Normalize every record in a batch"""
+    if not schema:
+        return batch
+    return [convert_record(record, schema) for record in batch]
+
+
+def migration_expression(value: str, kind: str) -> Dict:
+    """Server-side expression converting a string value to its numeric type"""
+    if kind == "int64":
+        # $toLong fails on values outside int64, keep those as Decimal128
+        return {
+            "$convert": {
+                "input": value,
+                "to": "long",
+                "onError": {"$toDecimal": value},
+            }
+        }
+    if kind == "decimal":
+        return {"$toDecimal": value}
+    scaled = {"$multiply": [{"$toDecimal": value}, 10**USDC_DECIMALS]}
+    return {"$toLong": {"$round": [scaled, 0]}}
+
+
+def migration_pipeline(name: str, kind: str) -> List[Dict]:
+    """
+    Build an update pipeline converting a field stored as string (or list of
+    strings) to its numeric type on the server
+    """
+    value = f"${name}"
+    return [
+        {
+            "$set": {
+                name: {
+                    "$cond": [
+                        {"$isArray": value},
+                        {
+                            "$map": {
+                                "input": value,
+                                "as": "item",
+                                "in": migration_expression("$$item", kind),
+                            }
+                        },
+                        migration_expression(value, kind),
+                    ]
+                }
+            }
+        }
+    ]
+
+
+def migration_filter(name: str) -> Dict:
+    """Match documents whose field (or any element of it) is still a string"""
+    return {name: {"$type": "string"}}
+
+
+def reference_pipeline(name: str) -> List[Dict]:
+    """Build an update pipeline replacing nested `{id}` references with the id"""
+    value = f"${name}"
+    return [
+        {
+            "$set": {
+                name: {
+                    "$cond": [
+                        {"$isArray": value},
+                        {"$map": {"input": value, "as": "item", "in": "$$item.id"}},
+                        f"{value}.id",
+                    ]
+                }
+            }
+        }
+    ]
+
+
+def reference_filter(name: str) -> Dict:
+    """Match documents whose reference (or any element of it) is still nested"""
+    return {name: {"$type": "object"}}
@@ -0,0 +1,419 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from bson.decimal128 import Decimal128
+from dotenv import load_dotenv
+from pymongo import IndexModel, MongoClient
+from pymongo.collection import Collection
+from utils.database import content_hash, store_batch_to_mongodb
+
+# Sort order as used by pymongo: [(field, 1 or -1), ...]
+Sort = List[Tuple[str, int]]
+
+# Parameters per SQLite statement stay well below SQLITE_MAX_VARIABLE_NUMBER
+SQLITE_CHUNK_SIZE = 500
+
+_FIELD_NAME = re.compile(r"^[\w.]+$")
+
+
+class StorageCollection(ABC):
+    """
+    A collection of records keyed by their 'id' field. Queries use the
+    MongoDB filter syntax, limited to equality, $in, $nin, $lt, $lte, $gt,
+    $gte, $ne, $exists, $and and $or on scalar fields, so ingest code runs
+    on any backend.
+    """
+
+    name: str
+
+    @abstractmethod
+    def store_batch(self, records: List[Dict], mode: str = "upsert") -> Dict[str, int]:
+        """
+        Bulk write records (see store_batch_to_mongodb for the modes), raising
+        if they could not be stored: checkpoints are saved after it returns
+        """
+
+    @abstractmethod
+    def find(
+        self,
+        query: Optional[Dict] = None,
+        projection: Optional[Dict] = None,
+        sort: Optional[Sort] = None,
+        limit: int = 0,
+    ) -> Iterator[Dict]:
+        """Iterate over matching records"""
+
+    def find_one(
+        self,
+        query: Optional[Dict] = None,
+        projection: Optional[Dict] = None,
+        sort: Optional[Sort] = None,
+    ) -> Optional[Dict]:
+        """First matching record, e.g. the high-water mark with a descending sort"""
+        return next(iter(self.find(query, projection, sort, limit=1)), None)
+
+    @abstractmethod
+    def count_documents(self, query: Dict) -> int:
+        """Number of matching records"""
+
+    @abstractmethod
+    def distinct(self, field: str, query: Optional[Dict] = None) -> List[Any]:
+        """Distinct values of a field among matching records"""
+
+    @abstractmethod
+    def group_sum(
+        self, group_field: str, sum_field: str, query: Optional[Dict] = None
+    ) -> Dict[Any, Any]:
+        """Sum of `sum_field` per value of `group_field` among matching records"""
+
+    @abstractmethod
+    def delete_many(self, query: Dict) -> int:
+        """Delete matching records, returning how many were deleted"""
+
+    @abstractmethod
+    def create_indexes(self, indexes: List[IndexModel]) -> None:
+        """Create the indexes if they do not exist yet"""
+
+    @abstractmethod
+    def sibling(self, name: str) -> "StorageCollection":
+        """Another collection of the same database"""
+
+
+class Storage(ABC):
+    """A storage backend holding databases of collections"""
+
+    @abstractmethod
+    def collection(self, db_name: str, name: str) -> StorageCollection:
+        """Get a collection, creating it on first write"""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Release the backend's connections"""
+
+
+class MongoCollection(StorageCollection):
+    """StorageCollection backed by a MongoDB collection"""
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def store_batch(self, records: List[Dict], mode: str = "upsert") -> Dict[str, int]:
+        return store_batch_to_mongodb(self.collection, records, mode=mode)
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        return self.collection.find(query or {}, projection, sort=sort, limit=limit)
+
+    def count_documents(self, query: Dict) -> int:
+        return self.collection.count_documents(query)
+
+    def distinct(self, field: str, query: Optional[Dict] = None) -> List[Any]:
+        return self.collection.distinct(field, query or {})
+
+    def group_sum(self, group_field, sum_field, query=None):
+        pipeline = [
+            {"$match": query or {}},
+            {"$group": {"_id": f"${group_field}", "total": {"$sum": f"${sum_field}"}}},
+        ]
+        return {doc["_id"]: doc["total"] for doc in self.collection.aggregate(pipeline)}
+
+    def delete_many(self, query: Dict) -> int:
+        return self.collection.delete_many(query).deleted_count
+
+    def create_indexes(self, indexes: List[IndexModel]) -> None:
+        self.collection.create_indexes(indexes)
+
+    def sibling(self, name: str) -> "MongoCollection":
+        return MongoCollection(self.collection.database[name])
+
+
+class MongoStorage(Storage):
+    def __init__(self, uri: str):
+        self.client = MongoClient(uri)
+
+    def collection(self, db_name: str, name: str) -> MongoCollection:
+        return MongoCollection(self.client[db_name][name])
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def _json_default(value: Any) -> Any:
+    # Decimal128 becomes a JSON number so it compares and sums numerically
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode(record: Dict) -> str:
+    record = {k: v for k, v in record.items() if k != "_id"}
+    return json.dumps(record, default=_json_default, sort_keys=True)
+
+
+def _param(value: Any) -> Any:
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_json_default)
+    return value
+
+
+def _field(name: str) -> str:
+    """SQL expression reading a (dotted) field of the stored JSON document"""
+    if not _FIELD_NAME.match(name):
+        raise ValueError(f"Unsupported field name: {name}")
+    return "id" if name == "id" else f"json_extract(doc, '$.{name}')"
+
+
+_OPERATORS = {"$lt": "<", "$lte": "<=", "$gt": ">", "$gte": ">=", "$ne": "IS NOT"}
+
+
+def _where(query: Optional[Dict]) -> Tuple[str, List[Any]]:
+    """Translate a MongoDB filter into a SQL condition and its parameters"""
+    clauses, params = [], []
+    for key, condition in (query or {}).items():
+        if key in ("$and", "$or"):
+            parts = [_where(sub) for sub in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            params.extend(p for _, sub_params in parts for p in sub_params)
+            continue
+
+        column = _field(key)
+        is_operator = (
+            isinstance(condition, dict)
+            and bool(condition)
+            and all(op.startswith("$") for op in condition)
+        )
+        if not is_operator:
+            clauses.append(f"{column} IS ?")
+            params.append(_param(condition))
+            continue
+
+        for op, value in condition.items():
+            if op in ("$in", "$nin"):
+                values = [_param(v) for v in value]
+                if not values:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                negate = "NOT " if op == "$nin" else ""
+                placeholders = ", ".join("?" * len(values))
+                clauses.append(f"{column} {negate}IN ({placeholders})")
+                params.extend(values)
+            elif op == "$exists":
+                clauses.append(f"{column} IS {'NOT ' if value else ''}NULL")
+            elif op in _OPERATORS:
+                clauses.append(f"{column} {_OPERATORS[op]} ?")
+                params.append(_param(value))
+            else:
+                raise ValueError(f"Unsupported query operator: {op}")
+
+    return (" AND ".join(clauses) or "1"), params
+
+
+def _project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    fields = [f for f, include in (projection or {}).items() if include and f != "_id"]
+    if not fields:
+        return doc
+    return {f: doc[f] for f in fields if f in doc}
+
+
+class SQLiteCollection(StorageCollection):
+    """
+    StorageCollection stored in an SQLite table: one row per record with
+    its id, its JSON document and its content hash. Indexes are expression
+    indexes on the document's fields. Decimal128 values are stored as JSON
+    numbers (double precision).
+    """
+
+    def __init__(self, storage: "SQLiteStorage", db_name: str, name: str):
+        self.storage = storage
+        self.db_name = db_name
+        self.name = name
+        self.table = f'"{db_name}.{name}"'
+        with storage.lock:
+            storage.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(id TEXT PRIMARY KEY, doc TEXT NOT NULL, hash TEXT)"
+            )
+
+    def _query(self, sql: str, params: List[Any]) -> List[Tuple]:
+        with self.storage.lock:
+            return self.storage.connection.execute(sql, params).fetchall()
+
+    def store_batch(self, records: List[Dict], mode: str = "upsert") -> Dict[str, int]:
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        if not records:
+            return counts
+
+        # Last write of an id within the batch wins, as with bulk upserts
+        latest = {record["id"]: record for record in records}
+        ids = list(latest)
+        stored = {}
+        for i in range(0, len(ids), SQLITE_CHUNK_SIZE):
+            chunk = ids[i : i + SQLITE_CHUNK_SIZE]
+            rows = self._query(
+                f"SELECT id, doc, hash FROM {self.table} "
+                f"WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            stored.update({row[0]: row[1:] for row in rows})
+
+        rows = []
+        for id_, record in latest.items():
+            doc = _encode(record)
+            digest = content_hash(record) if mode == "hash" else None
+            if id_ in stored:
+                stored_doc, stored_hash = stored[id_]
+                unchanged = (
+                    mode == "insert"
+                    or (mode == "hash" and stored_hash == digest)
+                    or (mode != "hash" and stored_doc == doc)
+                )
+                if unchanged:
+                    counts["unchanged"] += 1
+                    continue
+                counts["updated"] += 1
+            else:
+                counts["inserted"] += 1
+            rows.append((id_, doc, digest))
+        counts["unchanged"] += len(records) - len(latest)
+
+        with self.storage.lock, self.storage.connection:
+            self.storage.connection.executemany(
+                f"INSERT INTO {self.table} (id, doc, hash) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE "
+                "SET doc = excluded.doc, hash = excluded.hash",
+                rows,
+            )
+        return counts
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        where, params = _where(query)
+        sql = f"SELECT doc FROM {self.table} WHERE {where}"
+        if sort:
+            order = ", ".join(
+                f"{_field(f)} {'DESC' if direction < 0 else 'ASC'}"
+                for f, direction in sort
+            )
+            sql += f" ORDER BY {order}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        rows = self._query(sql, params)
+        return (_project(json.loads(row[0]), projection) for row in rows)
+
+    def count_documents(self, query: Dict) -> int:
+        where, params = _where(query)
+        sql = f"SELECT COUNT(*) FROM {self.table} WHERE {where}"
+        return self._query(sql, params)[0][0]
+
+    def distinct(self, field: str, query: Optional[Dict] = None) -> List[Any]:
+        where, params = _where(query)
+        rows = self._query(
+            f"SELECT DISTINCT {_field(field)} FROM {self.table} WHERE {where}", params
+        )
+        return [row[0] for row in rows if row[0] is not None]
+
+    def group_sum(self, group_field, sum_field, query=None):
+        where, params = _where(query)
+        group = _field(group_field)
+        rows = self._query(
+            f"SELECT {group}, SUM({_field(sum_field)}) FROM {self.table} "
+            f"WHERE {where} GROUP BY {group}",
+            params,
+        )
+        return dict(rows)
+
+    def delete_many(self, query: Dict) -> int:
+        where, params = _where(query)
+        with self.storage.lock, self.storage.connection:
+            cursor = self.storage.connection.execute(
+                f"DELETE FROM {self.table} WHERE {where}", params
+            )
+        return cursor.rowcount
+
+    def create_indexes(self, indexes: List[IndexModel]) -> None:
+        for index in indexes:
+            document = index.document
+            keys = list(document["key"].items())
+            if keys == [("id", 1)]:
+                continue  # The primary key
+            columns = ", ".join(
+                f"{_field(f)} {'DESC' if direction == -1 else 'ASC'}"
+                for f, direction in keys
+            )
+            unique = "UNIQUE " if document.get("unique") else ""
+            name = f'"{self.db_name}.{self.name}.{document["name"]}"'
+            with self.storage.lock, self.storage.connection:
+                self.storage.connection.execute(
+                    f"CREATE {unique}INDEX IF NOT EXISTS {name} "
+                    f"ON {self.table} ({columns})"
+                )
+
+    def sibling(self, name: str) -> "SQLiteCollection":
+        return self.storage.collection(self.db_name, name)
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded backend keeping every collection in one SQLite file, so
+    ingestion and analytics run on a single box without a MongoDB server.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+        self._collections: Dict[Tuple[str, str], SQLiteCollection] = {}
+
+    def collection(self, db_name: str, name: str) -> SQLiteCollection:
+        with self.lock:
+            if (db_name, name) not in self._collections:
+                self._collections[(db_name, name)] = SQLiteCollection(
+                    self, db_name, name
+                )
+            return self._collections[(db_name, name)]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def open_storage(uri: Optional[str] = None) -> Storage:
+    """
+    Open the storage backend named by a URI: `mongodb://...` for MongoDB or
+    `sqlite:///path/to/file.db` for the embedded backend. Defaults to
+    STORAGE_URI, then MONGO_URI.
+    """
+    load_dotenv()
+    uri = uri or os.getenv("STORAGE_URI") or os.getenv("MONGO_URI")
+    if not uri:
+        raise ValueError("STORAGE_URI or MONGO_URI not found in environment variables")
+    if uri.startswith("sqlite:///"):
+        return SQLiteStorage(uri[len("sqlite:///") :])
+    if uri.startswith(("mongodb://", "mongodb+srv://")):
+        return MongoStorage(uri)
+    raise ValueError(f"Unsupported storage URI: {uri}")
+
+
+@contextmanager
+def storage_connection(db_name: str, collection_name: str):
+    """
+    Context manager yielding a collection of the configured storage backend
+    Args:
+        db_name: Name of the database
+        collection_name: Name of the collection
+    """
+    storage = open_storage()
+    try:
+        yield storage.collection(db_name, collection_name)
+    finally:
+        storage.close()
@@ -1,44 +1,360 @@
-import os
-import requests
-from typing import Dict, Optional
-from pymongo.collection import Collection
-
-
-def get_last_processed_id(
-    collection: Collection, order_direction: str = "asc", id_field: str = "id"
-) -> Optional[str]:
-    """
-    Get the last processed ID from the database based on sort direction
-    Args:
-        collection: MongoDB collection to query
-        order_direction: Sort direction ('asc' or 'desc')
-        id_field: Name of the field to use as ID (defaults to 'id')
-    """
-    sort_direction = 1 if order_direction == "asc" else -1
-    last_record = collection.find_one(sort=[(id_field, sort_direction)])
-    return last_record[id_field] if last_record else None
-
-
-def query_subgraph(
-    query: str, variables: Dict, subgraph_url: str, api_key: str
-) -> Dict:
-    """
-    Generic function to query The Graph API
-    """
-    formatted_url = subgraph_url.format(api_key)
-
-    try:
-        response = requests.post(
-            formatted_url,
-            headers={"Content-Type": "application/json"},
-            json={"query": query, "variables": variables},
-        )
-
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Error {response.status_code}:", response.text)
-            return None
-    except Exception as e:
-        print(f"Error querying The Graph API: {str(e)}")
-        return None
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+import requests
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Union
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from pymongo.collection import Collection
+from utils.errors import (
+    PermanentSubgraphError,
+    SubgraphError,
+    TransientSubgraphError,
+    classify_graphql_errors,
+    classify_status,
+)
+from utils.gateway_pool import (
+    KEY_REJECTED_STATUS_CODES,
+    get_gateway_pool,
+    is_key_rejected,
+)
+from utils.metrics import REQUESTS, STAGE_ROWS, timed_stage
+from utils.rate_limiter import get_rate_limiter
+from utils.response_cache import (
+    cache_key,
+    load_response,
+    pin_query,
+    store_response,
+)
+
+# Size of the keep-alive connection pool shared by every query to the gateway
+POOL_SIZE = int(os.getenv("SUBGRAPH_POOL_SIZE", "16"))
+# Default number of queries kept in flight by the async variant
+MAX_IN_FLIGHT = int(os.getenv("SUBGRAPH_MAX_IN_FLIGHT", "8"))
+# Responses that mean the gateway wants us to slow down
+THROTTLE_STATUS_CODES = {429, 502, 503, 504}
+# Retries of a transiently failing query, and their backoff bounds (seconds)
+MAX_RETRIES = int(os.getenv("SUBGRAPH_MAX_RETRIES", "6"))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+logger = logging.getLogger(__name__)
+
+# Collection fields a query selects, naming the entity in its metrics
+_QUERY_ENTITY = re.compile(r"(\w+)\(\s*(?:block:\s*\{[^}]*\},\s*)?first:")
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Subgraph URL template -> block every query to that subgraph is pinned to
+_pinned_blocks: Dict[str, int] = {}
+
+HEAD_BLOCK_QUERY = """
+    query Head {
+        _meta {
+            block {
+                number
+            }
+        }
+    }
+"""
+
+
+def get_session() -> requests.Session:
+    """
+    Return the process-wide HTTP session used for subgraph queries.
+    Connections are kept alive and reused across pages, scripts and threads.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(
+                    {
+                        "Content-Type": "application/json",
+                        "Accept-Encoding": "gzip, deflate",
+                    }
+                )
+                _session = session
+    return _session
+
+
+def get_last_processed_id(
+    collection: Collection, order_direction: str = "asc", id_field: str = "id"
+) -> Optional[str]:
+    """
+    Get the last processed ID from the database based on sort direction
+    Args:
+        collection: MongoDB collection to query
+        order_direction: Sort direction ('asc' or 'desc')
+        id_field: Name of the field to use as ID (defaults to 'id')
+    """
+    sort_direction = 1 if order_direction == "asc" else -1
+    last_record = collection.find_one(sort=[(id_field, sort_direction)])
+    return last_record[id_field] if last_record else None
+
+
+def pin_subgraph(subgraph_url: str, block: Optional[int]) -> None:
+    """
+    Pin every following query to a subgraph to one block (None unpins), so all
+    entities of a run read the same chain snapshot and responses are cached
+    """
+    if block is None:
+        _pinned_blocks.pop(subgraph_url, None)
+    else:
+        _pinned_blocks[subgraph_url] = block
+
+
+def get_subgraph_head(subgraph_url: str, api_key: str) -> int:
+    """Get the latest block a subgraph has indexed"""
+    result = query_subgraph(HEAD_BLOCK_QUERY, {}, subgraph_url, api_key)
+    return result["data"]["_meta"]["block"]["number"]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, base * 2**attempt]"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+def query_entity(query: str) -> str:
+    """Entity (or '+'-joined entities of a batch) a query selects"""
+    return "+".join(sorted(set(_QUERY_ENTITY.findall(query)))) or "_meta"
+
+
+def _post_query(query: str, variables: Dict, subgraph_url: str, api_key: str) -> Dict:
+    """
+    Send a query once, failing over across the gateway pool.
+    Raises a TransientSubgraphError or PermanentSubgraphError on failure.
+    """
+    pool = get_gateway_pool(api_key)
+    entity = query_entity(query)
+    error: SubgraphError = TransientSubgraphError("No gateway endpoint answered")
+    # Try each endpoint of the pool at most once per attempt
+    for _ in range(pool.size):
+        endpoint = pool.acquire()  # Raises GatewayExhaustedError
+        formatted_url = endpoint.url_for(subgraph_url)
+        limiter = get_rate_limiter(
+            f"{urlparse(formatted_url).netloc}/{endpoint.key_name}"
+        )
+        labels = {"entity": entity, "provider": endpoint.label}
+
+        try:
+            limiter.acquire()
+            started = time.monotonic()
+            with timed_stage("fetch", **labels):
+                response = get_session().post(
+                    formatted_url,
+                    json={"query": query, "variables": variables},
+                )
+            result = None
+            if response.status_code == 200:
+                with timed_stage("decode", **labels):
+                    result = response.json()
+        except Exception as e:
+            logger.warning(
+                "Error querying The Graph API",
+                extra={**labels, "error": str(e)},
+            )
+            REQUESTS.inc(status="error", **labels)
+            pool.record_failure(endpoint)
+            error = TransientSubgraphError(str(e))
+            continue
+        REQUESTS.inc(status=response.status_code, **labels)
+
+        if result is not None:
+            if is_key_rejected(result):
+                pool.record_rejected(endpoint, str(result["errors"]))
+                continue
+            limiter.record_success(time.monotonic() - started)
+            pool.record_success(endpoint)
+            data = result.get("data") or {}
+            rows = sum(len(v) for v in data.values() if isinstance(v, list))
+            STAGE_ROWS.inc(rows, stage="fetch", **labels)
+            # A selection the subgraph failed to resolve comes back null next
+            # to the others: it must not pass for an empty page
+            if result.get("errors") and (
+                not data or any(value is None for value in data.values())
+            ):
+                raise classify_graphql_errors(result["errors"])
+            return result
+
+        if response.status_code in KEY_REJECTED_STATUS_CODES:
+            pool.record_rejected(endpoint, f"HTTP {response.status_code}")
+            continue
+
+        error = classify_status(response.status_code, response.text)
+        logger.warning(
+            "Error response from The Graph API",
+            extra={**labels, "status": response.status_code},
+        )
+        if isinstance(error, PermanentSubgraphError):
+            raise error
+        if response.status_code in THROTTLE_STATUS_CODES:
+            limiter.record_throttle()
+        pool.record_failure(endpoint)
+
+    raise error
+
+
+def query_subgraph(
+    query: str,
+    variables: Dict,
+    subgraph_url: str,
+    api_key: str,
+    block: Optional[int] = None,
+) -> Dict:
+    """
+    Generic function to query The Graph API. Requests are spread over the
+    gateway pool (see utils.gateway_pool) and fail over to the next endpoint
+    when one throttles or rejects its key. Transient failures are retried
+    with jittered exponential backoff.
+    Failures raise instead of returning None, so they are never mistaken for
+    the end of the data: TransientSubgraphError once the retries are used up,
+    PermanentSubgraphError for invalid queries and GatewayExhaustedError when
+    every key is exhausted (all SubgraphError subclasses, see utils.errors).
+    Args:
+        block: Block to pin the query to, defaults to the block the subgraph
+            is pinned to (see pin_subgraph). Responses of pinned queries are
+            immutable and served from the on-disk cache when present.
+    """
+    if block is None:
+        block = _pinned_blocks.get(subgraph_url)
+    key = None
+    if block is not None and pin_query(query, block) != query:
+        query = pin_query(query, block)
+        key = cache_key(subgraph_url, query, variables)
+        cached = load_response(key)
+        if cached is not None:
+            return cached
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            result = _post_query(query, variables, subgraph_url, api_key)
+        except TransientSubgraphError as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(
+                "Retrying subgraph query",
+                extra={
+                    "error": str(e),
+                    "attempt": attempt + 1,
+                    "max_retries": MAX_RETRIES,
+                    "delay": round(delay, 1),
+                },
+            )
+            time.sleep(delay)
+            continue
+
+        if key and "errors" not in result:
+            store_response(key, result)
+        return result
+
+
+def selection_rows(result: Dict, key: str) -> List[Dict]:
+    """
+    Rows of one top-level selection (entity or alias) of a query result.
+    A missing or null selection raises instead of passing for an empty page.
+    """
+    rows = (result.get("data") or {}).get(key)
+    if rows is None:
+        if result.get("errors"):
+            raise classify_graphql_errors(result["errors"])
+        raise PermanentSubgraphError(f"No {key} in the subgraph response")
+    return rows
+
+
+def query_subgraph_batch(
+    selections: Dict[str, str],
+    variable_types: Dict[str, str],
+    variables: Dict,
+    subgraph_url: str,
+    api_key: str,
+) -> Dict[str, List[Dict]]:
+    """
+    Send several aliased entity selections as one GraphQL document and
+    demultiplex the response. Returns the rows of each selection keyed by
+    its alias. Failures raise as in query_subgraph.
+    Args:
+        selections: Alias -> selection using that alias as its response key
+        variable_types: Variable name -> GraphQL type, for every variable the
+            selections read
+    """
+    declarations = ", ".join(
+        f"${name}: {type_}" for name, type_ in variable_types.items()
+    )
+    body = "\n        ".join(selections.values())
+    query = f"""
+    query Batch({declarations}) {{
+        {body}
+    }}
+"""
+    result = query_subgraph(query, variables, subgraph_url, api_key)
+    return {alias: selection_rows(result, alias) for alias in selections}
+
+
+async def query_subgraph_async(
+    query: str,
+    variables: Dict,
+    subgraph_url: str,
+    api_key: str,
+    block: Optional[int] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    executor: Optional[Executor] = None,
+) -> Dict:
+    """
+    Async variant of query_subgraph running on the shared connection pool
+    Args:
+        block: Block to pin the query to (see query_subgraph)
+        semaphore: Optional semaphore bounding the number of in-flight queries
+        executor: Executor running the blocking query, defaults to the loop's
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(query_subgraph, query, variables, subgraph_url, api_key, block)
+    if semaphore is None:
+        return await loop.run_in_executor(executor, call)
+    async with semaphore:
+        return await loop.run_in_executor(executor, call)
+
+
+def query_subgraph_many(
+    queries: List[Dict], max_in_flight: int = MAX_IN_FLIGHT
+) -> List[Union[Dict, SubgraphError]]:
+    """
+    Run several subgraph queries concurrently, keeping at most max_in_flight
+    requests open at once. Results are returned in the order of the input;
+    a query that failed yields its SubgraphError instead of a result. Any
+    other exception is raised.
+    Args:
+        queries: List of keyword argument dicts accepted by query_subgraph
+        max_in_flight: Maximum number of concurrent requests
+    """
+
+    async def run_all(executor: Executor):
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def run_one(q: Dict) -> Union[Dict, SubgraphError]:
+            try:
+                return await query_subgraph_async(
+                    semaphore=semaphore, executor=executor, **q
+                )
+            except SubgraphError as e:
+                return e
+
+        return await asyncio.gather(*(run_one(q) for q in queries))
+
+    # Executor as wide as the semaphore, scoped to this call
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        return asyncio.run(run_all(executor))